@@ -1,15 +1,4148 @@
+import argparse
+import bisect
+import copy
+import csv
+import gc
+import hashlib
+import heapq
+import html
+import json
+import os
+import re
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import _thread
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from matplotlib.patches import FancyBboxPatch, ConnectionPatch, Circle
+from matplotlib.patches import FancyBboxPatch, ConnectionPatch, Circle, PathPatch, Polygon
 import numpy as np
+import pandas as pd
 import seaborn as sns
 from matplotlib.patches import Rectangle, Arrow
 import matplotlib.gridspec as gridspec
+from matplotlib.collections import Collection, LineCollection, PatchCollection, PathCollection
+from matplotlib.colors import to_hex, to_rgba
+from matplotlib.font_manager import FontProperties, findfont
+from matplotlib.lines import Line2D
+from matplotlib.path import Path
+from matplotlib.text import Text
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+from PIL import GifImagePlugin, Image, features
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Set up the plotting style
 plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
+# TEMPLATE LAYERS
+# Static scaffolding (phone frames, security layers, step circles) is built
+# once per parameter set into a vector fragment: every patch becomes a path in
+# data coordinates and every label becomes a glyph outline. The fragment is
+# cached and composited underneath the dynamic content as two collections, so
+# repeated screens and themed copies only pay for the parts that differ.
+_template_cache = {}
+
+def build_template(draw, params, xlim, ylim):
+    # Let the template draw onto a scratch axes, then harvest its artists
+    scratch = Figure().add_axes([0, 0, 1, 1])
+    scratch.set_xlim(*xlim)
+    scratch.set_ylim(*ylim)
+    draw(scratch, **params)
+
+    fragment = {'paths': [], 'facecolors': [], 'edgecolors': [], 'linewidths': [],
+                'glyphs': [], 'offsets': [], 'glyph_colors': []}
+    for patch in scratch.patches:
+        fragment['paths'].append(patch.get_patch_transform().transform_path(patch.get_path()))
+        fragment['facecolors'].append(patch.get_facecolor())
+        fragment['edgecolors'].append(patch.get_edgecolor())
+        fragment['linewidths'].append(patch.get_linewidth())
+
+    for text in scratch.texts:
+        glyphs = TextPath((0, 0), text.get_text(), size=text.get_fontsize(),
+                          prop=text.get_fontproperties())
+        extents = glyphs.get_extents()
+        dx = {'left': 0, 'center': -(extents.x0 + extents.x1) / 2,
+              'right': -extents.x1}[text.get_horizontalalignment()]
+        dy = {'baseline': 0, 'center': -(extents.y0 + extents.y1) / 2,
+              'center_baseline': -(extents.y0 + extents.y1) / 2,
+              'bottom': -extents.y0, 'top': -extents.y1}[text.get_verticalalignment()]
+        fragment['glyphs'].append(glyphs.transformed(Affine2D().translate(dx, dy)))
+        fragment['offsets'].append(text.get_position())
+        fragment['glyph_colors'].append(to_rgba(text.get_color(), text.get_alpha()))
+
+    return fragment
+
+def draw_template(ax, draw, **params):
+    # Labels become glyph outlines that apply_brand cannot rewrite, so the
+    # brand's text replacements go into the parameters (and the cache key)
+    if RENDER_CONFIG['brand']:
+        params = {name: brand_strings(value, RENDER_CONFIG['brand']['replace']) for name, value in params.items()}
+    xlim = ax.get_xlim()
+    ylim = ax.get_ylim()
+    cache_key = (draw.__name__, tuple(sorted(params.items())), xlim, ylim)
+    if cache_key not in _template_cache:
+        _template_cache[cache_key] = build_template(draw, params, xlim, ylim)
+    fragment = _template_cache[cache_key]
+
+    # Shapes sit in data coordinates underneath everything drawn later
+    if fragment['paths']:
+        ax.add_collection(PathCollection(fragment['paths'],
+                                         facecolors=fragment['facecolors'],
+                                         edgecolors=fragment['edgecolors'],
+                                         linewidths=fragment['linewidths'],
+                                         transform=ax.transData, zorder=1),
+                          autolim=False)
+
+    # Glyph outlines are sized in points and anchored at data positions,
+    # at the same level as ordinary text
+    if fragment['glyphs']:
+        points_to_pixels = Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans
+        ax.add_collection(PathCollection(fragment['glyphs'],
+                                         facecolors=fragment['glyph_colors'],
+                                         edgecolors='none',
+                                         offsets=fragment['offsets'],
+                                         offset_transform=ax.transData,
+                                         transform=points_to_pixels, zorder=3),
+                          autolim=False)
+
+def draw_label_layer(ax, labels, offsets, colors, size=8, weight='bold', zorder=3):
+    # Many short labels as one collection: each distinct label is laid out
+    # once as centred glyph outlines and stamped at every data offset
+    prop = FontProperties(weight=weight)
+    if RENDER_CONFIG['brand']:
+        labels = brand_strings(tuple(labels), RENDER_CONFIG['brand']['replace'])
+    glyphs = []
+    for label in labels:
+        key = ('label', label, size, weight)
+        if key not in _template_cache:
+            path = TextPath((0, 0), label, size=size, prop=prop)
+            extents = path.get_extents()
+            _template_cache[key] = path.transformed(Affine2D().translate(-(extents.x0 + extents.x1) / 2,
+                                                                         -(extents.y0 + extents.y1) / 2))
+        glyphs.append(_template_cache[key])
+    points_to_pixels = Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans
+    ax.add_collection(PathCollection(glyphs, facecolors=colors, edgecolors='none', offsets=offsets,
+                                     offset_transform=ax.transData, transform=points_to_pixels,
+                                     zorder=zorder),
+                      autolim=False)
+
+def draw_phone_template(ax, frame_color, screen_color, header_color, nav_color, nav_items):
+    # Phone frame
+    ax.add_patch(Rectangle((1, 1), 8, 13, facecolor=frame_color, edgecolor=frame_color))
+
+    # Screen
+    ax.add_patch(Rectangle((1.5, 2), 7, 11, facecolor=screen_color, edgecolor='gray'))
+
+    # Header
+    ax.add_patch(Rectangle((1.5, 11.5), 7, 1.5, facecolor=header_color, edgecolor='none'))
+
+    # Navigation bar
+    ax.add_patch(Rectangle((1.5, 2), 7, 0.8, facecolor=nav_color, edgecolor='none'))
+    for i, item in enumerate(nav_items):
+        ax.text(2.5 + i*1.5, 2.4, item, ha='center', va='center',
+               color='white', fontsize=12)
+
+def draw_security_layers_template(ax, layers):
+    for name, rect, color, alpha in layers:
+        ax.add_patch(Rectangle((rect[0], rect[1]), rect[2], rect[3],
+                               facecolor=color, alpha=alpha,
+                               edgecolor='black', linewidth=2))
+        ax.text(rect[0] + 0.1, rect[1] + rect[3] - 0.3,
+                name, fontsize=10, fontweight='bold')
+
+def draw_step_template(ax, color, steps):
+    last_y = min(y for _, y in steps)
+    for label, y in steps:
+        # Step circle
+        ax.add_patch(Circle((1, y), 0.3, facecolor=color, alpha=0.7))
+        ax.text(1, y, label, ha='center', va='center',
+                fontweight='bold', color='white')
+        # Arrow to next step
+        if y > last_y:
+            ax.arrow(1, y-0.4, 0, -0.2, head_width=0.1, head_length=0.1,
+                     fc=color, ec=color)
+
+# RENDER SETTINGS
+# Every create_* function hands its finished figure to save_figure, which
+# applies the active brand and writes the file into the output directory.
+RENDER_CONFIG = {
+    'output_dir': '.',
+    'dpi': 300,
+    'bbox_inches': 'tight',
+    'show': True,
+    'brand': None,
+    'variants': None,
+    'preview': False,
+    'status_history': None,
+    'chat_export': None,
+    'chat_users': None,
+    'chat_participants': None,
+    'fuel_export': None,
+    'rollup_store': None,
+    'filters': {},
+    'tracking_export': None,
+    'bbox': None,
+    'consignments_export': None,
+    'policy_files': None,
+    'schema_files': None,
+    'schema_focus': None,
+    'schema_depth': 2,
+    'migrations': None,
+    'diff_from': None,
+    'report_month': None,
+    'memory_budget': None,  # MB
+    'max_artists': 250_000,
+    'max_pixels': 250,  # megapixels
+    'over_budget': 'downgrade'
+}
+
+def save_figure(fig, filename, keep=False):
+    # keep: fig is a reused template, branded when it was built and left open
+    if RENDER_CONFIG['brand'] and not keep:
+        apply_brand(fig, RENDER_CONFIG['brand'])
+
+    os.makedirs(RENDER_CONFIG['output_dir'], exist_ok=True)
+    path = os.path.join(RENDER_CONFIG['output_dir'], filename)
+    # A reused template keeps its artists, so only its canvas is checked
+    dpi = figure_budget(fig, RENDER_CONFIG['dpi'], count_artists=not keep)
+    fig.savefig(path, dpi=dpi, bbox_inches=RENDER_CONFIG['bbox_inches'])
+    if RENDER_CONFIG['variants']:
+        export_variants(path, RENDER_CONFIG['variants'])
+
+    if keep:
+        return path
+    if RENDER_CONFIG['show']:
+        # Blocks until the window is closed; a no-op on Agg, where the
+        # figure would otherwise stay open for the rest of the run
+        plt.show()
+    plt.close(fig)
+    return path
+
+# RESOURCE BUDGETS
+# Each diagram runs under a governor, so one oversized input degrades or
+# stops that diagram instead of exhausting the build machine:
+#   memory   --memory-budget is the resident set each rendering process
+#            may reach. A watchdog thread reads it ten times a second for
+#            the life of the process and interrupts a diagram that passes
+#            it, once per diagram, which is reported as a MemoryError; the
+#            render buffer is checked against the resident set left before
+#            saving. The data segment is also capped at twice the
+#            budget (RLIMIT_DATA) for a runaway allocation between two
+#            checks. Usage is read from /proc (getrusage where it is
+#            missing) rather than tracemalloc, which slowed data-driven
+#            diagrams several times
+#   pixels   a canvas over --max-pixels is saved at a lower DPI
+#   artists  a figure over --max-artists has the plain lines and patches of
+#            each axes merged into one collection per style, which draws
+#            the same marks with far fewer objects
+# Downgrades are printed; with --over-budget fail the first budget
+# exceeded stops the run with a report instead. What every diagram used is
+# kept in _budget_log.
+MEMORY_CHECK_SECONDS = 0.1
+_budget_log = []
+_budget_current = {}
+_memory_alarm = []  # RSS at which the watchdog fired during the current diagram
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+def process_mb():
+    # (resident set, data segment) from /proc; the data segment is what
+    # RLIMIT_DATA counts. The peak RSS stands in for both where /proc is
+    # missing
+    try:
+        with open('/proc/self/statm') as f:
+            fields = f.read().split()
+        page = os.sysconf('SC_PAGE_SIZE') / 2**20
+        return int(fields[1]) * page, int(fields[5]) * page
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb(), peak_rss_mb()
+
+def memory_watchdog(budget):
+    # Stays armed for later diagrams; governed clears the alarm for each one
+    while True:
+        time.sleep(MEMORY_CHECK_SECONDS)
+        rss = process_mb()[0]
+        if rss > budget and not _memory_alarm:
+            _memory_alarm.append(rss)
+            _thread.interrupt_main()
+
+def apply_memory_budget():
+    # In the main process and in every worker
+    budget = RENDER_CONFIG['memory_budget']
+    if not budget:
+        return
+    # A single-job pool warms the main process a second time
+    if not any(thread.name == 'memory-watchdog' for thread in threading.enumerate()):
+        threading.Thread(target=memory_watchdog, args=(budget,), name='memory-watchdog', daemon=True).start()
+    if resource is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        limit = int(2 * budget * 2**20)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+
+def budget_report(entry, reason):
+    rss, data = process_mb()
+    usage = [f'RSS {rss:,.0f} MB (peak {peak_rss_mb():,.0f} MB)', f'data {data:,.0f} MB']
+    # Artists and canvas are only known once the figure reached save_figure
+    if entry['pixels']:
+        usage.append(f"{entry['artists']:,} artists, {entry['pixels'] / 1e6:,.1f} MP canvas")
+    lines = [f"{entry['diagram']}: {reason}", '  ' + ', '.join(usage)]
+    lines += [f'  {action}' for action in entry['actions']]
+    return '\n'.join(lines)
+
+def governed(name, function):
+    entry = {'diagram': name, 'rss': 0.0, 'data': 0.0, 'artists': 0, 'pixels': 0, 'actions': []}
+    _budget_current['entry'] = entry
+    _memory_alarm.clear()
+    try:
+        function()
+    except (MemoryError, KeyboardInterrupt) as error:
+        if not RENDER_CONFIG['memory_budget'] or (isinstance(error, KeyboardInterrupt) and not _memory_alarm):
+            raise
+        plt.close('all')
+        reached = f' at {_memory_alarm[0]:,.0f} MB RSS' if _memory_alarm else ''
+        raise MemoryError(budget_report(entry, f"ran out of the {RENDER_CONFIG['memory_budget']:,} MB "
+                                               f"memory budget{reached}")) from None
+    finally:
+        entry['rss'], entry['data'] = process_mb()
+        _budget_current.clear()
+        _budget_log.append(entry)
+        # Closed figures sit in reference cycles; with a resident-set budget
+        # they would count against the next diagram
+        if RENDER_CONFIG['memory_budget']:
+            gc.collect()
+        # A later Ctrl-C is a Ctrl-C again
+        _memory_alarm.clear()
+    if entry['actions']:
+        print(f"⚠️  {name}: " + '; '.join(entry['actions']))
+    return entry
+
+def over_budget(entry, reason):
+    if RENDER_CONFIG['over_budget'] == 'fail':
+        raise ValueError(budget_report(entry, reason + ' (--over-budget fail)'))
+
+def merge_artists(fig):
+    # Lines without markers become a LineCollection per (colour, width,
+    # style, alpha, zorder) and patches a PathCollection per zorder that
+    # keeps each patch's colours; text, ticks, markers, hatches and artists
+    # outside data coordinates are left alone
+    for ax in fig.axes:
+        lines = {}
+        for line in ax.lines:
+            if (line.get_transform() == ax.transData and line.get_marker() in ('None', 'none', '', ' ', None)
+                    and line.get_drawstyle() == 'default' and line.get_clip_path() is None):
+                key = (to_rgba(line.get_color(), line.get_alpha()), line.get_linewidth(), line.get_linestyle(),
+                       line.get_zorder())
+                lines.setdefault(key, []).append(line)
+        for (color, width, style, zorder), group in lines.items():
+            if len(group) > 1:
+                ax.add_collection(LineCollection([line.get_xydata() for line in group], colors=[color],
+                                                 linewidths=width, linestyles=style, zorder=zorder),
+                                  autolim=False)
+                for line in group:
+                    line.remove()
+
+        patches = {}
+        for patch in ax.patches:
+            if (patch.get_data_transform() == ax.transData and not patch.get_hatch()
+                    and patch.get_clip_path() is None):
+                patches.setdefault(patch.get_zorder(), []).append(patch)
+        for zorder, group in patches.items():
+            if len(group) > 1:
+                # Paths in data coordinates; PatchCollection would freeze
+                # them in display coordinates at the current DPI
+                paths = [patch.get_patch_transform().transform_path(patch.get_path()) for patch in group]
+                ax.add_collection(PathCollection(paths, facecolors=[patch.get_facecolor() for patch in group],
+                                                 edgecolors=[patch.get_edgecolor() for patch in group],
+                                                 linewidths=[patch.get_linewidth() for patch in group],
+                                                 zorder=zorder),
+                                  autolim=False)
+                for patch in group:
+                    patch.remove()
+
+def figure_budget(fig, dpi, count_artists=True):
+    # The DPI fig can be saved at within the artist, pixel and memory budgets
+    entry = _budget_current.get('entry') or {'diagram': 'figure', 'rss': 0.0, 'data': 0.0,
+                                             'artists': 0, 'pixels': 0, 'actions': []}
+    width, height = fig.get_size_inches()
+    entry['pixels'] = width * height * dpi * dpi
+    if count_artists:
+        entry['artists'] = len(fig.findobj())
+        if entry['artists'] > RENDER_CONFIG['max_artists']:
+            over_budget(entry, f"{entry['artists']:,} artists exceed --max-artists {RENDER_CONFIG['max_artists']:,}")
+            merge_artists(fig)
+            artists = len(fig.findobj())
+            entry['actions'].append(f"merged {entry['artists']:,} artists into {artists:,}")
+            entry['artists'] = artists
+            if artists > RENDER_CONFIG['max_artists']:
+                raise ValueError(budget_report(entry, f"{artists:,} artists left after merging exceed "
+                                                      f"--max-artists {RENDER_CONFIG['max_artists']:,}"))
+
+    scale = min(1.0, RENDER_CONFIG['max_pixels'] * 1e6 / entry['pixels'])
+    reason = f"{entry['pixels'] / 1e6:,.1f} MP canvas exceeds --max-pixels {RENDER_CONFIG['max_pixels']:g}"
+    if RENDER_CONFIG['memory_budget']:
+        # An RGBA buffer, drawn twice when the bounding box is tightened
+        needed = entry['pixels'] * 4 * (2 if RENDER_CONFIG['bbox_inches'] else 1) / 2**20
+        # Resident set, as the watchdog measures it
+        left = RENDER_CONFIG['memory_budget'] - process_mb()[0]
+        if needed > left:
+            scale = min(scale, max(left, 0) / needed)
+            reason = f"{needed:,.0f} MB render buffer exceeds the {left:,.0f} MB left in the memory budget"
+    if scale < 1:
+        over_budget(entry, reason)
+        lowered = int(dpi * scale ** 0.5)
+        if lowered < 1:
+            raise ValueError(budget_report(entry, reason))
+        entry['actions'].append(f'{reason}; saved at {lowered} DPI instead of {dpi}')
+        dpi = lowered
+    return dpi
+
+# BRANDING
+# A brand spec recolours, retitles and adds a logo to a finished figure, so
+# white-label copies need no changes to the create_* functions:
+#   {"name": "acme",
+#    "colors": {"#3498db": "#0b5394", "lightblue": "#cfe2f3"},
+#    "replace": {"Logistics Management System": "Acme Freight"},
+#    "logo": "brands/acme.png"}
+_logo_cache = {}
+
+def load_brands(path):
+    with open(path, encoding='utf-8') as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = [specs]
+
+    brands = []
+    for spec in specs:
+        if 'name' not in spec:
+            raise ValueError(f'Brand spec in {path} is missing a name')
+        brands.append({
+            'name': spec['name'],
+            # Colours are matched on their RGB value, whatever notation the
+            # diagrams happen to use
+            'colors': {to_hex(source): to_hex(target)
+                       for source, target in spec.get('colors', {}).items()},
+            'replace': dict(spec.get('replace', {})),
+            'logo': spec.get('logo')
+        })
+    return brands
+
+def brand_strings(value, replace):
+    # Text replacements applied to a string or to the strings in nested tuples
+    if isinstance(value, str):
+        for source, target in replace.items():
+            value = value.replace(source, target)
+        return value
+    if isinstance(value, tuple):
+        return tuple(brand_strings(item, replace) for item in value)
+    return value
+
+def brand_color(color, palette):
+    rgba = to_rgba(color)
+    replacement = palette.get(to_hex(rgba))
+    if replacement is None:
+        return None
+    return to_rgba(replacement, rgba[3])
+
+def brand_colors(colors, palette):
+    colors = np.array(colors, dtype=float).reshape(-1, 4)
+    changed = False
+    for i, rgba in enumerate(colors):
+        replacement = brand_color(rgba, palette)
+        if replacement is not None:
+            colors[i] = replacement
+            changed = True
+    return colors if changed else None
+
+def apply_brand(fig, brand):
+    palette = brand['colors']
+
+    for artist in fig.findobj():
+        if palette and isinstance(artist, patches.Patch):
+            facecolor = brand_color(artist.get_facecolor(), palette)
+            if facecolor is not None:
+                artist.set_facecolor(facecolor)
+            edgecolor = brand_color(artist.get_edgecolor(), palette)
+            if edgecolor is not None:
+                artist.set_edgecolor(edgecolor)
+
+        elif palette and isinstance(artist, Line2D):
+            for getter, setter in ((artist.get_color, artist.set_color),
+                                   (artist.get_markerfacecolor, artist.set_markerfacecolor),
+                                   (artist.get_markeredgecolor, artist.set_markeredgecolor)):
+                color = getter()
+                if isinstance(color, str) and color in ('none', 'auto'):
+                    continue
+                replacement = brand_color(color, palette)
+                if replacement is not None:
+                    setter(replacement)
+
+        # Colour-mapped collections keep their colormap
+        elif palette and isinstance(artist, Collection) and artist.get_array() is None:
+            facecolors = brand_colors(artist.get_facecolor(), palette)
+            if facecolors is not None:
+                artist.set_facecolor(facecolors)
+            edgecolors = brand_colors(artist.get_edgecolor(), palette)
+            if edgecolors is not None:
+                artist.set_edgecolor(edgecolors)
+
+        elif isinstance(artist, Text):
+            text = brand_strings(artist.get_text(), brand['replace'])
+            if text != artist.get_text():
+                artist.set_text(text)
+
+            if palette:
+                color = brand_color(artist.get_color(), palette)
+                if color is not None:
+                    artist.set_color(color)
+                bbox = artist.get_bbox_patch()
+                if bbox is not None:
+                    facecolor = brand_color(bbox.get_facecolor(), palette)
+                    if facecolor is not None:
+                        bbox.set_facecolor(facecolor)
+                    edgecolor = brand_color(bbox.get_edgecolor(), palette)
+                    if edgecolor is not None:
+                        bbox.set_edgecolor(edgecolor)
+
+    if brand['logo']:
+        if brand['logo'] not in _logo_cache:
+            # Pillow sniffs the real format; some of our app icons are JPEGs
+            # saved with a .png extension
+            with Image.open(brand['logo']) as logo:
+                _logo_cache[brand['logo']] = np.asarray(logo.convert('RGBA'))
+        logo = _logo_cache[brand['logo']]
+        logo_ax = fig.add_axes([0.01, 0.92, 0.07, 0.07])
+        logo_ax.imshow(logo)
+        logo_ax.axis('off')
+
+# ASSET VARIANTS
+# The figure is rendered once at the configured (highest) DPI and every other
+# size is derived from that master by area averaging, laid out the way
+# Flutter's resolution-aware assets expect:
+#   variants/name.png, variants/2.0x/name.png, variants/3.0x/name.png
+# plus thumbnails and compact web copies. Each export is recorded for
+# variants/manifest.json with its size and hash.
+VARIANTS = {
+    '3x': {'scale': 1.0, 'dir': '3.0x', 'format': 'png'},
+    '2x': {'scale': 2 / 3, 'dir': '2.0x', 'format': 'png'},
+    '1x': {'scale': 1 / 3, 'dir': '', 'format': 'png'},
+    'thumb': {'width': 320, 'dir': 'thumbs', 'format': 'png'},
+    'web': {'width': 1600, 'dir': 'web', 'format': 'webp'}
+}
+_variant_log = []
+
+def area_downscale_axis(image, size, axis):
+    # Output pixel i averages the input span [edges[i], edges[i + 1]). The
+    # span is summed one pixel offset at a time, each step a single gather
+    # the size of the output, with the partially covered pixels at either
+    # end weighted by their covered fraction
+    n = image.shape[axis]
+    if size >= n:
+        return image
+    edges = np.arange(size + 1) * (n / size)
+    first = edges.astype(int)
+    frac = (edges - first).astype(np.float32)
+    shape = [1] * image.ndim
+    shape[axis] = size
+
+    # The first pixel is only covered from its fractional start
+    result = np.take(image, first[:-1], axis=axis)
+    if frac[:-1].any():
+        result *= (1 - frac[:-1]).reshape(shape)
+    for offset in range(1, int((first[1:] - first[:-1]).max())):
+        index = first[:-1] + offset
+        covered = index < first[1:]
+        gathered = np.take(image, np.minimum(index, n - 1), axis=axis)
+        if not covered.all():
+            gathered *= covered.reshape(shape)
+        result += gathered
+
+    # ... and the pixel the span ends in up to its fractional end
+    end_weights = np.where(first[1:] < n, frac[1:], 0).astype(np.float32)
+    if end_weights.any():
+        result += end_weights.reshape(shape) * np.take(image, np.minimum(first[1:], n - 1), axis=axis)
+    result *= size / n
+    return result
+
+def area_downscale(image, width, height, band_rows=512):
+    # Averages premultiplied colour so transparent pixels do not bleed into
+    # their neighbours; fully opaque renders skip that step. The width pass
+    # runs over bands of rows so a 300 dpi master is never converted to
+    # floats all at once.
+    opaque = bool(image[..., 3].min() == 255)
+    bands = []
+    for start in range(0, image.shape[0], band_rows):
+        band = image[start:start + band_rows].astype(np.float32)
+        if not opaque:
+            band[..., :3] *= band[..., 3:] / 255
+        bands.append(area_downscale_axis(band, width, 1))
+    rgba = area_downscale_axis(np.concatenate(bands), height, 0)
+
+    if not opaque:
+        alpha = rgba[..., 3:] / 255
+        rgba[..., :3] = np.divide(rgba[..., :3], alpha, out=np.zeros_like(rgba[..., :3]),
+                                  where=alpha > 0)
+    return np.clip(np.rint(rgba), 0, 255).astype(np.uint8)
+
+def save_image(image, path, file_format):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    picture = Image.fromarray(image)
+    if file_format == 'webp' and features.check('webp'):
+        picture.save(path, 'WEBP', quality=80, method=4)
+        return path
+    if file_format == 'webp':
+        # Without WebP support, fall back to a 256-colour palette PNG,
+        # which is still several times smaller than the full PNG
+        path = os.path.splitext(path)[0] + '.png'
+        picture = picture.quantize(256, method=Image.Quantize.FASTOCTREE)
+    picture.save(path)
+    return path
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def export_variants(master_path, names):
+    output_dir = os.path.dirname(master_path) or '.'
+    filename = os.path.basename(master_path)
+    diagram = os.path.splitext(filename)[0]
+    with Image.open(master_path) as picture:
+        master = np.asarray(picture.convert('RGBA'))
+    height, width = master.shape[:2]
+
+    for name in names:
+        variant = VARIANTS[name]
+        if 'width' in variant:
+            scale = min(1.0, variant['width'] / width)
+        else:
+            scale = variant['scale']
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        target = os.path.join(output_dir, 'variants', variant['dir'],
+                              diagram + '.' + variant['format'])
+        if size == (width, height) and variant['format'] == 'png':
+            # Full size PNG is the master itself
+            image = master
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(master_path, target)
+        else:
+            image = master if size == (width, height) else area_downscale(master, *size)
+            target = save_image(image, target, variant['format'])
+        _variant_log.append({
+            'output_dir': output_dir,
+            'diagram': diagram,
+            'variant': name,
+            'file': os.path.relpath(target, output_dir),
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'bytes': os.path.getsize(target),
+            'sha256': file_digest(target)
+        })
+
+def write_variant_manifests(entries):
+    by_dir = {}
+    for entry in entries:
+        by_dir.setdefault(entry['output_dir'], []).append(entry)
+
+    for output_dir, dir_entries in by_dir.items():
+        path = os.path.join(output_dir, 'variants', 'manifest.json')
+        # Merge into the existing manifest so partial runs (--only) keep
+        # the other diagrams' entries
+        manifest = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        for entry in dir_entries:
+            manifest.setdefault(entry['diagram'], {})[entry['variant']] = {
+                key: entry[key] for key in ('file', 'width', 'height', 'bytes', 'sha256')
+            }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+# EVENT EXPORTS
+# Supabase table exports are read in fixed-size chunks so memory stays flat
+# however many rows the export holds. IDs are reduced to 64-bit hashes and
+# timestamps to integer milliseconds before anything else touches them.
+EXPORT_CHUNK_ROWS = 1_000_000
+WINDOW_CHUNK_ROWS = 100_000
+DAY_MS = 86_400_000
+SEEK_SLACK = 64 * 1024
+
+def export_header(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+def read_export_chunks(path, columns, chunk_rows=EXPORT_CHUNK_ROWS, optional=(), start=None):
+    # start is a byte offset of a row boundary, e.g. from seek_time
+    required = [column for column in columns if column not in optional]
+    if start is None:
+        reader = pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_rows)
+        with reader:
+            for chunk in reader:
+                yield chunk.dropna(subset=required)
+        return
+
+    names = export_header(path)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        reader = pd.read_csv(f, header=None, names=names, usecols=columns, dtype=str, chunksize=chunk_rows)
+        with reader:
+            for chunk in reader:
+                yield chunk.dropna(subset=required)
+
+def hash_ids(values):
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+def hash_id(value):
+    return int(hash_ids(pd.Series([value]))[0])
+
+def parse_timestamps(values):
+    return pd.to_datetime(values, utc=True, format='ISO8601').dt.as_unit('ms').astype('int64').to_numpy()
+
+# FILTERS
+# --from/--to/--client/--driver arrive in RENDER_CONFIG['filters'] as epoch
+# ms bounds (from inclusive, to exclusive) and 64-bit id hashes. Exports kept
+# in time order are not scanned from the top: the first row of the window is
+# found by bisecting over byte offsets, and reading stops at the first chunk
+# past the window. A filter a source cannot honour is an error rather than a
+# silently unfiltered diagram.
+def parse_time_bound(text, end=False):
+    # A bare date is a whole day, so --to 2025-09-30 includes the 30th
+    bound = int(parse_timestamps(pd.Series([text]))[0])
+    if end and len(text) == 10:
+        bound += DAY_MS
+    return bound
+
+def time_mask(times, filters):
+    mask = np.ones(len(times), dtype=bool)
+    if filters.get('since') is not None:
+        mask &= times >= filters['since']
+    if filters.get('until') is not None:
+        mask &= times < filters['until']
+    return mask
+
+def check_key_filters(filters, supported, source):
+    for name in ('client', 'driver'):
+        if filters.get(name) is not None and name not in supported:
+            raise ValueError(f'--{name} cannot be applied to {source}')
+
+def next_row_time(f, index):
+    # Rows inside multi-line quoted fields do not parse; try the next few
+    for _ in range(8):
+        line = f.readline()
+        if not line:
+            return None
+        fields = next(csv.reader([line.decode('utf-8', 'replace')]), [])
+        if len(fields) > index:
+            try:
+                return int(parse_timestamps(pd.Series([fields[index]]))[0])
+            except ValueError:
+                continue
+    return None
+
+def seek_time(path, time_column, bound):
+    # Byte offset of a row boundary at or before the first row whose time is
+    # >= bound, in an export sorted by time_column
+    index = export_header(path).index(time_column)
+    with open(path, 'rb') as f:
+        f.readline()
+        low = f.tell()
+        high = os.path.getsize(path)
+        while high - low > SEEK_SLACK:
+            middle = (low + high) // 2
+            f.seek(middle)
+            f.readline()
+            row_start = f.tell()
+            time = next_row_time(f, index)
+            if time is not None and time < bound:
+                low = row_start
+            else:
+                high = middle
+    return low
+
+def read_export_window(path, columns, time_column, filters, optional=()):
+    # (chunk, times) pairs inside the --from/--to window of a time-ordered
+    # export; smaller chunks keep the overshoot past --to short
+    start = seek_time(path, time_column, filters['since']) if filters.get('since') is not None else None
+    chunk_rows = WINDOW_CHUNK_ROWS if filters.get('until') is not None else EXPORT_CHUNK_ROWS
+    for chunk in read_export_chunks(path, columns, chunk_rows, optional, start):
+        times = parse_timestamps(chunk[time_column])
+        keep = time_mask(times, filters)
+        yield chunk[keep], times[keep]
+        if filters.get('until') is not None and len(times) and times.max() >= filters['until']:
+            break
+
+def filter_key(filters):
+    return tuple(sorted(filters.items()))
+
+def input_key(path):
+    # Parsed inputs are cached per path and invalidated when the file changes
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+_input_cache = {}
+
+# STAGE DURATIONS
+# Time spent reaching each lifecycle stage, measured from consignment status
+# history (consignment_id, status, timestamp). Events are hash-partitioned by
+# consignment into spill files, each partition is sorted by (consignment,
+# time) and diffed in one pass, and the gaps land in per-stage log-spaced
+# histograms. Percentiles come from the histograms, so the result is exact to
+# within one bin (~1.5%) and memory is bounded by the partition size.
+LIFECYCLE_STATUSES = {
+    # status -> index into the create_system_lifecycle stages
+    'pending': 0, 'created': 0,
+    'approved': 1, 'reviewed': 1,
+    'assigned': 2,
+    'pickup_scheduled': 3, 'scheduled': 3,
+    'picked_up': 4,
+    'in_transit': 5,
+    'out_for_delivery': 6, 'delivery_attempted': 6,
+    'delivered': 7,
+    'paid': 8,
+    'closed': 9, 'completed': 9
+}
+LIFECYCLE_STAGE_COUNT = 10
+DURATION_BINS = np.logspace(0, np.log10(400 * 86400), 1200)
+EVENT_DTYPE = np.dtype([('key', '<u8'), ('time', '<i8'), ('stage', 'i1')])
+PARTITION_BYTES = 256 * 1024 * 1024
+MAX_PARTITIONS = 256
+
+def matching_consignments(path, filters):
+    # Hashes of the consignments --client/--driver select, or None when
+    # neither is given. A consignment matches when any of its events carries
+    # the id: the driver is only set from the assigned event on, and the
+    # earlier events still belong to its stages
+    names = [name for name in ('client', 'driver') if filters.get(name) is not None]
+    if not names:
+        return None
+    header = export_header(path)
+    supported = [name for name in ('client', 'driver') if name + '_id' in header]
+    check_key_filters(filters, supported, f'{path} (no client_id/driver_id column)')
+    key = ('consignments', input_key(path), filter_key(filters))
+    if key not in _input_cache:
+        columns = [name + '_id' for name in names]
+        found = {name: [] for name in names}
+        for chunk in read_export_chunks(path, ['consignment_id'] + columns, optional=columns):
+            consignments = hash_ids(chunk['consignment_id'])
+            for name in names:
+                ids = chunk[name + '_id']
+                hit = ids.notna().to_numpy() & (hash_ids(ids) == filters[name])
+                found[name].append(np.unique(consignments[hit]))
+        matching = None
+        for name in names:
+            ids = np.unique(np.concatenate(found[name])) if found[name] else np.empty(0, dtype=np.uint64)
+            matching = ids if matching is None else np.intersect1d(matching, ids, assume_unique=True)
+        _input_cache[key] = matching
+    return _input_cache[key]
+
+def consignment_chunks(path, filters):
+    # Every event of the matching consignments, pending rows without a
+    # driver included
+    matching = matching_consignments(path, filters)
+    for chunk in read_export_chunks(path, ['consignment_id', 'status', 'timestamp']):
+        if matching is not None:
+            chunk = chunk[np.isin(hash_ids(chunk['consignment_id']), matching)]
+        yield chunk
+
+def status_events(chunk):
+    events = np.empty(len(chunk), dtype=EVENT_DTYPE)
+    events['key'] = hash_ids(chunk['consignment_id'])
+    events['time'] = parse_timestamps(chunk['timestamp'])
+    # Map the handful of distinct statuses, not every row. Unmapped statuses
+    # (cancelled, ...) still end the previous stage
+    codes, statuses = pd.factorize(chunk['status'])
+    lookup = np.array([LIFECYCLE_STATUSES.get(status.strip().lower(), -1) for status in statuses], dtype='i1')
+    events['stage'] = lookup[codes]
+    return events
+
+def stage_histograms(events, histograms, filters):
+    order = np.lexsort((events['time'], events['key']))
+    keys = events['key'][order]
+    times = events['time'][order]
+    stages = events['stage'][order]
+
+    # Each event after the first of its consignment closes the gap since
+    # the previous event
+    same = keys[1:] == keys[:-1]
+    stages = stages[1:][same]
+    seconds = (times[1:] - times[:-1])[same] / 1000.0
+    # A transition belongs to the window it finished in
+    measured = (stages >= 0) & time_mask(times[1:][same], filters)
+    bins = np.searchsorted(DURATION_BINS, seconds[measured])
+    histograms += np.bincount(
+        stages[measured].astype(np.int64) * (len(DURATION_BINS) + 1) + bins,
+        minlength=histograms.size
+    ).reshape(histograms.shape)
+
+def spill_partitions(path, partitions, spill_dir, filters, make_events):
+    files = [open(os.path.join(spill_dir, f'{i}.bin'), 'wb') for i in range(partitions)]
+    try:
+        for chunk in consignment_chunks(path, filters):
+            events = make_events(chunk)
+            part = events['key'] % partitions
+            order = np.argsort(part, kind='stable')
+            bounds = np.searchsorted(part[order], np.arange(partitions + 1))
+            events = events[order]
+            for i in range(partitions):
+                events[bounds[i]:bounds[i + 1]].tofile(files[i])
+    finally:
+        for f in files:
+            f.close()
+    return [f.name for f in files]
+
+def partitioned_events(path, filters, make_events, dtype):
+    # Event arrays holding every event of their consignments; the whole
+    # export is read before the first one is yielded
+    partitions = min(MAX_PARTITIONS, os.path.getsize(path) // PARTITION_BYTES + 1)
+    if partitions == 1:
+        chunks = [make_events(chunk) for chunk in consignment_chunks(path, filters)]
+        if chunks:
+            yield np.concatenate(chunks)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='lifecycle-') as spill_dir:
+        for part_path in spill_partitions(path, partitions, spill_dir, filters, make_events):
+            events = np.fromfile(part_path, dtype=dtype)
+            os.remove(part_path)
+            yield events
+
+def lifecycle_histograms(path, filters):
+    histograms = np.zeros((LIFECYCLE_STAGE_COUNT, len(DURATION_BINS) + 1), dtype=np.int64)
+    for events in partitioned_events(path, filters, status_events, EVENT_DTYPE):
+        stage_histograms(events, histograms, filters)
+    return histograms
+
+def histogram_percentiles(counts, quantiles):
+    # Geometric middle of the bin holding each quantile
+    edges = np.concatenate(([0.0], DURATION_BINS, [DURATION_BINS[-1]]))
+    cumulative = np.cumsum(counts)
+    ranks = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1])
+    return np.sqrt(np.maximum(edges[ranks], 0.5) * edges[ranks + 1])
+
+def lifecycle_durations(path, filters):
+    key = ('lifecycle', input_key(path), filter_key(filters))
+    if key not in _input_cache:
+        histograms = lifecycle_histograms(path, filters)
+        stats = {}
+        for stage, counts in enumerate(histograms):
+            if counts.sum():
+                p50, p90, p99 = histogram_percentiles(counts, (0.5, 0.9, 0.99))
+                stats[stage] = {'p50': p50, 'p90': p90, 'p99': p99, 'count': int(counts.sum())}
+        _input_cache[key] = stats
+    return _input_cache[key]
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f'{seconds:.0f}s'
+    if seconds < 90 * 60:
+        return f'{seconds / 60:.0f}m'
+    if seconds < 36 * 3600:
+        return f'{seconds / 3600:.1f}h'
+    return f'{seconds / 86400:.1f}d'
+
+# STATUS TRANSITIONS
+# Every status change in the status history export, counted per (from, to)
+# pair. Statuses are coded in the order they are first seen, events go
+# through the same consignment partitions as the stage durations, and each
+# partition is sorted by (consignment, time) so consecutive events of a
+# consignment form its transitions; the pairs are encoded as
+# from * statuses + to and counted with one bincount. Repeats of the same
+# status are not transitions. The first and last status of each consignment
+# are counted too, so a node's size covers consignments that start or stop
+# there. Like the stage durations, a transition belongs to the window it
+# finished in.
+TRANSITION_DTYPE = np.dtype([('key', '<u8'), ('time', '<i8'), ('status', '<i2')])
+SANKEY_NODE_WIDTH = 0.012
+SANKEY_GAP = 0.02  # between nodes of a column, as a fraction of the height
+SANKEY_LABEL_HEIGHT = 0.012  # smaller nodes are drawn but not labelled
+
+def transition_events(chunk, statuses):
+    events = np.empty(len(chunk), dtype=TRANSITION_DTYPE)
+    events['key'] = hash_ids(chunk['consignment_id'])
+    events['time'] = parse_timestamps(chunk['timestamp'])
+    codes, names = pd.factorize(chunk['status'].fillna('unknown'))
+    lookup = np.array([statuses.setdefault(str(name).strip().lower(), len(statuses)) for name in names],
+                      dtype='i2')
+    events['status'] = lookup[codes]
+    return events
+
+def transition_counts(path, filters):
+    key = ('transitions', input_key(path), filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+    statuses = {}
+    counts = starts = ends = None
+    consignments = 0
+    for events in partitioned_events(path, filters, lambda chunk: transition_events(chunk, statuses),
+                                     TRANSITION_DTYPE):
+        size = len(statuses)
+        if counts is None:
+            counts = np.zeros((size, size), dtype=np.int64)
+            starts, ends = np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)
+        if not len(events):
+            continue
+        order = np.lexsort((events['time'], events['key']))
+        keys, times = events['key'][order], events['time'][order]
+        codes = events['status'][order].astype(np.int64)
+        inside = time_mask(times, filters)
+
+        same = keys[1:] == keys[:-1]
+        source, target = codes[:-1][same], codes[1:][same]
+        measured = (source != target) & inside[1:][same]
+        counts += np.bincount(source[measured] * size + target[measured],
+                              minlength=size * size).reshape(size, size)
+        first = np.r_[True, ~same]
+        last = np.r_[~same, True]
+        starts += np.bincount(codes[first & inside], minlength=size)
+        ends += np.bincount(codes[last & inside], minlength=size)
+        consignments += int((np.add.reduceat(inside, np.flatnonzero(first)) > 0).sum())
+
+    if counts is None:
+        counts, starts, ends = np.zeros((0, 0), dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    result = {'statuses': list(statuses), 'counts': counts, 'starts': starts, 'ends': ends,
+              'consignments': consignments}
+    _input_cache[key] = result
+    return result
+
+def sankey_columns(statuses, counts, starts):
+    # Lifecycle statuses sit at their stage; any other status goes one column
+    # after the status most of its consignments came from
+    column = np.array([LIFECYCLE_STATUSES.get(status, -1) for status in statuses])
+    if (column < 0).all():
+        column[np.argmax(starts)] = 0
+    order = np.argsort(-counts.sum(axis=0), kind='stable')
+    placed = True
+    while placed:
+        placed = False
+        for status in order:
+            sources = np.flatnonzero((column >= 0) & (counts[:, status] > 0))
+            if column[status] < 0 and len(sources):
+                column[status] = column[sources[np.argmax(counts[sources, status])]] + 1
+                placed = True
+    column[column < 0] = column.max() + 1
+    # Close up columns nothing landed in
+    return np.unique(column, return_inverse=True)[1]
+
+def sankey_layout(transitions):
+    # Nodes stacked top-down in their column, lifecycle statuses first, with
+    # heights to one scale; ribbons leave a node in the order of the nodes
+    # they reach and arrive in the order of the nodes they left
+    counts, starts, ends = transitions['counts'], transitions['starts'], transitions['ends']
+    through = np.maximum(counts.sum(axis=0) + starts, counts.sum(axis=1) + ends)
+    shown = np.flatnonzero(through)
+    counts, starts, through = counts[np.ix_(shown, shown)], starts[shown], through[shown]
+    statuses = [transitions['statuses'][i] for i in shown]
+    on_path = np.array([status in LIFECYCLE_STATUSES for status in statuses], dtype=bool)
+    column = sankey_columns(statuses, counts, starts)
+
+    order = np.lexsort((-through, ~on_path, column))
+    column_nodes = np.bincount(column)
+    scale = (1 - SANKEY_GAP * (column_nodes.max() - 1)) / np.bincount(column, weights=through).max()
+    height = through * scale
+    stacked = np.cumsum(height[order]) - height[order]
+    first = np.searchsorted(column[order], column[order])
+    top = np.empty(len(order))
+    top[order] = 1 - (stacked - stacked[first]) - SANKEY_GAP * (np.arange(len(order)) - first)
+    x = column / max(column.max(), 1) * (1 - SANKEY_NODE_WIDTH)
+
+    source, target = np.nonzero(counts)
+    width = counts[source, target] * scale
+    source_top = top[source] - sankey_offsets(source, -top[target], width)
+    target_top = top[target] - sankey_offsets(target, -top[source], width)
+    # Lanes for the ribbons that loop back to the same or an earlier column,
+    # shortest span innermost. Only a move between two lifecycle statuses to
+    # an earlier stage is backward (a retry); an off-path status merely sits
+    # after its main source, so a move into it from further on still loops.
+    loop = column[target] <= column[source]
+    stage = np.array([LIFECYCLE_STATUSES.get(status, -1) for status in statuses])
+    backward = on_path[source] & on_path[target] & (stage[target] < stage[source])
+    lane = np.full(len(source), np.nan)
+    nested = np.flatnonzero(loop)[np.argsort((x[source] - x[target])[loop], kind='stable')]
+    lane[nested] = (top - height).min() - SANKEY_GAP - np.r_[0, np.cumsum(width[nested] + SANKEY_GAP / 4)][:-1]
+    return {'statuses': statuses, 'through': through, 'on_path': on_path, 'column': column, 'x': x,
+            'top': top, 'height': height, 'source': source, 'target': target,
+            'count': counts[source, target], 'width': width, 'source_top': source_top,
+            'target_top': target_top, 'loop': loop, 'backward': backward, 'lane': lane}
+
+def sankey_offsets(node, rank, width):
+    # Distance of each ribbon below the top of its node
+    order = np.lexsort((rank, node))
+    stacked = np.r_[0, np.cumsum(width[order])]
+    offsets = np.empty(len(node))
+    offsets[order] = stacked[:-1] - stacked[np.searchsorted(node[order], node[order])]
+    return offsets
+
+def sankey_ribbons(x0, y0, x1, y1, width):
+    # One closed path per ribbon: a cubic along the top edge, down the
+    # target side, a cubic back along the bottom edge
+    bend = np.maximum(np.abs(x1 - x0) / 2, 0.06)
+    xs = np.column_stack((x0, x0 + bend, x1 - bend, x1, x1, x1 - bend, x0 + bend, x0, x0, x0))
+    ys = np.column_stack((y0, y0, y1, y1, y1 - width, y1 - width, y0 - width, y0 - width, y0, y0))
+    codes = [Path.MOVETO] + [Path.CURVE4] * 3 + [Path.LINETO] + [Path.CURVE4] * 3 + [Path.LINETO, Path.CLOSEPOLY]
+    return [PathPatch(Path(vertices, codes)) for vertices in np.stack((xs, ys), axis=-1)]
+
+def sankey_loops(x0, y0, x1, y1, width, lane):
+    # Ribbons back to an earlier column: out of the source to the right,
+    # down to their lane under the nodes, left along it and up into the
+    # target. The outer edge runs first, then the inner one back.
+    bend = 0.04
+    outer, inner = x0 + bend + width, x0 + bend
+    xs = np.column_stack((x0, outer, outer, x0, x1, x1 - bend - width, x1 - bend - width, x1,
+                          x1, x1 - bend, x1 - bend, x1, x0, inner, inner, x0, x0))
+    ys = np.column_stack((y0, y0, lane - width, lane - width, lane - width, lane - width, y1, y1,
+                          y1 - width, y1 - width, lane, lane, lane, lane, y0 - width, y0 - width, y0))
+    codes = ([Path.MOVETO] + [Path.CURVE4] * 3 + [Path.LINETO] + [Path.CURVE4] * 3 + [Path.LINETO] +
+             [Path.CURVE4] * 3 + [Path.LINETO] + [Path.CURVE4] * 3 + [Path.CLOSEPOLY])
+    return [PathPatch(Path(vertices, codes)) for vertices in np.stack((xs, ys), axis=-1)]
+
+# CHAT TRAFFIC
+# Sender-role -> receiver-role message counts and reply latencies from a chat
+# export, reduced in one pass over the file. Two layouts are understood:
+#   messages       (chat_room_id, sender_id, receiver_id, created_at)
+#   chat_messages  (room_id, sender_id, created_at[, message_type]) plus a
+#                  chat_room_participants export (room_id, user_id) from
+#                  which the receiver of a two-person room is derived
+# Roles come from a users export (id, role). A reply is a message that
+# follows one from the other side of the same room; its latency is the gap.
+# The export is expected in created_at order: each chunk is sorted by
+# (room, time) and the last message of every room is carried into the next
+# chunk, so replies that straddle a chunk boundary are still measured.
+CHAT_ROLES = ['Admin', 'Client', 'Driver', 'System']
+USER_ROLE_GROUPS = {'admin': 0, 'other_admin': 0, 'client': 1, 'user': 1, 'driver': 2}
+SYSTEM_ROLE = 3
+
+def load_user_roles(path):
+    keys, roles = [], []
+    for chunk in read_export_chunks(path, ['id', 'role']):
+        keys.append(hash_ids(chunk['id']))
+        roles.append(chunk['role'].str.strip().str.lower().map(USER_ROLE_GROUPS).fillna(SYSTEM_ROLE).to_numpy('i1'))
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+    roles = np.concatenate(roles) if roles else np.empty(0, dtype='i1')
+    order = np.argsort(keys)
+    return keys[order], roles[order]
+
+def lookup_sorted(sorted_keys, keys):
+    # Index of every key in sorted_keys and whether it was found there
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    index = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return index, sorted_keys[index] == keys
+
+def user_roles_of(users, keys):
+    user_keys, user_roles = users
+    index, found = lookup_sorted(user_keys, keys)
+    return np.where(found, user_roles[index] if len(user_roles) else SYSTEM_ROLE, SYSTEM_ROLE)
+
+def load_room_pairs(path):
+    # Two-person rooms only: sorted room keys and their two members
+    rooms, members = [], []
+    for chunk in read_export_chunks(path, ['room_id', 'user_id']):
+        rooms.append(hash_ids(chunk['room_id']))
+        members.append(hash_ids(chunk['user_id']))
+    rooms = np.concatenate(rooms) if rooms else np.empty(0, dtype=np.uint64)
+    members = np.concatenate(members) if members else np.empty(0, dtype=np.uint64)
+    order = np.lexsort((members, rooms))
+    rooms, members = rooms[order], members[order]
+    starts = np.flatnonzero(np.r_[True, rooms[1:] != rooms[:-1]]) if len(rooms) else np.empty(0, dtype=np.int64)
+    sizes = np.diff(np.r_[starts, len(rooms)])
+    pairs = starts[sizes == 2]
+    return rooms[pairs], members[pairs], members[pairs + 1]
+
+def chat_events(chunk, times, users, room_pairs):
+    room = hash_ids(chunk['room'])
+    sender = hash_ids(chunk['sender_id'])
+    if 'receiver_id' in chunk:
+        receiver = hash_ids(chunk['receiver_id'])
+        keep = np.ones(len(chunk), dtype=bool)
+    else:
+        pair_rooms, first, second = room_pairs
+        index, keep = lookup_sorted(pair_rooms, room)
+        receiver = np.where(sender == first[index], second[index], first[index]) if len(pair_rooms) else sender
+    sender_role = user_roles_of(users, sender)
+    if 'message_type' in chunk:
+        sender_role[(chunk['message_type'] == 'system').to_numpy()] = SYSTEM_ROLE
+    return {
+        'room': room[keep],
+        'time': times[keep],
+        'sender': sender[keep],
+        'receiver': receiver[keep],
+        'sender_role': sender_role[keep],
+        'receiver_role': user_roles_of(users, receiver)[keep]
+    }
+
+def chat_traffic_stats(path, users_path, participants_path, filters):
+    key = ('chat', input_key(path), input_key(users_path),
+           input_key(participants_path) if participants_path else None, filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+
+    header = set(pd.read_csv(path, nrows=0).columns)
+    room_column = 'chat_room_id' if 'chat_room_id' in header else 'room_id'
+    columns = [room_column, 'sender_id', 'created_at']
+    columns += [column for column in ('receiver_id', 'message_type') if column in header]
+    if 'receiver_id' not in header and not participants_path:
+        raise ValueError(f'{path} has no receiver_id column; a chat_room_participants export is needed')
+
+    users = load_user_roles(users_path)
+    room_pairs = load_room_pairs(participants_path) if 'receiver_id' not in header else None
+    roles = len(CHAT_ROLES)
+    counts = np.zeros(roles * roles, dtype=np.int64)
+    latencies = np.zeros((roles * roles, len(DURATION_BINS) + 1), dtype=np.int64)
+    carry = {name: np.empty(0, dtype=dtype) for name, dtype in
+             (('room', np.uint64), ('time', np.int64), ('sender', np.uint64), ('sender_role', 'i1'))}
+
+    for chunk, times in read_export_window(path, columns, 'created_at', filters):
+        events = chat_events(chunk.rename(columns={room_column: 'room'}), times, users, room_pairs)
+        # --client/--driver keep the conversations that person is part of
+        for name in ('client', 'driver'):
+            if filters.get(name) is not None:
+                involved = (events['sender'] == filters[name]) | (events['receiver'] == filters[name])
+                events = {field: values[involved] for field, values in events.items()}
+        if not len(events['room']):
+            continue
+        counts += np.bincount(events['sender_role'].astype(np.int64) * roles + events['receiver_role'],
+                              minlength=roles * roles)
+
+        # Last message of each room from earlier chunks goes first, so it
+        # only ever serves as the message being replied to
+        size = len(carry['room'])
+        merged = {name: np.concatenate((carry[name], events[name])) for name in carry}
+        order = np.lexsort((np.arange(len(merged['room'])) >= size, merged['time'], merged['room']))
+        merged = {name: values[order] for name, values in merged.items()}
+
+        reply = (merged['room'][1:] == merged['room'][:-1]) & (merged['sender'][1:] != merged['sender'][:-1])
+        gaps = (merged['time'][1:] - merged['time'][:-1])[reply] / 1000.0
+        pair = merged['sender_role'][:-1][reply].astype(np.int64) * roles + merged['sender_role'][1:][reply]
+        latencies += np.bincount(pair * (len(DURATION_BINS) + 1) + np.searchsorted(DURATION_BINS, gaps),
+                                 minlength=latencies.size).reshape(latencies.shape)
+
+        last = np.r_[merged['room'][1:] != merged['room'][:-1], True]
+        carry = {name: merged[name][last] for name in carry}
+
+    counts = counts.reshape(roles, roles)
+    stats = {'counts': counts, 'messages': int(counts.sum()), 'reply_p50': {}}
+    for a in range(roles):
+        for b in range(a + 1, roles):
+            # Replies in either direction of the pair
+            pair = latencies[a * roles + b] + latencies[b * roles + a]
+            if pair.sum():
+                stats['reply_p50'][CHAT_ROLES[a], CHAT_ROLES[b]] = histogram_percentiles(pair, (0.5,))[0]
+    _input_cache[key] = stats
+    return stats
+
+def format_count(count):
+    if count >= 1_000_000:
+        return f'{count / 1_000_000:.1f}M'
+    if count >= 10_000:
+        return f'{count / 1000:.0f}k'
+    if count >= 1000:
+        return f'{count / 1000:.1f}k'
+    return str(count)
+
+# FUEL LEDGER
+# Per-driver spend, daily balance trajectories and ledger anomalies from a
+# fuel_transactions export (driver_id, amount, created_at or
+# transaction_date, optionally transaction_type/type and balance_before/
+# balance_after). Chunks are grouped by (driver, day) with sort + reduceat
+# and folded into a running table of the same shape, so memory follows
+# drivers x days rather than transactions. Two anomalies are flagged:
+#   mismatch  balance_after != balance_before -/+ amount
+#   gap       balance_before != the driver's previous balance_after
+# The gap check needs the export in time order; the last transaction of each
+# driver is carried into the next chunk.
+FUEL_CREDIT_TYPES = {'topup', 'top_up', 'credit', 'refund', 'deposit', 'load'}
+BALANCE_TOLERANCE = 0.005
+MAX_FUEL_PANELS = 400
+
+def fuel_columns(path):
+    header = set(pd.read_csv(path, nrows=0).columns)
+    columns = {'driver': 'driver_id', 'amount': 'amount',
+               'time': 'created_at' if 'created_at' in header else 'transaction_date'}
+    if 'transaction_type' in header or 'type' in header:
+        columns['type'] = 'transaction_type' if 'transaction_type' in header else 'type'
+    if {'balance_before', 'balance_after'} <= header:
+        columns['before'] = 'balance_before'
+        columns['after'] = 'balance_after'
+    return columns
+
+def reduce_daily(daily):
+    # Collapse rows sharing (driver, day): spend and anomalies add up, the
+    # balance is the one with the latest time
+    order = np.lexsort((daily['time'], daily['day'], daily['driver']))
+    daily = {name: values[order] for name, values in daily.items()}
+    starts = np.flatnonzero(np.r_[True, (daily['driver'][1:] != daily['driver'][:-1]) |
+                                        (daily['day'][1:] != daily['day'][:-1])])
+    ends = np.r_[starts[1:], len(daily['driver'])] - 1
+    return {
+        'driver': daily['driver'][starts],
+        'day': daily['day'][starts],
+        'time': daily['time'][ends],
+        'balance': daily['balance'][ends],
+        'spend': np.add.reduceat(daily['spend'], starts),
+        'count': np.add.reduceat(daily['count'], starts),
+        'anomalies': np.add.reduceat(daily['anomalies'], starts)
+    }
+
+def fuel_ledger(path, filters):
+    key = ('fuel', input_key(path), filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+
+    columns = fuel_columns(path)
+    check_key_filters(filters, ['driver'], 'fuel transactions')
+    has_balance = 'after' in columns
+    optional = [columns[name] for name in ('type', 'before', 'after') if name in columns]
+    daily = None
+    labels = {}
+    totals = {'mismatch': 0, 'gap': 0, 'transactions': 0}
+    carry = {'driver': np.empty(0, dtype=np.uint64), 'time': np.empty(0, dtype=np.int64),
+             'after': np.empty(0, dtype=np.float64)}
+
+    for chunk, time in read_export_window(path, list(columns.values()), columns['time'], filters, optional):
+        if filters.get('driver') is not None:
+            mine = hash_ids(chunk[columns['driver']]) == filters['driver']
+            chunk, time = chunk[mine], time[mine]
+        if not len(chunk):
+            continue
+        # Short labels for the panels; only the distinct ids are hashed twice
+        ids = pd.unique(chunk[columns['driver']])
+        labels.update(zip(hash_ids(pd.Series(ids)), (driver_id[:8] for driver_id in ids)))
+
+        driver = hash_ids(chunk[columns['driver']])
+        amount = pd.to_numeric(chunk[columns['amount']], errors='coerce').fillna(0).to_numpy()
+        debit = amount
+        if 'type' in columns:
+            credit = chunk[columns['type']].str.lower().isin(FUEL_CREDIT_TYPES).to_numpy()
+            debit = np.where(credit, 0.0, amount)
+            amount = np.where(credit, -amount, amount)
+
+        anomalies = np.zeros(len(chunk), dtype=np.int64)
+        balance = np.full(len(chunk), np.nan)
+        if has_balance:
+            before = pd.to_numeric(chunk[columns['before']], errors='coerce').to_numpy()
+            balance = pd.to_numeric(chunk[columns['after']], errors='coerce').to_numpy()
+            mismatch = np.abs(before - amount - balance) > BALANCE_TOLERANCE
+            totals['mismatch'] += int(mismatch.sum())
+            anomalies += mismatch
+
+            # Previous transaction of the same driver, including the one
+            # carried over from the last chunk
+            size = len(carry['driver'])
+            merged_driver = np.concatenate((carry['driver'], driver))
+            merged_time = np.concatenate((carry['time'], time))
+            merged_after = np.concatenate((carry['after'], balance))
+            merged_before = np.concatenate((np.full(size, np.nan), before))
+            order = np.lexsort((np.arange(len(merged_driver)) >= size, merged_time, merged_driver))
+            same = merged_driver[order][1:] == merged_driver[order][:-1]
+            gap = np.zeros(len(order), dtype=bool)
+            gap[1:] = same & (np.abs(merged_before[order][1:] - merged_after[order][:-1]) > BALANCE_TOLERANCE)
+            gap_rows = order[gap] - size
+            totals['gap'] += len(gap_rows)
+            anomalies[gap_rows] += 1
+
+            last = np.r_[merged_driver[order][1:] != merged_driver[order][:-1], True]
+            carry = {'driver': merged_driver[order][last], 'time': merged_time[order][last],
+                     'after': merged_after[order][last]}
+
+        totals['transactions'] += len(chunk)
+        partial = reduce_daily({'driver': driver, 'day': time // DAY_MS, 'time': time,
+                                'balance': balance, 'spend': debit,
+                                'count': np.ones(len(chunk), dtype=np.int64), 'anomalies': anomalies})
+        daily = partial if daily is None else reduce_daily(
+            {name: np.concatenate((daily[name], partial[name])) for name in daily})
+
+    if daily is None:
+        raise ValueError(f'{path} has no fuel transactions for the selected filters')
+
+    # Per-driver totals over the (driver, day) table
+    starts = np.flatnonzero(np.r_[True, daily['driver'][1:] != daily['driver'][:-1]])
+    drivers = daily['driver'][starts]
+    ledger = {
+        'daily': daily,
+        'starts': starts,
+        'drivers': drivers,
+        'labels': [labels[driver] for driver in drivers],
+        'spend': np.add.reduceat(daily['spend'], starts),
+        'transactions': np.add.reduceat(daily['count'], starts),
+        'anomalies': np.add.reduceat(daily['anomalies'], starts),
+        'has_balance': has_balance,
+        'totals': totals
+    }
+    _input_cache[key] = ledger
+    return ledger
+
+def draw_fuel_panels_template(ax, cells, labels, flagged):
+    # Frame and caption of every small-multiple cell
+    for (x, y), label, flag in zip(cells, labels, flagged):
+        ax.add_patch(Rectangle((x, y), 0.92, 0.84, facecolor='white',
+                               edgecolor='#e74c3c' if flag else '#bdc3c7',
+                               linewidth=0.8 if flag else 0.4))
+        ax.text(x + 0.04, y + 0.8, label, fontsize=5, va='top', color='#2c3e50')
+
+# ROUTE TRACKS
+# Driver routes from a tracking_logs export (driver_id, latitude, longitude,
+# timestamp), expected in timestamp order like the other event exports.
+# Points are split into trips per driver wherever the gap exceeds
+# TRIP_GAP_MS, and a uniform grid index over all points answers bounding-box
+# queries without touching points outside the requested cells. Visible runs
+# are simplified with a Douglas-Peucker pass that works on every polyline at
+# once: each round measures all interior points of all open ranges, splits
+# the ranges whose farthest point exceeds the tolerance, and stops when none
+# do. The tolerance follows the zoom, one output pixel by default, so a
+# city-level view keeps street detail and a country-level view does not.
+TRIP_GAP_MS = 30 * 60 * 1000
+GRID_CELLS = 256
+ROUTE_TOLERANCE_PX = 0.75
+
+def load_tracks(path, filters):
+    key = ('tracks', input_key(path), filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+    check_key_filters(filters, ['driver'], 'tracking logs')
+
+    parts = {'driver': [], 'time': [], 'lon': [], 'lat': []}
+    columns = ['driver_id', 'latitude', 'longitude', 'timestamp']
+    for chunk, times in read_export_window(path, columns, 'timestamp', filters):
+        driver = hash_ids(chunk['driver_id'])
+        keep = np.ones(len(chunk), dtype=bool)
+        if filters.get('driver') is not None:
+            keep = driver == filters['driver']
+        parts['driver'].append(driver[keep])
+        parts['time'].append(times[keep])
+        parts['lon'].append(pd.to_numeric(chunk['longitude'], errors='coerce').to_numpy()[keep])
+        parts['lat'].append(pd.to_numeric(chunk['latitude'], errors='coerce').to_numpy()[keep])
+    if not parts['driver']:
+        raise ValueError(f'{path} has no tracking points for the selected filters')
+    points = {name: np.concatenate(values) for name, values in parts.items()}
+    valid = np.isfinite(points['lon']) & np.isfinite(points['lat'])
+    order = np.lexsort((points['time'][valid], points['driver'][valid]))
+    points = {name: values[valid][order] for name, values in points.items()}
+
+    # A new trip starts at every driver change and every long pause
+    breaks = np.r_[True, (points['driver'][1:] != points['driver'][:-1]) |
+                         (np.diff(points['time']) > TRIP_GAP_MS)]
+    trip = np.cumsum(breaks) - 1
+
+    # Equirectangular projection around the middle latitude for distances
+    scale = np.cos(np.radians((points['lat'].min() + points['lat'].max()) / 2))
+    lon, lat = points['lon'], points['lat']
+    tracks = {
+        'lon': lon, 'lat': lat, 'x': lon * scale, 'y': lat, 'scale': scale,
+        'time': points['time'], 'driver': points['driver'],
+        'trip': trip, 'trip_driver': points['driver'][breaks],
+        'index': build_grid_index(lon, lat)
+    }
+    _input_cache[key] = tracks
+    return tracks
+
+def build_grid_index(lon, lat):
+    # Points sorted by grid cell, with each cell's offset into that order
+    bounds = (lon.min(), lat.min(), lon.max(), lat.max())
+    width = max(bounds[2] - bounds[0], 1e-9) / GRID_CELLS
+    height = max(bounds[3] - bounds[1], 1e-9) / GRID_CELLS
+    column = np.minimum(((lon - bounds[0]) / width).astype(np.int64), GRID_CELLS - 1)
+    row = np.minimum(((lat - bounds[1]) / height).astype(np.int64), GRID_CELLS - 1)
+    cell = row * GRID_CELLS + column
+    order = np.argsort(cell, kind='stable')
+    offsets = np.searchsorted(cell[order], np.arange(GRID_CELLS * GRID_CELLS + 1))
+    return {'bounds': bounds, 'width': width, 'height': height, 'order': order, 'offsets': offsets}
+
+def points_in_bbox(index, lon, lat, bbox):
+    # Candidates come from the cells the box overlaps, one slice per grid row
+    west, south, east, north = bbox
+    (min_lon, min_lat, _, _), width, height = index['bounds'], index['width'], index['height']
+    first_column = int(np.clip((west - min_lon) // width, 0, GRID_CELLS - 1))
+    last_column = int(np.clip((east - min_lon) // width, 0, GRID_CELLS - 1))
+    first_row = int(np.clip((south - min_lat) // height, 0, GRID_CELLS - 1))
+    last_row = int(np.clip((north - min_lat) // height, 0, GRID_CELLS - 1))
+    slices = [index['order'][index['offsets'][row * GRID_CELLS + first_column]:
+                             index['offsets'][row * GRID_CELLS + last_column + 1]]
+              for row in range(first_row, last_row + 1)]
+    candidates = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+    inside = ((lon[candidates] >= west) & (lon[candidates] <= east) &
+              (lat[candidates] >= south) & (lat[candidates] <= north))
+    return candidates[inside]
+
+def visible_runs(tracks, bbox):
+    # (start, end) point ranges of the route pieces that touch the box; a
+    # segment is kept when either end lies inside, so lines leave the frame
+    # instead of stopping at its edge
+    inside = np.zeros(len(tracks['lon']), dtype=bool)
+    inside[points_in_bbox(tracks['index'], tracks['lon'], tracks['lat'], bbox)] = True
+    segment = (inside[:-1] | inside[1:]) & (tracks['trip'][1:] == tracks['trip'][:-1])
+    edges = np.diff(np.r_[0, segment.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def simplify_runs(x, y, starts, ends, tolerance):
+    # Vectorised Douglas-Peucker over all runs; returns the kept point mask
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    low, high = starts, ends
+    while True:
+        open_ranges = high - low > 1
+        low, high = low[open_ranges], high[open_ranges]
+        if not len(low):
+            return keep
+        lengths = high - low - 1
+        offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        owner = np.repeat(np.arange(len(low)), lengths)
+        points = np.arange(lengths.sum()) - offsets[owner] + low[owner] + 1
+
+        # Distance from each interior point to its range's chord
+        x0, y0 = x[low][owner], y[low][owner]
+        dx, dy = x[high][owner] - x0, y[high][owner] - y0
+        length = dx * dx + dy * dy
+        t = np.clip(((x[points] - x0) * dx + (y[points] - y0) * dy) / np.where(length > 0, length, 1), 0, 1)
+        distance = np.hypot(x[points] - x0 - t * dx, y[points] - y0 - t * dy)
+
+        farthest = np.maximum.reduceat(distance, offsets)
+        split = farthest > tolerance
+        at = np.minimum.reduceat(np.where(distance == farthest[owner], points, len(x)), offsets)[split]
+        keep[at] = True
+        low = np.concatenate((low[split], at))
+        high = np.concatenate((at, high[split]))
+
+def route_polylines(tracks, bbox, tolerance):
+    starts, ends = visible_runs(tracks, bbox)
+    if not len(starts):
+        return [], np.empty(0, dtype=np.uint64), 0, 0
+    keep = simplify_runs(tracks['x'], tracks['y'], starts, ends, tolerance)
+    kept = np.flatnonzero(keep)
+    # Runs never share points, so the kept vertices split back into one
+    # polyline per run at each run's first point
+    lines = np.split(np.column_stack((tracks['lon'][kept], tracks['lat'][kept])),
+                     np.searchsorted(kept, starts)[1:])
+    drivers = tracks['trip_driver'][tracks['trip'][starts]]
+    return lines, drivers, int((ends - starts + 1).sum()), len(kept)
+
+# GPS PLAYBACK
+# A replay of driver positions from the tracking export. The routes, axes
+# and title are drawn once and cached as a pixel background; every frame
+# restores that background and draws only the position markers and the
+# clock (blitting), then hands the RGBA buffer to a writer:
+#   mp4  piped to ffmpeg when it is on PATH
+#   gif  Pillow, quantised against a palette fixed from the first frame and
+#        appended to the file frame by frame, cropped to what changed
+#   png  a numbered frame sequence in <output-dir>/playback/
+# Positions for every frame are interpolated up front, one searchsorted per
+# driver over all frame times, and drivers between trips are hidden.
+PLAYBACK_DPI = 80
+PLAYBACK_FORMATS = ['gif', 'mp4', 'png']
+
+def playback_positions(tracks, frame_times):
+    # (frames, drivers, 2) lon/lat, NaN where the driver is not on a trip
+    bounds = np.flatnonzero(np.r_[True, tracks['driver'][1:] != tracks['driver'][:-1], True])
+    positions = np.full((len(frame_times), len(bounds) - 1, 2), np.nan)
+    for column, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if end - start < 2:
+            continue
+        times = tracks['time'][start:end]
+        after = np.searchsorted(times, frame_times, side='right')
+        moving = (after > 0) & (after < len(times))
+        after = np.clip(after, 1, len(times) - 1) + start
+        before = after - 1
+        moving &= tracks['trip'][before] == tracks['trip'][after]
+        span = np.maximum(tracks['time'][after] - tracks['time'][before], 1)
+        fraction = (frame_times - tracks['time'][before]) / span
+        for axis, name in enumerate(('lon', 'lat')):
+            values = tracks[name][before] + (tracks[name][after] - tracks[name][before]) * fraction
+            positions[:, column, axis] = np.where(moving, values, np.nan)
+    return positions, tracks['driver'][bounds[:-1]]
+
+def open_frame_writer(file_format, output_dir, size, fps):
+    # Returns (write(frame), close() -> output path)
+    width, height = size
+    if file_format == 'mp4':
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise ValueError('mp4 playback needs ffmpeg on PATH; use --playback gif or png')
+        path = os.path.join(output_dir, 'playback.mp4')
+        process = subprocess.Popen(
+            [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+             '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path],
+            stdin=subprocess.PIPE)
+
+        def close():
+            process.stdin.close()
+            if process.wait():
+                raise RuntimeError(f'ffmpeg failed writing {path}')
+            return path
+        return (lambda frame: process.stdin.write(frame.tobytes())), close
+
+    if file_format == 'png':
+        frame_dir = os.path.join(output_dir, 'playback')
+        os.makedirs(frame_dir, exist_ok=True)
+        count = [0]
+
+        def write(frame):
+            Image.fromarray(frame, 'RGBA').save(os.path.join(frame_dir, f'frame_{count[0]:05d}.png'),
+                                                compress_level=1)
+            count[0] += 1
+        return write, lambda: frame_dir
+
+    # GIF frames share one palette (the global colour table) so no frame
+    # needs its own quantisation pass. Each frame is written as it arrives,
+    # only the rectangle that differs from the previous one with unchanged
+    # pixels set to the spare index 255 as transparent, so memory holds a
+    # single frame however long the playback is.
+    path = os.path.join(output_dir, 'playback.gif')
+    f = open(path, 'wb')
+    palette = []
+    previous = []
+
+    def write(frame):
+        image = Image.fromarray(frame, 'RGBA').convert('RGB')
+        if not palette:
+            palette.append(image.quantize(colors=255, method=Image.Quantize.MEDIANCUT))
+            header, _ = GifImagePlugin.getheader(palette[0], info={'loop': 0})
+            f.write(b''.join(header))
+        image = image.quantize(palette=palette[0], dither=Image.Dither.NONE)
+        pixels = np.asarray(image)
+        if not previous:
+            previous.append(pixels)
+            f.write(b''.join(GifImagePlugin.getdata(image, duration=round(1000 / fps))))
+            return
+        changed = pixels != previous[0]
+        rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+        # An unchanged frame still needs its delay, as a single pixel
+        top, bottom = (int(rows[0]), int(rows[-1]) + 1) if len(rows) else (0, 1)
+        left, right = (int(columns[0]), int(columns[-1]) + 1) if len(columns) else (0, 1)
+        delta = np.where(changed, pixels, 255)[top:bottom, left:right].astype(np.uint8)
+        previous[0] = pixels
+        image = Image.fromarray(delta, 'P')
+        image.putpalette(palette[0].getpalette())
+        f.write(b''.join(GifImagePlugin.getdata(image, offset=(left, top), duration=round(1000 / fps),
+                                                transparency=255)))
+
+    def close():
+        f.write(b';')
+        f.close()
+        return path
+    return write, close
+
+def render_playback(file_format, output_dir, frames, fps):
+    tracks = load_tracks(RENDER_CONFIG['tracking_export'], RENDER_CONFIG['filters'])
+    bbox = RENDER_CONFIG['bbox'] or (tracks['lon'].min(), tracks['lat'].min(),
+                                     tracks['lon'].max(), tracks['lat'].max())
+    filters = RENDER_CONFIG['filters']
+    first = max(tracks['time'].min(), filters.get('since', tracks['time'].min()))
+    last = min(tracks['time'].max(), filters.get('until', tracks['time'].max()))
+    frame_times = np.linspace(first, last, frames)
+    positions, drivers = playback_positions(tracks, frame_times)
+
+    # Static layer: faint simplified routes, axes and title
+    fig = Figure(figsize=(10, 8), dpi=PLAYBACK_DPI)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    pixels = fig.get_figwidth() * 0.8 * PLAYBACK_DPI
+    tolerance = (bbox[2] - bbox[0]) * tracks['scale'] / pixels * ROUTE_TOLERANCE_PX
+    lines, _, _, _ = route_polylines(tracks, bbox, tolerance)
+    ax.add_collection(LineCollection(lines, colors='#bdc3c7', linewidths=0.5, alpha=0.6))
+    ax.set_xlim(bbox[0], bbox[2])
+    ax.set_ylim(bbox[1], bbox[3])
+    ax.set_aspect(1 / tracks['scale'])
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    title = 'Delivery Replay - Driver Positions'
+    if filters.get('label'):
+        title += f"\n{filters['label']}"
+    ax.set_title(title, fontsize=14, fontweight='bold')
+
+    # Moving layer
+    palette = plt.get_cmap('tab20')
+    markers = ax.scatter(positions[0, :, 0], positions[0, :, 1], s=28,
+                         c=[palette(int(driver % 20)) for driver in drivers],
+                         edgecolors='black', linewidths=0.4, zorder=3, animated=True)
+    clock = ax.text(0.01, 0.98, '', transform=ax.transAxes, va='top', fontsize=11,
+                    fontweight='bold', animated=True,
+                    bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
+    if RENDER_CONFIG['brand']:
+        apply_brand(fig, RENDER_CONFIG['brand'])
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    os.makedirs(output_dir, exist_ok=True)
+    write, close = open_frame_writer(file_format, output_dir, canvas.get_width_height(), fps)
+    for frame, frame_time in enumerate(frame_times):
+        canvas.restore_region(background)
+        markers.set_offsets(positions[frame])
+        active = int(np.isfinite(positions[frame, :, 0]).sum())
+        clock.set_text(f"{np.datetime64(int(frame_time), 'ms').astype('datetime64[m]')} UTC · "
+                       f"{active} drivers on the road")
+        ax.draw_artist(markers)
+        ax.draw_artist(clock)
+        write(np.asarray(canvas.buffer_rgba()))
+    return close()
+
+# LIVE DASHBOARD
+# The evaluation dashboard kept current from an event stream standing in
+# for Supabase realtime: a JSONL file that is tailed (lines appended later
+# are picked up) or tcp://host:port sending one JSON event per line, in the
+# realtime payload shape
+#   {"table": "consignments", "eventType": "INSERT" | "UPDATE" | "DELETE",
+#    "new": {...}, "old": {...}, "commit_timestamp": "2025-09-01T10:00:00Z"}
+# Each event updates the aggregates in O(1): counters by status, month, role
+# and hour, plus id -> bucket maps so an UPDATE or DELETE moves the row out
+# of its old bucket without a rescan. Panels an event touched are marked
+# dirty; at most --fps times a second every dirty panel is restored from its
+# own cached background, its animated artists are redrawn and only its area
+# is blitted. A value outgrowing its axis doubles the limit and redraws the
+# figure once. Without a window (--no-show or a non-interactive backend)
+# each frame is written to <output-dir>/system_evaluation_live.png instead.
+LIVE_RATE_SECONDS = 60
+LIVE_MONTHS = 6
+LIVE_ROLES = [('Admin', ('admin', 'other_admin')), ('Client', ('client', 'user')), ('Driver', ('driver',))]
+LIVE_PANELS = ['kpis', 'users', 'hours', 'monthly', 'rate']
+
+def live_state():
+    return {
+        'status': np.zeros(len(ROLLUP_TABLES['consignments']['categories']), dtype=int),
+        'months': {},  # 'YYYY-MM' -> counts by status
+        'consignments': {},  # id -> (status, month)
+        'roles': np.zeros(len(LIVE_ROLES), dtype=int),
+        'users': {},  # id -> role
+        'hours': np.zeros(24, dtype=int),
+        'rate': np.zeros(LIVE_RATE_SECONDS, dtype=int),
+        'second': int(time.time()),
+        'events': 0,
+        'last': None
+    }
+
+def live_tick(state, now):
+    # Advance the per-second ring, clearing the seconds that passed
+    second = int(now)
+    for passed in range(state['second'] + 1, min(second, state['second'] + LIVE_RATE_SECONDS) + 1):
+        state['rate'][passed % LIVE_RATE_SECONDS] = 0
+    state['second'] = max(second, state['second'])
+
+def apply_event(state, event, now):
+    # Returns the panels the event changed
+    categories = ROLLUP_TABLES['consignments']['categories']
+    new, old = event.get('new') or {}, event.get('old') or {}
+    kind = str(event.get('eventType') or event.get('type') or 'INSERT').upper()
+    key = new.get('id') or old.get('id')
+    stamp = event.get('commit_timestamp') or new.get('created_at')
+    state['events'] += 1
+    state['rate'][int(now) % LIVE_RATE_SECONDS] += 1
+    dirty = {'rate'}
+    if stamp:
+        state['last'] = stamp
+        if stamp[11:13].isdigit():
+            state['hours'][int(stamp[11:13]) % 24] += 1
+            dirty.add('hours')
+
+    if event.get('table') == 'consignments':
+        previous = state['consignments'].pop(key, None)
+        if previous is not None:
+            status, month = previous
+            state['status'][status] -= 1
+            state['months'][month][status] -= 1
+        if kind != 'DELETE' and new.get('status') in categories:
+            status = categories.index(new['status'])
+            month = (new.get('created_at') or '')[:7] or (previous[1] if previous else (stamp or '')[:7])
+            state['status'][status] += 1
+            state['months'].setdefault(month, np.zeros(len(categories), dtype=int))[status] += 1
+            state['consignments'][key] = (status, month)
+        dirty |= {'kpis', 'monthly'}
+
+    elif event.get('table') == 'users':
+        previous = state['users'].pop(key, None)
+        if previous is not None:
+            state['roles'][previous] -= 1
+        role = next((i for i, (_, roles) in enumerate(LIVE_ROLES) if new.get('role') in roles), None)
+        if kind != 'DELETE' and role is not None:
+            state['roles'][role] += 1
+            state['users'][key] = role
+        dirty.add('users')
+    return dirty
+
+def event_source(source):
+    # Returns poll(timeout) -> list of new lines, or None once the stream ended
+    if source.startswith('tcp://'):
+        host, _, port = source[len('tcp://'):].rpartition(':')
+        connection = socket.create_connection((host, int(port)))
+        buffer = [b'']
+
+        def poll(timeout):
+            # Drains whatever is already buffered so a backlog is not
+            # spread over many frames
+            chunks = []
+            while select.select([connection], [], [], 0 if chunks else timeout)[0] and len(chunks) < 64:
+                data = connection.recv(1 << 16)
+                if not data:
+                    if not chunks:
+                        return None
+                    break
+                chunks.append(data)
+            *lines, buffer[0] = (buffer[0] + b''.join(chunks)).split(b'\n')
+            return [line.decode('utf-8') for line in lines]
+        return poll
+
+    stream = open(source, encoding='utf-8')
+    partial = ['']
+
+    def poll(timeout):
+        # A line still being written is held back until its newline arrives
+        lines = []
+        for line in iter(stream.readline, ''):
+            if not line.endswith('\n'):
+                partial[0] += line
+                break
+            lines.append(partial[0] + line)
+            partial[0] = ''
+        if not lines:
+            time.sleep(timeout)
+        return lines
+    return poll
+
+def create_live_dashboard():
+    fig = plt.figure(figsize=(16, 10))
+    gs = gridspec.GridSpec(2, 3, figure=fig)
+    fig.suptitle('System Performance & Evaluation Dashboard - Live', fontsize=20, fontweight='bold')
+    page = {'fig': fig, 'axes': {}, 'artists': {}}
+
+    # Consignment outcomes, % of all live consignments
+    ax = page['axes']['kpis'] = fig.add_subplot(gs[0, 0])
+    bars = ax.bar(['Delivered', 'Open', 'Cancelled'], np.zeros(3), color=['#2ecc71', '#f39c12', '#e74c3c'])
+    labels = [ax.text(bar.get_x() + bar.get_width() / 2, 0, '', ha='center', va='bottom', fontweight='bold')
+              for bar in bars]
+    page['artists']['kpis'] = list(bars) + labels
+    ax.set_title('Key Performance Indicators', fontweight='bold')
+    ax.set_ylabel('Percentage (%)')
+    ax.set_ylim(0, 110)
+
+    # Registered users
+    ax = page['axes']['users'] = fig.add_subplot(gs[0, 1])
+    page['artists']['users'] = list(ax.bar([name for name, _ in LIVE_ROLES], np.zeros(len(LIVE_ROLES)),
+                                           color=['#ff6b6b', '#4ecdc4', '#45b7d1']))
+    ax.set_title('Registered Users by Role', fontweight='bold')
+    ax.set_ylim(0, 10)
+
+    # Events by hour of day
+    ax = page['axes']['hours'] = fig.add_subplot(gs[0, 2])
+    line, = ax.plot(np.arange(24), np.zeros(24), marker='o', linewidth=2, markersize=4)
+    page['artists']['hours'] = [line]
+    ax.set_title('24-Hour System Load', fontweight='bold')
+    ax.set_xlabel('Hour of Day')
+    ax.set_ylabel('Events')
+    ax.set_xlim(0, 23)
+    ax.set_ylim(0, 10)
+    ax.grid(True, alpha=0.3)
+
+    # Consignments of the latest months by outcome
+    ax = page['axes']['monthly'] = fig.add_subplot(gs[1, :2])
+    x = np.arange(LIVE_MONTHS)
+    width = 0.25
+    page['artists']['monthly'] = [bar for offset, label, color in
+                                  ((-width, 'Completed', '#2ecc71'), (0, 'Pending', '#f39c12'),
+                                   (width, 'Cancelled', '#e74c3c'))
+                                  for bar in ax.bar(x + offset, np.zeros(LIVE_MONTHS), width, label=label, color=color)]
+    ax.set_title('Monthly Delivery Statistics', fontweight='bold')
+    ax.set_ylabel('Number of Consignments')
+    ax.set_xticks(x)
+    ax.set_xticklabels([''] * LIVE_MONTHS)
+    ax.set_ylim(0, 10)
+    # Kept on top of the bars as they grow into it
+    page['artists']['monthly'].append(ax.legend(loc='upper left'))
+    ax.grid(True, alpha=0.3)
+
+    # Events per second over the last minute, newest on the right
+    ax = page['axes']['rate'] = fig.add_subplot(gs[1, 2])
+    line, = ax.plot(np.arange(-LIVE_RATE_SECONDS + 1, 1), np.zeros(LIVE_RATE_SECONDS), color='#9b59b6', linewidth=2)
+    counter = ax.text(0.02, 0.95, '', transform=ax.transAxes, va='top', fontsize=9, family='monospace',
+                      bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
+    page['artists']['rate'] = [line, counter]
+    ax.set_title('Live Events per Second', fontweight='bold')
+    ax.set_xlabel('Seconds Ago')
+    ax.set_xlim(-LIVE_RATE_SECONDS + 1, 0)
+    ax.set_ylim(0, 10)
+    ax.grid(True, alpha=0.3)
+
+    for artists in page['artists'].values():
+        for artist in artists:
+            artist.set_animated(True)
+    fig.tight_layout()
+    if RENDER_CONFIG['brand']:
+        apply_brand(fig, RENDER_CONFIG['brand'])
+    return page
+
+def update_live_panel(page, name, state):
+    # Moves the panel's artists to the current aggregates; returns True when
+    # the panel needs a full redraw (axis limit or tick labels changed)
+    ax, artists = page['axes'][name], page['artists'][name]
+    relabelled = False
+    if name == 'kpis':
+        status = state['status']
+        share = 100 / max(status.sum(), 1)
+        values = [status[3] * share, status[:3].sum() * share, status[4] * share]
+        for bar, label, value in zip(artists[:3], artists[3:], values):
+            bar.set_height(value)
+            label.set_y(value + 1)
+            label.set_text(f'{value:.0f}%')
+        return False
+
+    if name == 'users':
+        values = state['roles']
+        for bar, value in zip(artists, values):
+            bar.set_height(value)
+    elif name == 'hours':
+        values = state['hours']
+        artists[0].set_ydata(values)
+    elif name == 'monthly':
+        months = sorted(state['months'])[-LIVE_MONTHS:]
+        counts = np.array([state['months'][month] for month in months]).reshape(-1, state['status'].size)
+        columns = np.zeros((3, LIVE_MONTHS))
+        columns[:, :len(months)] = [counts[:, 3], counts[:, :3].sum(axis=1), counts[:, 4]]
+        for bar, value in zip(artists, columns.ravel()):
+            bar.set_height(value)
+        values = columns
+        labels = months + [''] * (LIVE_MONTHS - len(months))
+        if [label.get_text() for label in ax.get_xticklabels()] != labels:
+            ax.set_xticklabels(labels)
+            relabelled = True
+    else:
+        now = state['second']
+        values = np.roll(state['rate'], -(now % LIVE_RATE_SECONDS) - 1)
+        artists[0].set_ydata(values)
+        artists[1].set_text(f"{state['events']:,} events\nlast {state['last'] or '—'}")
+
+    # New tick labels still need the limit check before the redraw
+    top = ax.get_ylim()[1]
+    if values.max() > top * 0.95:
+        while values.max() > top * 0.95:
+            top *= 2
+        ax.set_ylim(0, top)
+        return True
+    return relabelled
+
+def run_live_dashboard(source, output_dir, fps):
+    state = live_state()
+    page = create_live_dashboard()
+    fig = page['fig']
+    canvas = fig.canvas
+    window = RENDER_CONFIG['show'] and type(canvas) is not FigureCanvasAgg
+    if window:
+        plt.show(block=False)
+    snapshot = os.path.join(output_dir, 'system_evaluation_live.png')
+    os.makedirs(output_dir, exist_ok=True)
+
+    def redraw():
+        # Full draw without the animated artists, then one background per panel
+        canvas.draw()
+        # Padded so lines clipped at the axes edge are restored too
+        page['regions'] = {name: ax.bbox.padded(3) for name, ax in page['axes'].items()}
+        page['backgrounds'] = {name: canvas.copy_from_bbox(region) for name, region in page['regions'].items()}
+
+    poll = event_source(source)
+    frame_seconds = 1 / fps
+    dirty = set(LIVE_PANELS)
+    redraw()
+    next_frame = time.monotonic()
+    try:
+        while True:
+            lines = poll(max(0, next_frame - time.monotonic()))
+            now = time.time()
+            live_tick(state, now)
+            for line in lines or ():
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    event = None
+                if not isinstance(event, dict):
+                    # One bad line from the feed should not stop the dashboard
+                    print(f"⚠️  live: skipped malformed event {line.strip()[:80]!r}")
+                    continue
+                dirty |= apply_event(state, event, now)
+            if time.monotonic() >= next_frame or lines is None:
+                dirty.add('rate')
+                if any([update_live_panel(page, name, state) for name in dirty]):
+                    redraw()
+                    dirty = set(LIVE_PANELS)
+                for name in dirty:
+                    ax = page['axes'][name]
+                    canvas.restore_region(page['backgrounds'][name])
+                    for artist in page['artists'][name]:
+                        ax.draw_artist(artist)
+                    if window:
+                        canvas.blit(page['regions'][name])
+                if window:
+                    canvas.flush_events()
+                    if not plt.fignum_exists(fig.number):
+                        break
+                else:
+                    Image.fromarray(np.asarray(canvas.buffer_rgba())).save(snapshot + '.tmp.png')
+                    os.replace(snapshot + '.tmp.png', snapshot)
+                dirty = set()
+                next_frame = max(next_frame + frame_seconds, time.monotonic())
+            if lines is None:
+                break
+    except KeyboardInterrupt:
+        pass
+    if os.path.exists(snapshot + '.tmp.png'):
+        os.remove(snapshot + '.tmp.png')
+    plt.close(fig)
+    return state['events']
+
+# DELIVERY NOTES
+# End-of-day reprints of the notes drivers capture in the app, from a
+# delivery_notes export (id, customer_name, delivery_address, created_at,
+# optionally status, notes, customer_id, driver_id, consignment_id). The
+# page template (header band, field boxes, captions, logo) is drawn once
+# per worker and brand, then rasterised at the render DPI; every page shows
+# that one image and only its field texts change, so PdfPages embeds the
+# template once per file and a page costs little more than its text. Notes
+# are streamed from the export in NOTES_PER_PDF batches, each written as
+# one multi-page PDF by a warm pool worker:
+#   <output-dir>/delivery_notes/delivery_notes_0001.pdf, ...
+NOTE_PAGE_SIZE = (5.83, 8.27)  # A5 portrait, inches; drawn in millimetres
+NOTE_PAGE_MM = (148, 210)
+NOTES_PER_PDF = 500
+NOTE_COLUMNS = ['id', 'customer_name', 'delivery_address', 'created_at']
+NOTE_OPTIONAL = ['status', 'notes', 'customer_id', 'driver_id', 'consignment_id']
+NOTE_LOGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AppIcons', 'playstore.png')
+# field: (x, y, wrap width in characters, lines, fontsize, weight)
+NOTE_FIELDS = {
+    'number': (12, 170, 24, 1, 11, 'bold'),
+    'date': (82, 170, 24, 1, 11, 'bold'),
+    'customer': (12, 150, 56, 2, 11, 'normal'),
+    'address': (12, 125, 62, 4, 10, 'normal'),
+    'status': (12, 87, 16, 1, 10, 'bold'),
+    'driver': (56, 87, 18, 1, 10, 'normal'),
+    'consignment': (104, 87, 16, 1, 10, 'normal'),
+    'notes': (12, 67, 72, 6, 9, 'normal')
+}
+NOTE_STATUS_COLORS = {'delivered': '#27ae60', 'failed': '#e74c3c', 'partial': '#f39c12'}
+
+def draw_note_template(ax, logo):
+    # Header band
+    ax.add_patch(Rectangle((0, 185), 148, 25, facecolor='#3498db', edgecolor='none'))
+    ax.text(74, 200, 'DELIVERY NOTE', ha='center', va='center', fontsize=16, fontweight='bold', color='white')
+    ax.text(74, 191, 'Logistics Management System', ha='center', va='center', fontsize=9, color='white')
+    if logo is not None:
+        ax.imshow(logo, extent=(126, 144, 188, 206), zorder=3)
+
+    # Field boxes with their captions
+    boxes = [('NOTE NO.', (8, 162, 62, 18)), ('DATE', (78, 162, 62, 18)),
+             ('CUSTOMER', (8, 136, 132, 22)), ('DELIVERY ADDRESS', (8, 98, 132, 34)),
+             ('STATUS', (8, 78, 40, 16)), ('DRIVER', (52, 78, 44, 16)),
+             ('CONSIGNMENT', (100, 78, 40, 16)), ('NOTES', (8, 36, 132, 38))]
+    for caption, (x, y, width, height) in boxes:
+        ax.add_patch(FancyBboxPatch((x, y), width, height, boxstyle="round,pad=0,rounding_size=2",
+                                    facecolor='#f8f9fa', edgecolor='#7f8c8d', linewidth=1))
+        ax.text(x + 3, y + height - 3.5, caption, ha='left', va='center', fontsize=6.5,
+                fontweight='bold', color='#7f8c8d')
+
+    # Signature lines
+    for x, caption in ((8, 'Received by (name)'), (78, 'Signature')):
+        ax.plot([x, x + 62], [20, 20], color='black', linewidth=0.8)
+        ax.text(x, 16, caption, ha='left', va='center', fontsize=7, color='#7f8c8d')
+    ax.text(74, 6, 'Reprinted from the delivery_notes records', ha='center', va='center',
+            fontsize=6.5, style='italic', color='#95a5a6')
+
+def note_axes(fig):
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(0, NOTE_PAGE_MM[0])
+    ax.set_ylim(0, NOTE_PAGE_MM[1])
+    ax.axis('off')
+    return ax
+
+def freeze_image(image):
+    # Hands back the first draw's pixels on every later draw; PdfPages keys
+    # embedded images by the array, so the image is written once per file
+    frozen = {}
+    make_image = image.make_image
+
+    def cached(renderer, magnification=1.0, unsampled=False):
+        key = (magnification, unsampled)
+        if key not in frozen:
+            frozen[key] = make_image(renderer, magnification, unsampled)
+        return frozen[key]
+    image.make_image = cached
+
+def note_page():
+    # The reusable page of this worker: template image plus one Text per field
+    brand = RENDER_CONFIG['brand']
+    key = ('delivery_note', brand['name'] if brand else None, RENDER_CONFIG['dpi'])
+    if key in _template_cache:
+        return _template_cache[key]
+
+    scratch = Figure(figsize=NOTE_PAGE_SIZE, dpi=RENDER_CONFIG['dpi'])
+    canvas = FigureCanvasAgg(scratch)
+    logo = None
+    if not (brand and brand['logo']) and os.path.exists(NOTE_LOGO):
+        # The app icon is a round badge on a baked-in checkerboard; keep the badge
+        with Image.open(NOTE_LOGO) as picture:
+            logo = np.asarray(picture.convert('RGBA')).copy()
+        y, x = np.indices(logo.shape[:2]) - (np.array(logo.shape[:2])[:, None, None] - 1) / 2
+        logo[..., 3] = np.where(np.hypot(x, y) <= min(logo.shape[:2]) * 0.485, 255, 0)
+    draw_note_template(note_axes(scratch), logo)
+    if brand:
+        apply_brand(scratch, brand)
+    canvas.draw()
+    template = np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+    fig = Figure(figsize=NOTE_PAGE_SIZE)
+    ax = note_axes(fig)
+    # interpolation='none' keeps the raster at its own resolution in the PDF
+    freeze_image(ax.imshow(template, extent=(0, NOTE_PAGE_MM[0], 0, NOTE_PAGE_MM[1]),
+                           interpolation='none', aspect='auto', zorder=0))
+    fields = {name: ax.text(x, y, '', ha='left', va='top', fontsize=size, fontweight=weight, linespacing=1.3)
+              for name, (x, y, _, _, size, weight) in NOTE_FIELDS.items()}
+    _template_cache[key] = {'fig': fig, 'fields': fields}
+    return _template_cache[key]
+
+def fit_text(text, width, lines):
+    # Each line wrapped at width characters, cut to the first lines
+    wrapped = [part for line in str(text).splitlines() or ['']
+               for part in textwrap.wrap(' '.join(line.split()), width) or ['']]
+    if len(wrapped) > lines:
+        wrapped = wrapped[:lines]
+        wrapped[-1] = wrapped[-1][:width - 1] + '…'
+    return '\n'.join(wrapped)
+
+def note_values(note):
+    status = note.get('status') or 'delivered'
+    customer = note['customer_name']
+    if note.get('customer_id'):
+        customer = fit_text(customer, NOTE_FIELDS['customer'][2], 1) + f"\nCustomer ID {note['customer_id']}"
+    return {
+        'number': note['id'][:8].upper(),
+        'date': str(np.datetime64(note['time'], 'ms').astype('datetime64[m]')).replace('T', ' ') + ' UTC',
+        'customer': customer,
+        'address': note['delivery_address'],
+        'status': status.title(),
+        'driver': (note.get('driver_id') or '—')[:8],
+        'consignment': (note.get('consignment_id') or '—')[:8],
+        'notes': note.get('notes') or '—'
+    }, NOTE_STATUS_COLORS.get(status, 'black')
+
+def render_note_batch(task):
+    number, notes, output_dir = task
+    page = note_page()
+    path = os.path.join(output_dir, f'delivery_notes_{number:04d}.pdf')
+    with PdfPages(path, metadata={'Title': f'Delivery notes {number:04d}'}) as pdf:
+        for note in notes:
+            values, status_color = note_values(note)
+            for name, text in page['fields'].items():
+                _, _, width, lines, _, _ = NOTE_FIELDS[name]
+                text.set_text(fit_text(values[name], width, lines))
+            page['fields']['status'].set_color(status_color)
+            pdf.savefig(page['fig'])
+    return path, len(notes)
+
+def note_batches(path, filters):
+    # Lists of note dicts, NOTES_PER_PDF at a time, in export order
+    present = set(export_header(path))
+    missing = [column for column in NOTE_COLUMNS if column not in present]
+    if missing:
+        raise ValueError(f"{path} is missing delivery note column(s): {', '.join(missing)}")
+    optional = [column for column in NOTE_OPTIONAL if column in present]
+    check_key_filters(filters, [name for name, column in (('client', 'customer_id'), ('driver', 'driver_id'))
+                                if column in present], path)
+
+    batch = []
+    for chunk in read_export_chunks(path, NOTE_COLUMNS + optional, optional=optional):
+        times = parse_timestamps(chunk['created_at'])
+        keep = time_mask(times, filters)
+        for name, column in (('client', 'customer_id'), ('driver', 'driver_id')):
+            if filters.get(name) is not None:
+                keep &= hash_ids(chunk[column].fillna('')) == filters[name]
+        chunk = chunk[keep].assign(time=times[keep])
+        for note in chunk.to_dict('records'):
+            batch.append({key: value for key, value in note.items() if not pd.isna(value)})
+            if len(batch) == NOTES_PER_PDF:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def render_delivery_notes(path, output_dir, jobs=None):
+    # Yields (pdf path, notes) as files finish
+    output_dir = os.path.join(output_dir, 'delivery_notes')
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = ((number, notes, output_dir)
+             for number, notes in enumerate(note_batches(path, RENDER_CONFIG['filters']), 1))
+    yield from stream_tasks(render_note_batch, tasks, jobs)
+
+# ETA ESTIMATES
+# Replayed ETAs for every consignment in a tracking_logs export
+# (consignment_id, latitude, longitude, timestamp, optionally driver_id and
+# status). Points are sorted by (consignment, time) and processed in blocks
+# of whole consignments; inside a block every step is one array operation:
+# haversine segment lengths, a running distance, the speed over the last
+# ETA_WINDOW_MS (found with one searchsorted on a (consignment, time) key)
+# and ETA = remaining distance / speed. The remaining distance is what a live
+# estimate could know: the great-circle distance to the destination times
+# ETA_ROUTE_FACTOR, the usual ratio of road to straight-line distance. The
+# destination and the arrival time are the first 'delivered' point when the
+# export has a status column, otherwise the last point, and every estimate
+# is scored against when the consignment actually arrived. Consignments that
+# never arrive inside the export are counted as active but not scored.
+# Errors land in a (time to arrival x error) histogram, so the percentiles
+# cost nothing extra. The sort needs every point of the export in memory
+# (five values each); the blocks bound only the per-point temporaries.
+EARTH_RADIUS_M = 6_371_008.8
+ETA_WINDOW_MS = 10 * 60 * 1000
+ETA_ROUTE_FACTOR = 1.3
+ETA_BLOCK_POINTS = 4_000_000
+MIN_MOVING_SPEED = 0.5  # m/s; slower than this the window speed is not trusted
+ETA_ERROR_STEP, ETA_HORIZON_STEP, SPEED_STEP = 0.5, 5, 1
+ETA_ERROR_EDGES = np.arange(-120, 120 + ETA_ERROR_STEP, ETA_ERROR_STEP)  # minutes, clipped at the ends
+ETA_HORIZON_EDGES = np.arange(0, 180 + ETA_HORIZON_STEP, ETA_HORIZON_STEP)  # minutes to arrival; the last row is 3h+
+SPEED_EDGES = np.arange(0, 150 + SPEED_STEP, SPEED_STEP)  # km/h
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def load_consignment_tracks(path, filters):
+    header = set(export_header(path))
+    check_key_filters(filters, ['driver'] if 'driver_id' in header else [], 'tracking logs')
+    optional = [column for column in ('driver_id', 'status') if column in header]
+    columns = ['consignment_id', 'latitude', 'longitude', 'timestamp'] + optional
+
+    parts = {'consignment': [], 'time': [], 'lat': [], 'lon': [], 'delivered': []}
+    for chunk, times in read_export_window(path, columns, 'timestamp', filters, optional):
+        keep = np.ones(len(chunk), dtype=bool)
+        if filters.get('driver') is not None:
+            keep = hash_ids(chunk['driver_id'].fillna('')) == filters['driver']
+        parts['consignment'].append(hash_ids(chunk['consignment_id'])[keep])
+        parts['time'].append(times[keep])
+        parts['lat'].append(pd.to_numeric(chunk['latitude'], errors='coerce').to_numpy()[keep])
+        parts['lon'].append(pd.to_numeric(chunk['longitude'], errors='coerce').to_numpy()[keep])
+        if 'status' in chunk:
+            parts['delivered'].append((chunk['status'] == 'delivered').to_numpy()[keep])
+    if not parts['consignment']:
+        raise ValueError(f'{path} has no tracking points for the selected filters')
+
+    has_status = 'status' in optional
+    points = {name: np.concatenate(values) for name, values in parts.items() if values}
+    valid = np.isfinite(points['lat']) & np.isfinite(points['lon'])
+    order = np.lexsort((points['time'][valid], points['consignment'][valid]))
+    points = {name: values[valid][order] for name, values in points.items()}
+    if not has_status:
+        points['delivered'] = None
+    return points
+
+def eta_block(consignment, time, lat, lon, delivered):
+    # Scores every point of a block of whole consignments; returns
+    # (minutes to arrival, error in minutes, scored-consignment count,
+    #  active-consignment count, segment speeds in km/h, distance travelled in m)
+    n = len(consignment)
+    new = np.r_[True, consignment[1:] != consignment[:-1]]
+    starts = np.flatnonzero(new)
+    group = np.cumsum(new) - 1
+    ends = np.r_[starts[1:], n] - 1
+
+    # Arrival: the first delivered point, or the last point without statuses
+    if delivered is None:
+        arrival = ends
+    else:
+        arrival = np.minimum.reduceat(np.where(delivered, np.arange(n), n), starts)
+    arrived = arrival < n
+    arrival_point = np.minimum(arrival, n - 1)[group]
+
+    # Running distance over the block with boundary segments zeroed, so the
+    # difference between two points of one consignment is what it travelled
+    segment = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    segment[new[1:]] = 0
+    distance = np.r_[0, np.cumsum(segment)]
+    seconds = np.diff(time) / 1000
+    timed = ~new[1:] & (seconds > 0)
+    speeds = segment[timed] / seconds[timed] * 3.6
+
+    # Window start of every point: the first point of the same consignment no
+    # more than ETA_WINDOW_MS earlier
+    offset = time - time[starts][group]
+    stride = int(offset.max()) + ETA_WINDOW_MS + 1
+    key = group.astype(np.int64) * stride + offset
+    window = np.searchsorted(key, key - ETA_WINDOW_MS)
+    elapsed = (time - time[window]) / 1000
+    speed = np.where(elapsed > 0, (distance - distance[window]) / np.where(elapsed > 0, elapsed, 1), 0)
+
+    # A stopped vehicle falls back to its average speed since the trip began
+    since_start = offset / 1000
+    travelled = distance - distance[starts][group]
+    average = np.where(since_start > 0, travelled / np.where(since_start > 0, since_start, 1), 0)
+    speed = np.where(speed >= MIN_MOVING_SPEED, speed, average)
+
+    scored = arrived[group] & (np.arange(n) < arrival_point) & (speed >= MIN_MOVING_SPEED)
+    remaining = haversine(lat, lon, lat[arrival_point], lon[arrival_point]) * ETA_ROUTE_FACTOR
+    predicted = remaining[scored] / speed[scored] / 60
+    actual = (time[arrival_point] - time)[scored] / 60000
+    return (actual, predicted - actual, int(arrived.sum()), int((~arrived).sum()),
+            speeds, float(segment.sum()))
+
+def binned_percentiles(counts, edges, quantiles):
+    # Middle of the bin holding each quantile, for every row of a 2-D histogram
+    counts = np.atleast_2d(counts)
+    cumulative = np.cumsum(counts, axis=1)
+    targets = np.asarray(quantiles)[None, :, None] * cumulative[:, -1][:, None, None]
+    ranks = np.minimum((cumulative[:, None, :] < targets).sum(axis=2), counts.shape[1] - 1)
+    middles = (edges[:-1] + edges[1:]) / 2
+    return np.where(cumulative[:, -1:] > 0, middles[ranks], np.nan)
+
+def eta_accuracy(path, filters):
+    key = ('eta', input_key(path), filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+    points = load_consignment_tracks(path, filters)
+    consignment = points['consignment']
+
+    rows, columns = len(ETA_HORIZON_EDGES), len(ETA_ERROR_EDGES) - 1
+    errors = np.zeros(rows * columns, dtype=np.int64)
+    speeds = np.zeros(len(SPEED_EDGES) - 1, dtype=np.int64)
+    totals = {'points': len(consignment), 'scored_points': 0, 'arrived': 0,
+              'active': 0, 'distance_km': 0.0, 'absolute_error': 0.0}
+
+    # Blocks end on consignment boundaries
+    starts = np.flatnonzero(np.r_[True, consignment[1:] != consignment[:-1]])
+    cuts = np.unique(starts[np.searchsorted(starts, np.arange(0, len(consignment), ETA_BLOCK_POINTS))])
+    for low, high in zip(cuts, np.r_[cuts[1:], len(consignment)]):
+        delivered = None if points['delivered'] is None else points['delivered'][low:high]
+        actual, error, arrived, active, segment_speeds, distance = eta_block(
+            consignment[low:high], points['time'][low:high],
+            points['lat'][low:high], points['lon'][low:high], delivered)
+        # The edges are evenly spaced, so a bin is one division
+        row = np.minimum(actual // ETA_HORIZON_STEP, rows - 1).astype(np.int64)
+        column = np.clip((error - ETA_ERROR_EDGES[0]) // ETA_ERROR_STEP, 0, columns - 1).astype(np.int64)
+        errors += np.bincount(row * columns + column, minlength=rows * columns)
+        speed_bins = (segment_speeds // SPEED_STEP).astype(np.int64)
+        speeds += np.bincount(speed_bins[speed_bins < len(speeds)], minlength=len(speeds))
+        totals['scored_points'] += len(error)
+        totals['arrived'] += arrived
+        totals['active'] += active
+        totals['distance_km'] += distance / 1000
+        totals['absolute_error'] += float(np.abs(error).sum())
+
+    result = {'errors': errors.reshape(rows, columns), 'speeds': speeds, 'totals': totals}
+    _input_cache[key] = result
+    return result
+
+# DRIVER ASSIGNMENT
+# Pending consignments matched to available drivers at the lowest total
+# pickup distance. Consignments come from a consignments export (id, status,
+# pickup_location as "lat,lng" or pickup_latitude/pickup_longitude, and
+# optionally driver_id, client_id, created_at); drivers are placed at their
+# last point in the tracking export, and a driver already holding an
+# assigned or in-transit consignment is not available. Distances are
+# straight lines on a local equirectangular projection, rounded to metres,
+# computed as one broadcast cost matrix.
+#
+# The matching is exact: scipy's linear_sum_assignment when scipy is
+# installed, otherwise an epsilon-scaling auction. Unassigned rows bid in
+# parallel, each over a short lookahead list of its best columns; prices only
+# rise, so the value of the first column left out of the list bounds every
+# column outside it, and a row is rescanned in full only when its list can
+# no longer prove its bid. Integer costs with a final epsilon below 1/n make
+# the result optimal. Past ASSIGNMENT_DENSE_CELLS the cost matrix is not
+# built and a greedy matcher takes the closest free pair first, working from
+# each consignment's nearest few drivers.
+ASSIGNMENT_DENSE_CELLS = 40_000_000
+ASSIGNMENT_BLOCK_CELLS = 8_000_000
+AUCTION_SCALING = 10
+AUCTION_LOOKAHEAD = 32
+GREEDY_CANDIDATES = 8
+BUSY_STATUSES = ('assigned', 'in_transit')
+COORDINATE_PATTERN = r'^\s*\(?\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\)?\s*$'
+
+def parse_coordinates(values):
+    # "lat,lng" text -> (lat, lon) arrays, NaN where the text is an address
+    parts = values.str.extract(COORDINATE_PATTERN)
+    lat = pd.to_numeric(parts[0], errors='coerce').to_numpy()
+    lon = pd.to_numeric(parts[1], errors='coerce').to_numpy()
+    valid = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    return np.where(valid, lat, np.nan), np.where(valid, lon, np.nan)
+
+def load_pending_consignments(path, filters):
+    header = set(export_header(path))
+    check_key_filters(filters, ['client'] if 'client_id' in header else [], 'consignments')
+    located = {'pickup_latitude', 'pickup_longitude'} <= header
+    optional = [column for column in ('driver_id', 'client_id', 'created_at') if column in header]
+    columns = ['id', 'status'] + (['pickup_latitude', 'pickup_longitude'] if located else ['pickup_location'])
+
+    parts = {'id': [], 'lat': [], 'lon': []}
+    busy = []
+    unlocated = 0
+    for chunk in read_export_chunks(path, columns + optional, optional=optional):
+        keep = np.ones(len(chunk), dtype=bool)
+        if 'created_at' in chunk:
+            keep = time_mask(parse_timestamps(chunk['created_at'].fillna('1970-01-01T00:00:00Z')), filters)
+        if filters.get('client') is not None:
+            keep &= hash_ids(chunk['client_id'].fillna('')) == filters['client']
+        if 'driver_id' in chunk:
+            holding = chunk['status'].isin(BUSY_STATUSES).to_numpy() & chunk['driver_id'].notna().to_numpy()
+            busy.append(hash_ids(chunk['driver_id'][holding]))
+        pending = chunk[keep & (chunk['status'] == 'pending').to_numpy()]
+        if located:
+            lat = pd.to_numeric(pending['pickup_latitude'], errors='coerce').to_numpy()
+            lon = pd.to_numeric(pending['pickup_longitude'], errors='coerce').to_numpy()
+        else:
+            lat, lon = parse_coordinates(pending['pickup_location'])
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        unlocated += int((~valid).sum())
+        parts['id'].append(pending['id'].to_numpy()[valid])
+        parts['lat'].append(lat[valid])
+        parts['lon'].append(lon[valid])
+    consignments = {name: np.concatenate(values) for name, values in parts.items()}
+    if not len(consignments['id']):
+        raise ValueError(f'{path} has no pending consignments with pickup coordinates')
+    consignments['unlocated'] = unlocated
+    consignments['busy'] = np.unique(np.concatenate(busy)) if busy else np.empty(0, dtype=np.uint64)
+    return consignments
+
+def driver_positions(tracks):
+    # Last known point of every driver (tracks are sorted by driver, time)
+    last = np.flatnonzero(np.r_[tracks['driver'][1:] != tracks['driver'][:-1], True])
+    return tracks['driver'][last], tracks['lat'][last], tracks['lon'][last]
+
+def project_points(lat, lon, middle):
+    # Local equirectangular projection in metres
+    return np.radians(lon) * np.cos(np.radians(middle)) * EARTH_RADIUS_M, np.radians(lat) * EARTH_RADIUS_M
+
+def distance_matrix(rx, ry, cx, cy):
+    cost = np.empty((len(rx), len(cx)), dtype=np.int64)
+    step = max(1, ASSIGNMENT_BLOCK_CELLS // max(len(cx), 1))
+    for low in range(0, len(rx), step):
+        high = low + step
+        cost[low:high] = np.rint(np.hypot(rx[low:high, None] - cx, ry[low:high, None] - cy))
+    return cost
+
+def top_two(values):
+    # Column and value of each row's best entry, and the second-best value
+    rows = np.arange(len(values))
+    best = np.argmax(values, axis=1)
+    first = values[rows, best]
+    values[rows, best] = -np.inf
+    return best, first, values.max(axis=1)
+
+def auction_assignment(cost):
+    # Column of every row of a square integer cost matrix, minimising the sum
+    n = len(cost)
+    if n == 1:
+        return np.zeros(1, dtype=np.int64)
+    # Subtracting row and column minima leaves the optimum unchanged and
+    # keeps the price scale small when every pickup is far from every driver
+    reduced = cost - cost.min(axis=1, keepdims=True)
+    benefit = -(reduced - reduced.min(axis=0)).astype(np.float64)
+    prices = np.zeros(n)
+    assigned = np.full(n, -1)
+    owner = np.full(n, -1)
+    lookahead = min(AUCTION_LOOKAHEAD, n - 1)
+    lists = np.zeros((n, lookahead), dtype=np.int64)
+    bound = np.full(n, np.inf)
+
+    def rescan(rows):
+        values = benefit[rows] - prices
+        part = np.argpartition(-values, lookahead, axis=1)
+        lists[rows] = part[:, :lookahead]
+        bound[rows] = np.take_along_axis(values, part[:, lookahead:lookahead + 1], axis=1)[:, 0]
+
+    eps = max(-float(benefit.min()) / AUCTION_SCALING, 1.0)
+    final = 1 / (n + 1)
+    while True:
+        # Assignments still within eps of their row's best survive the phase
+        held = np.flatnonzero(assigned >= 0)
+        if len(held):
+            columns = lists[held]
+            best = np.maximum((benefit[held[:, None], columns] - prices[columns]).max(axis=1), bound[held])
+            unhappy = held[benefit[held, assigned[held]] - prices[assigned[held]] < best - eps]
+            owner[assigned[unhappy]] = -1
+            assigned[unhappy] = -1
+
+        bidders = np.flatnonzero(assigned < 0)
+        while len(bidders):
+            columns = lists[bidders]
+            slot, first, second = top_two(benefit[bidders[:, None], columns] - prices[columns])
+            stale = second < bound[bidders]
+            if stale.any():
+                rows = bidders[stale]
+                rescan(rows)
+                columns[stale] = lists[rows]
+                slot[stale], first[stale], second[stale] = top_two(
+                    benefit[rows[:, None], lists[rows]] - prices[lists[rows]])
+                second[stale] = np.maximum(second[stale], bound[rows])
+            target = columns[np.arange(len(bidders)), slot]
+            bids = prices[target] + first - second + eps
+
+            # Each column goes to its highest bidder; its old owner bids again
+            order = np.lexsort((bids, target))
+            winners = order[np.r_[target[order][1:] != target[order][:-1], True]]
+            won = target[winners]
+            outbid = owner[won]
+            outbid = outbid[outbid >= 0]
+            assigned[outbid] = -1
+            prices[won] = bids[winners]
+            owner[won] = bidders[winners]
+            assigned[bidders[winners]] = won
+            waiting = np.ones(len(bidders), dtype=bool)
+            waiting[winners] = False
+            bidders = np.concatenate((bidders[waiting], outbid))
+        if eps <= final:
+            return assigned
+        eps = max(eps / AUCTION_SCALING, final)
+
+def augmenting_assignment(cost):
+    # Column of every row of a cost matrix with fewer rows than columns:
+    # one shortest augmenting path per row, each Dijkstra step a vector
+    # operation over the columns. Paths stay short while free columns are
+    # plentiful, which is where the auction is weakest.
+    n, m = cost.shape
+    cost = cost.astype(np.float64)
+    u, v = np.zeros(n), np.zeros(m)
+    row_of = np.full(m, -1)
+    column_of = np.full(n, -1)
+    for start in range(n):
+        shortest = np.full(m, np.inf)
+        path = np.full(m, -1)
+        open_columns = np.ones(m, dtype=bool)
+        visited = [start]
+        row, low, sink = start, 0.0, -1
+        while sink < 0:
+            reduced = low + cost[row] - u[row] - v
+            better = open_columns & (reduced < shortest)
+            shortest[better] = reduced[better]
+            path[better] = row
+            column = int(np.argmin(np.where(open_columns, shortest, np.inf)))
+            low = shortest[column]
+            open_columns[column] = False
+            if row_of[column] < 0:
+                sink = column
+            else:
+                row = row_of[column]
+                visited.append(row)
+
+        # Keep the reduced costs non-negative, then flip the path
+        visited = np.array(visited)
+        u[start] += low
+        u[visited[1:]] += low - shortest[column_of[visited[1:]]]
+        scanned = ~open_columns
+        v[scanned] -= low - shortest[scanned]
+        column = sink
+        while True:
+            row = path[column]
+            row_of[column] = row
+            column_of[row], column = column, column_of[row]
+            if row == start:
+                break
+    return column_of
+
+def optimal_assignment(cost):
+    # (rows, columns) of a minimum-cost matching of a rectangular matrix
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    if not cost.size:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if cost.shape[0] > cost.shape[1]:
+        columns, rows = optimal_assignment(cost.T)
+        order = np.argsort(rows)
+        return rows[order], columns[order]
+    if cost.shape[0] == cost.shape[1]:
+        return np.arange(len(cost)), auction_assignment(cost)
+    return np.arange(len(cost)), augmenting_assignment(cost)
+
+def nearest_candidates(rx, ry, cx, cy, k, cells):
+    # (row, column, distance) for up to k nearest columns of every row,
+    # searched in the 3x3 grid cells around the row; processed in row blocks
+    # of about ASSIGNMENT_BLOCK_CELLS pairs
+    west, south = min(rx.min(), cx.min()), min(ry.min(), cy.min())
+    size = max(max(rx.max(), cx.max()) - west, max(ry.max(), cy.max()) - south, 1.0) / cells
+    column_cell = (np.minimum((cy - south) // size, cells - 1) * cells +
+                   np.minimum((cx - west) // size, cells - 1)).astype(np.int64)
+    order = np.argsort(column_cell, kind='stable')
+    offsets = np.searchsorted(column_cell[order], np.arange(cells * cells + 1))
+    grid_x = np.minimum((rx - west) // size, cells - 1).astype(np.int64)
+    grid_y = np.minimum((ry - south) // size, cells - 1).astype(np.int64)
+
+    # Column range of each of the nine neighbour cells of every row
+    starts, counts = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            x, y = grid_x + dx, grid_y + dy
+            inside = (x >= 0) & (x < cells) & (y >= 0) & (y < cells)
+            cell = np.where(inside, y * cells + x, 0)
+            starts.append(offsets[cell])
+            counts.append(np.where(inside, offsets[cell + 1] - offsets[cell], 0))
+    starts, counts = np.column_stack(starts), np.column_stack(counts)
+    totals = counts.sum(axis=1)
+    bounds = np.searchsorted(np.cumsum(totals), np.arange(0, totals.sum(), ASSIGNMENT_BLOCK_CELLS), side='right')
+
+    rows, columns, lengths = [], [], []
+    for low, high in zip(np.r_[0, bounds[1:]], np.r_[bounds[1:], len(rx)]):
+        block_counts = counts[low:high].ravel()
+        if not block_counts.sum():
+            continue
+        owner = np.repeat(np.arange(low, high), totals[low:high])
+        first = np.repeat(starts[low:high].ravel(), block_counts)
+        position = np.arange(block_counts.sum()) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+        column = order[first + position]
+        distance = np.hypot(rx[owner] - cx[column], ry[owner] - cy[column])
+        ranked = np.lexsort((distance, owner))
+        owner, column, distance = owner[ranked], column[ranked], distance[ranked]
+        rank = np.arange(len(owner)) - np.searchsorted(owner, owner)
+        nearest = rank < k
+        rows.append(owner[nearest])
+        columns.append(column[nearest])
+        lengths.append(distance[nearest])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(lengths)
+
+def greedy_assignment(rx, ry, cx, cy):
+    # Closest free pair first, from each row's nearest few columns. Rows
+    # whose candidates were all taken look again among the columns still
+    # free; when a round matches little, as when every row sees the same few
+    # columns, the candidate count doubles and the grid cells grow with it
+    # until a single cell holds every column.
+    free_rows, free_columns = np.arange(len(rx)), np.arange(len(cx))
+    matched_rows, matched_columns = [], []
+    k = GREEDY_CANDIDATES
+    while len(free_rows) and len(free_columns):
+        k = min(k, len(free_columns))
+        cells = max(1, int(np.sqrt(len(free_columns) / k)))
+        rows, columns, lengths = nearest_candidates(rx[free_rows], ry[free_rows], cx[free_columns],
+                                                    cy[free_columns], k, cells)
+        order = np.argsort(lengths, kind='stable')
+        rows, columns = rows[order], columns[order]
+        match = np.full(len(free_rows), -1)
+        column_taken = np.zeros(len(free_columns), dtype=bool)
+        # A pair that comes first for both its row and its column would be
+        # taken by a sequential scan of the sorted pairs; taking all such
+        # pairs at once and repeating gives the same matching. When that
+        # stops paying off, as when every row wants the same column, the rest
+        # is scanned one pair at a time.
+        while len(rows):
+            first = np.zeros(len(rows), dtype=bool)
+            first[np.unique(rows, return_index=True)[1]] = True
+            column_first = np.zeros(len(rows), dtype=bool)
+            column_first[np.unique(columns, return_index=True)[1]] = True
+            first &= column_first
+            match[rows[first]] = columns[first]
+            column_taken[columns[first]] = True
+            keep = (match[rows] < 0) & ~column_taken[columns]
+            rows, columns = rows[keep], columns[keep]
+            if first.sum() < GREEDY_CANDIDATES:
+                break
+        left = min(len(free_rows), len(free_columns)) - column_taken.sum()
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            if not left:
+                break
+            if match[row] < 0 and not column_taken[column]:
+                match[row] = column
+                column_taken[column] = True
+                left -= 1
+        row_taken = match >= 0
+        matched_rows.append(free_rows[row_taken])
+        matched_columns.append(free_columns[match[row_taken]])
+        if row_taken.sum() < min(len(free_rows), len(free_columns)) / 4:
+            k *= 2
+        free_rows = free_rows[~row_taken]
+        free_columns = free_columns[~column_taken]
+    if not matched_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(matched_rows), np.concatenate(matched_columns)
+
+def driver_assignment(consignments_path, tracking_path, filters):
+    key = ('assignment', input_key(consignments_path), input_key(tracking_path), filter_key(filters))
+    if key in _input_cache:
+        return _input_cache[key]
+    consignments = load_pending_consignments(consignments_path, {name: value for name, value in filters.items()
+                                                                 if name != 'driver'})
+    tracks = load_tracks(tracking_path, {name: value for name, value in filters.items() if name != 'client'})
+    drivers, driver_lat, driver_lon = driver_positions(tracks)
+    free = ~np.isin(drivers, consignments['busy'])
+    drivers, driver_lat, driver_lon = drivers[free], driver_lat[free], driver_lon[free]
+
+    middle = np.median(np.r_[consignments['lat'], driver_lat])
+    rx, ry = project_points(consignments['lat'], consignments['lon'], middle)
+    cx, cy = project_points(driver_lat, driver_lon, middle)
+    greedy_rows, greedy_columns = greedy_assignment(rx, ry, cx, cy)
+    greedy_cost = np.hypot(rx[greedy_rows] - cx[greedy_columns], ry[greedy_rows] - cy[greedy_columns])
+    if not len(cx) or len(rx) * len(cx) > ASSIGNMENT_DENSE_CELLS:
+        rows, columns, method = greedy_rows, greedy_columns, 'greedy'
+    else:
+        rows, columns = optimal_assignment(distance_matrix(rx, ry, cx, cy))
+        method = 'optimal'
+
+    result = {
+        'consignment_lat': consignments['lat'], 'consignment_lon': consignments['lon'],
+        'driver_lat': driver_lat, 'driver_lon': driver_lon,
+        'rows': rows, 'columns': columns, 'method': method,
+        'distance': np.hypot(rx[rows] - cx[columns], ry[rows] - cy[columns]),
+        'greedy_distance': greedy_cost,
+        'unlocated': consignments['unlocated'], 'busy': int((~free).sum())
+    }
+    _input_cache[key] = result
+    return result
+
+# ROLLUP STORE
+# Hourly counts from raw exports, kept as NumPy structured arrays with one
+# .npy file per table and day:
+#   <store>/manifest.json                 ingested exports and watermarks
+#   <store>/<table>/YYYY-MM-DD.npy        (hour, client, driver, category, count)
+#   <store>/<table>/YYYY-MM-DD.idx.npz    per-key offset index of that day
+# Rows are sorted by hour, so a time window is a binary search inside the
+# first and last partition and whole partitions in between. The index holds,
+# for client and driver, the sorted distinct keys, offsets into a row list
+# grouped by key, and that row list; a --client query reads only the rows
+# of that client from a memory-mapped partition.
+# An export is read once: its digest is recorded and a second ingest of the
+# same file is skipped. Each source file (by path) keeps its own watermark,
+# the latest timestamp ingested from it and how many rows carried that
+# timestamp, so a cumulative export re-written to the same path only adds
+# rows after the watermark (and ties beyond those already counted). Other
+# sources feeding the same table, back-filled exports included, are not
+# affected. An export that had rows skipped is not recorded, so it can be
+# ingested again once the watermark is reset. Categories are the value at
+# the time the row was first ingested. The manifest also keeps, per table,
+# the keys (client, driver) every export that added rows carried; a
+# --client or --driver query on a table some of whose rows lack the key is
+# an error, as those rows would be silently left out.
+ROLLUP_TABLES = {
+    'consignments': {'category': 'status',
+                     'categories': ['pending', 'assigned', 'in_transit', 'delivered', 'cancelled']},
+    'users': {'category': 'role',
+              'categories': ['admin', 'other_admin', 'client', 'user', 'driver']},
+    # Any timestamped export (status history, messages, tracking logs, ...)
+    'activity': {'category': None, 'categories': []}
+}
+ROLLUP_KEYS = {'client': 'client_id', 'driver': 'driver_id'}
+ROLLUP_DTYPE = np.dtype([('hour', '<i8'), ('client', '<u8'), ('driver', '<u8'),
+                         ('category', 'i1'), ('count', '<i8')])
+ROLLUP_TIME_COLUMNS = ['created_at', 'timestamp', 'transaction_date', 'sent_at']
+HOUR_MS = 3_600_000
+
+def load_rollup_manifest(store):
+    path = os.path.join(store, 'manifest.json')
+    if not os.path.exists(path):
+        return {'exports': {}, 'watermarks': {}}
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    for table, mark in list(manifest['watermarks'].items()):
+        # Per-table watermarks of older stores apply to the sources they came from
+        if isinstance(mark, int):
+            manifest['watermarks'][table] = {
+                export['path']: {'time': mark, 'ties': 0}
+                for export in manifest['exports'].values() if export['table'] == table}
+    return manifest
+
+def save_rollup_manifest(store, manifest):
+    os.makedirs(store, exist_ok=True)
+    path = os.path.join(store, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def reduce_rollup(records):
+    # Sum the counts of rows sharing (hour, client, driver, category)
+    if not len(records):
+        return records
+    order = np.lexsort((records['category'], records['driver'], records['client'], records['hour']))
+    records = records[order]
+    changed = np.zeros(len(records), dtype=bool)
+    changed[0] = True
+    for name in ('hour', 'client', 'driver', 'category'):
+        changed[1:] |= records[name][1:] != records[name][:-1]
+    starts = np.flatnonzero(changed)
+    reduced = records[starts]
+    reduced['count'] = np.add.reduceat(records['count'], starts)
+    return reduced
+
+def write_partition(path, records):
+    np.save(path, records)
+    index = {}
+    for name in ROLLUP_KEYS:
+        rows = np.argsort(records[name], kind='stable')
+        keys, offsets = np.unique(records[name][rows], return_index=True)
+        index[name + '_keys'] = keys
+        index[name + '_offsets'] = np.r_[offsets, len(rows)]
+        index[name + '_rows'] = rows
+    np.savez(path[:-len('.npy')] + '.idx.npz', **index)
+
+def ingest_export(store, table, path):
+    spec = ROLLUP_TABLES[table]
+    manifest = load_rollup_manifest(store)
+    digest = file_digest(path)
+    if digest in manifest['exports']:
+        return None
+
+    header = set(export_header(path))
+    time_column = next((column for column in ROLLUP_TIME_COLUMNS if column in header), None)
+    if time_column is None:
+        raise ValueError(f"{path} has none of the time columns {', '.join(ROLLUP_TIME_COLUMNS)}")
+    keys = {name: column for name, column in ROLLUP_KEYS.items() if column in header}
+    columns = [time_column] + ([spec['category']] if spec['category'] else []) + list(keys.values())
+    source = os.path.abspath(path)
+    mark = manifest['watermarks'].get(table, {}).get(source)
+    ties = mark['ties'] if mark else 0
+    latest = latest_rows = None
+
+    parts = []
+    rows = skipped = 0
+    for chunk in read_export_chunks(path, columns, optional=list(keys.values())):
+        times = parse_timestamps(chunk[time_column])
+        if len(times):
+            newest = int(times.max())
+            at_newest = int((times == newest).sum())
+            if latest is None or newest > latest:
+                latest, latest_rows = newest, at_newest
+            elif newest == latest:
+                latest_rows += at_newest
+        if mark is None:
+            fresh = np.ones(len(times), dtype=bool)
+        else:
+            # Rows tied on the watermark beyond those already counted are new
+            fresh = times > mark['time']
+            tied = np.flatnonzero(times == mark['time'])
+            fresh[tied[ties:]] = True
+            ties = max(ties - len(tied), 0)
+        skipped += len(times) - int(fresh.sum())
+        if not fresh.any():
+            continue
+        part = np.zeros(int(fresh.sum()), dtype=ROLLUP_DTYPE)
+        part['hour'] = times[fresh] // HOUR_MS
+        if spec['category']:
+            # Unknown values are kept as -1 rather than dropped
+            codes, values = pd.factorize(chunk[spec['category']])
+            lookup = np.array([spec['categories'].index(value) if value in spec['categories'] else -1
+                               for value in values], dtype='i1')
+            part['category'] = lookup[codes][fresh]
+        for name, column in keys.items():
+            # Missing ids (an unassigned driver) stay 0
+            present = chunk[column].notna().to_numpy()
+            hashes = np.zeros(len(chunk), dtype=np.uint64)
+            hashes[present] = hash_ids(chunk[column][present])
+            part[name] = hashes[fresh]
+        part['count'] = 1
+        parts.append(reduce_rollup(part))
+        rows += len(part)
+
+    if parts:
+        # Merge the new counts into the day partitions they fall in
+        records = reduce_rollup(np.concatenate(parts))
+        days = records['hour'] // 24
+        table_dir = os.path.join(store, table)
+        os.makedirs(table_dir, exist_ok=True)
+        bounds = np.flatnonzero(np.r_[True, days[1:] != days[:-1], True])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            name = str(np.datetime64(int(days[start]), 'D')) + '.npy'
+            partition = records[start:end]
+            partition_path = os.path.join(table_dir, name)
+            if os.path.exists(partition_path):
+                partition = reduce_rollup(np.concatenate((np.load(partition_path), partition)))
+            write_partition(partition_path, partition)
+
+    if not skipped:
+        manifest['exports'][digest] = {'table': table, 'path': source, 'rows': rows}
+    if rows:
+        known = manifest.setdefault('keys', {}).get(table)
+        manifest['keys'][table] = sorted(set(keys) if known is None else set(known) & set(keys))
+    if latest is not None and (mark is None or latest >= mark['time']):
+        if mark is not None and latest == mark['time']:
+            latest_rows = max(latest_rows, mark['ties'])
+        manifest['watermarks'].setdefault(table, {})[source] = {'time': latest, 'ties': latest_rows}
+    save_rollup_manifest(store, manifest)
+    return rows, skipped
+
+def rollup_keys(store, table):
+    # Keys a query on the table can honour; stores from before the keys
+    # were recorded are taken at their word
+    return load_rollup_manifest(store).get('keys', {}).get(table, list(ROLLUP_KEYS))
+
+def rollup_tables(store):
+    # Tables that have been ingested at all; an empty query result on one of
+    # these means "nothing matched", not "no data"
+    return {table for table in ROLLUP_TABLES if os.path.isdir(os.path.join(store, table))}
+
+def partition_rows(path, filters):
+    records = np.load(path, mmap_mode='r')
+    rows = None
+    for name in ROLLUP_KEYS:
+        key = filters.get(name)
+        if key is None:
+            continue
+        if rows is None or len(rows):
+            index = np.load(path[:-len('.npy')] + '.idx.npz')
+            keys = index[name + '_keys']
+            position = np.searchsorted(keys, key)
+            if position == len(keys) or keys[position] != key:
+                return np.zeros(0, dtype=ROLLUP_DTYPE)
+            offsets = index[name + '_offsets']
+            found = np.sort(index[name + '_rows'][offsets[position]:offsets[position + 1]])
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+    if rows is not None:
+        # Ascending row numbers keep the hour order
+        records = records[rows]
+
+    hours = records['hour']
+    low, high = 0, len(hours)
+    if filters.get('since') is not None:
+        low = np.searchsorted(hours, filters['since'] // HOUR_MS)
+    if filters.get('until') is not None:
+        high = np.searchsorted(hours, -(-filters['until'] // HOUR_MS))
+    return np.array(records[low:high])
+
+def query_rollup(store, table, filters):
+    # Rows in the --from/--to window for the given client/driver
+    table_dir = os.path.join(store, table)
+    if not os.path.isdir(table_dir):
+        return np.zeros(0, dtype=ROLLUP_DTYPE)
+    names = sorted(name for name in os.listdir(table_dir) if name.endswith('.npy'))
+    low, high = 0, len(names)
+    if filters.get('since') is not None:
+        low = bisect.bisect_left(names, str(np.datetime64(filters['since'] // DAY_MS, 'D')))
+    if filters.get('until') is not None:
+        high = bisect.bisect_right(names, str(np.datetime64((filters['until'] - 1) // DAY_MS, 'D')) + '.npy')
+    parts = [partition_rows(os.path.join(table_dir, name), filters) for name in names[low:high]]
+    if not parts:
+        return np.zeros(0, dtype=ROLLUP_DTYPE)
+    return np.concatenate(parts)
+
+def rollup_months(records, categories):
+    # Month labels and a (month, category) count table
+    months = (records['hour'] // 24).astype('datetime64[D]').astype('datetime64[M]')
+    labels, index = np.unique(months, return_inverse=True)
+    keep = records['category'] >= 0
+    counts = np.bincount(index[keep] * categories + records['category'][keep],
+                         weights=records['count'][keep], minlength=len(labels) * categories)
+    return labels, counts.reshape(len(labels), categories)
+
+def empty_window(ax):
+    # Stands in for a panel whose table has no rows in the --from/--to window
+    ax.text(0.5, 0.5, 'No data in window', ha='center', va='center', transform=ax.transAxes,
+            fontsize=12, style='italic', color='#7f8c8d')
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+# CLIENT REPORTS
+# The evaluation dashboard per client for one month, from a consignments
+# export (client_id, status, created_at, optionally estimated_ and
+# actual_delivery_date, weight, driver_id). The export is read once: rows of
+# the report month and the months before it are kept, client ids become
+# dense codes (one factorize over the window) and every panel's numbers for
+# every client come from one bincount over a (client, bucket) key, so no
+# client is ever scanned on its own. Each pool worker builds the report
+# figure once and per client only updates its artists (bar heights, line
+# data, texts, limits):
+#   <output-dir>/client_reports/YYYY-MM/<client_id>.png
+REPORT_MONTHS = 6
+REPORT_KPIS = ['Delivered', 'On Time', 'Cancelled', 'Open']
+LEAD_TIME_EDGES = np.array([0, 1, 2, 3, 5, 7, 14])  # days
+LEAD_TIME_LABELS = ['<1d', '1-2d', '2-3d', '3-5d', '5-7d', '1-2w', '2w+']
+
+def report_window(month):
+    # First month shown and the month after the report month
+    month = np.datetime64(month, 'M')
+    return month - (REPORT_MONTHS - 1), month + 1
+
+def month_ms(month):
+    return int(month.astype('datetime64[ms]').astype('int64'))
+
+def optional_times(chunk, column):
+    # Epoch ms as floats, NaN where the export has no value
+    times = np.full(len(chunk), np.nan)
+    if column in chunk:
+        present = chunk[column].notna().to_numpy()
+        times[present] = parse_timestamps(chunk[column][present])
+    return times
+
+def client_report_stats(path, month, filters):
+    header = set(export_header(path))
+    missing = [column for column in ('client_id', 'status', 'created_at') if column not in header]
+    if missing:
+        raise ValueError(f"{path} is missing consignment column(s): {', '.join(missing)}")
+    optional = [column for column in ('estimated_delivery_date', 'actual_delivery_date', 'weight', 'driver_id')
+                if column in header]
+    check_key_filters(filters, ['client'] + (['driver'] if 'driver_id' in header else []), path)
+    cache_key = ('client_reports', input_key(path), month, filter_key(filters))
+    if cache_key in _input_cache:
+        return _input_cache[cache_key]
+
+    first, end = report_window(month)
+    categories = ROLLUP_TABLES['consignments']['categories']
+    parts = {'client': [], 'time': [], 'status': [], 'lead': [], 'late': [], 'weight': []}
+    for chunk in read_export_chunks(path, ['client_id', 'status', 'created_at'] + optional, optional=optional):
+        times = parse_timestamps(chunk['created_at'])
+        keep = (times >= month_ms(first)) & (times < month_ms(end))
+        for name, column in (('client', 'client_id'), ('driver', 'driver_id')):
+            if filters.get(name) is not None:
+                keep &= hash_ids(chunk[column].fillna('')) == filters[name]
+        chunk, times = chunk[keep], times[keep]
+        # Days from booking to delivery, and whether delivery beat the estimate
+        delivered = optional_times(chunk, 'actual_delivery_date')
+        estimated = optional_times(chunk, 'estimated_delivery_date')
+        parts['client'].append(chunk['client_id'].to_numpy())
+        parts['time'].append(times)
+        parts['status'].append(pd.Categorical(chunk['status'], categories=categories).codes)
+        parts['lead'].append((delivered - times) / DAY_MS)
+        parts['late'].append(np.where(np.isnan(delivered) | np.isnan(estimated), np.nan, delivered > estimated))
+        parts['weight'].append(pd.to_numeric(chunk['weight'], errors='coerce').fillna(0).to_numpy()
+                               if 'weight' in chunk else np.zeros(len(chunk)))
+    rows = {name: np.concatenate(values) if values else np.zeros(0) for name, values in parts.items()}
+
+    codes, clients = pd.factorize(rows['client'])
+    count = len(clients)
+    months = (rows['time'].astype('datetime64[ms]').astype('datetime64[M]') - first).astype(int)
+    statuses = len(categories)
+    known = rows['status'] >= 0
+    monthly = np.bincount((codes * REPORT_MONTHS + months)[known] * statuses + rows['status'][known],
+                          minlength=count * REPORT_MONTHS * statuses).reshape(count, REPORT_MONTHS, statuses)
+
+    # The report month on its own
+    current = months == REPORT_MONTHS - 1
+    code, times = codes[current], rows['time'][current]
+    days = int((end.astype('datetime64[D]') - (end - 1).astype('datetime64[D]')).astype(int))
+    day = (times - month_ms(end - 1)) // DAY_MS
+    lead, late = rows['lead'][current], rows['late'][current]
+    timed, judged = np.isfinite(lead), np.isfinite(late)
+    buckets = np.searchsorted(LEAD_TIME_EDGES, np.maximum(lead[timed], 0), side='right') - 1
+    stats = {
+        'clients': np.asarray(clients),
+        'monthly': monthly,
+        'hourly': np.bincount(code * 24 + (times // HOUR_MS) % 24, minlength=count * 24).reshape(count, 24),
+        'daily': np.bincount(code * days + day, minlength=count * days).reshape(count, days),
+        'lead_times': np.bincount(code[timed] * len(LEAD_TIME_LABELS) + buckets,
+                                  minlength=count * len(LEAD_TIME_LABELS)).reshape(count, -1),
+        'on_time': np.bincount(code[judged], weights=late[judged] == 0, minlength=count),
+        'judged': np.bincount(code[judged], minlength=count),
+        'weight': np.bincount(code, weights=rows['weight'][current], minlength=count)
+    }
+    _input_cache[cache_key] = stats
+    return stats
+
+def client_report_page(month):
+    # The report figure of this worker, built once per month and brand
+    brand = RENDER_CONFIG['brand']
+    key = ('client_report', month, brand['name'] if brand else None)
+    if key in _template_cache:
+        return _template_cache[key]
+    first, end = report_window(month)
+    month_names = [str(label.astype(object).strftime('%b %Y')) for label in np.arange(first, end)]
+    days = int((end.astype('datetime64[D]') - (end - 1).astype('datetime64[D]')).astype(int))
+
+    fig = Figure(figsize=(16, 12))
+    gs = gridspec.GridSpec(3, 3, figure=fig)
+    page = {'fig': fig, 'title': fig.suptitle(f'Monthly Client Report\n{month_names[-1]}',
+                                              fontsize=20, fontweight='bold')}
+
+    # 1. Key performance indicators, % of the month's consignments
+    ax = page['kpi_axes'] = fig.add_subplot(gs[0, 0])
+    page['kpis'] = ax.bar(REPORT_KPIS, np.zeros(len(REPORT_KPIS)),
+                          color=['#2ecc71', '#3498db', '#e74c3c', '#f39c12'])
+    page['kpi_labels'] = [ax.text(bar.get_x() + bar.get_width() / 2, 0, '', ha='center', va='bottom',
+                                  fontweight='bold') for bar in page['kpis']]
+    ax.set_title('Key Performance Indicators', fontweight='bold')
+    ax.set_ylabel('Percentage (%)')
+    ax.set_ylim(0, 110)
+
+    # 2. Booking to delivery
+    ax = page['lead_axes'] = fig.add_subplot(gs[0, 1])
+    page['lead_times'] = ax.bar(LEAD_TIME_LABELS, np.zeros(len(LEAD_TIME_LABELS)), color='#9b59b6')
+    ax.set_title('Delivery Lead Time', fontweight='bold')
+    ax.set_ylabel('Consignments')
+
+    # 3. Bookings by hour of day
+    ax = page['hourly_axes'] = fig.add_subplot(gs[0, 2])
+    hours = np.arange(24)
+    page['hourly'], = ax.plot(hours, np.zeros(24), marker='o', linewidth=2, markersize=4)
+    page['hourly_fill'] = ax.fill_between(hours, np.zeros(24), alpha=0.3)
+    ax.set_title('Bookings by Hour of Day', fontweight='bold')
+    ax.set_xlabel('Hour of Day')
+    ax.set_ylabel('Consignments')
+    ax.set_xlim(0, 23)
+    ax.grid(True, alpha=0.3)
+
+    # 4. Monthly delivery statistics
+    ax = page['monthly_axes'] = fig.add_subplot(gs[1, :])
+    x = np.arange(REPORT_MONTHS)
+    width = 0.25
+    page['monthly'] = [ax.bar(x + offset, np.zeros(REPORT_MONTHS), width, label=label, color=color)
+                       for offset, label, color in ((-width, 'Completed', '#2ecc71'), (0, 'Pending', '#f39c12'),
+                                                    (width, 'Cancelled', '#e74c3c'))]
+    ax.set_title('Monthly Delivery Statistics', fontweight='bold')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Number of Consignments')
+    ax.set_xticks(x)
+    ax.set_xticklabels(month_names)
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+
+    # 5. Consignments per day of the report month
+    ax = page['daily_axes'] = fig.add_subplot(gs[2, :2])
+    page['daily'] = ax.bar(np.arange(1, days + 1), np.zeros(days), color='#3498db')
+    ax.set_title(f'Daily Consignments - {month_names[-1]}', fontweight='bold')
+    ax.set_xlabel('Day of Month')
+    ax.set_ylabel('Consignments')
+    ax.set_xlim(0.4, days + 0.6)
+    ax.grid(True, alpha=0.3)
+
+    # 6. Summary
+    ax = fig.add_subplot(gs[2, 2])
+    ax.axis('off')
+    ax.set_title('Month Summary', fontweight='bold')
+    page['summary'] = ax.text(0.05, 0.9, '', transform=ax.transAxes, va='top', fontsize=12, family='monospace',
+                              bbox=dict(boxstyle="round,pad=0.6", facecolor='lightgray', alpha=0.5))
+
+    fig.tight_layout()
+    if brand:
+        apply_brand(fig, brand)
+    _template_cache[key] = page
+    return page
+
+def draw_client_report(page, month, client, stats):
+    monthly = stats['monthly']
+    current = monthly[-1]
+    total = int(current.sum())
+    share = 100 / max(total, 1)
+    kpis = [current[3] * share, 100 * stats['on_time'] / max(stats['judged'], 1),
+            current[4] * share, current[:3].sum() * share]
+    for bar, label, value in zip(page['kpis'], page['kpi_labels'], kpis):
+        bar.set_height(value)
+        label.set_y(value + 1)
+        label.set_text(f'{value:.0f}%')
+
+    for bar, value in zip(page['lead_times'], stats['lead_times']):
+        bar.set_height(value)
+    page['lead_axes'].set_ylim(0, max(stats['lead_times'].max(), 1) * 1.15)
+
+    hourly = stats['hourly']
+    page['hourly'].set_ydata(hourly)
+    hours = np.arange(24)
+    page['hourly_fill'].set_verts([np.c_[np.r_[hours, hours[::-1]], np.r_[hourly, np.zeros(24)]]])
+    page['hourly_axes'].set_ylim(0, max(hourly.max(), 1) * 1.15)
+
+    columns = (monthly[:, 3], monthly[:, :3].sum(axis=1), monthly[:, 4])
+    for bars, values in zip(page['monthly'], columns):
+        for bar, value in zip(bars, values):
+            bar.set_height(value)
+    page['monthly_axes'].set_ylim(0, max(max(values.max() for values in columns), 1) * 1.15)
+
+    for bar, value in zip(page['daily'], stats['daily']):
+        bar.set_height(value)
+    page['daily_axes'].set_ylim(0, max(stats['daily'].max(), 1) * 1.15)
+
+    previous = int(monthly[-2].sum())
+    change = f'{(total - previous) / previous:+.0%}' if previous else 'n/a'
+    page['summary'].set_text(f"Consignments {total:>10,}\n"
+                             f"Delivered    {int(current[3]):>10,}\n"
+                             f"Cancelled    {int(current[4]):>10,}\n"
+                             f"Open         {int(current[:3].sum()):>10,}\n"
+                             f"Weight (kg)  {stats['weight']:>10,.0f}\n"
+                             f"vs last month{change:>10}")
+    page['title'].set_text(f"Monthly Client Report - {client}\n"
+                           f"{np.datetime64(month, 'M').astype(object).strftime('%B %Y')}")
+
+def render_client_report(task):
+    client, stats, output_dir = task
+    month = RENDER_CONFIG['report_month']
+    page = client_report_page(month)
+    draw_client_report(page, month, client, stats)
+    RENDER_CONFIG['output_dir'] = output_dir
+    return client, save_figure(page['fig'], re.sub(r'[^\w.-]', '_', client) + '.png', keep=True)
+
+def render_client_reports(path, month, output_dir, jobs=None):
+    # Yields (done, total, client, png path) as reports finish
+    stats = client_report_stats(path, month, RENDER_CONFIG['filters'])
+    clients = stats['clients']
+    output_dir = os.path.join(output_dir, 'client_reports', month)
+    tasks = ((client, {name: values[i] for name, values in stats.items() if name != 'clients'}, output_dir)
+             for i, client in enumerate(clients))
+    for done, (client, report) in enumerate(stream_tasks(render_client_report, tasks, jobs), 1):
+        yield done, len(clients), client, report
+
+# RLS POLICIES
+# Who may do what, read from the row level security statements in the
+# Supabase SQL files. The files are replayed in order: CREATE POLICY adds a
+# policy, DROP POLICY removes it and ENABLE/DISABLE ROW LEVEL SECURITY switch
+# a table's checks, so a later fix script overrides the schema it patches.
+# Each policy's USING (or, for INSERT, WITH CHECK) expression is split at
+# top-level OR and AND, and every operand is rated per application role:
+#   role test        'admin' IN (...), role = 'driver', EXISTS (... role ...)
+#                    -> all rows for the listed roles, none for the rest
+#   auth.uid() test  -> the user's own rows, for every role
+#   true             -> all rows, for every role
+#   anything else    -> a filtered subset of rows, for every role
+# OR takes the best operand and AND the worst. A TO clause limits a policy
+# to the roles it names: public and authenticated (every signed-in user)
+# cover all application roles, other database roles only the application
+# role of the same name, so a policy TO anon or service_role covers none.
+# Permissive policies on the same table and command combine by best,
+# restrictive ones cap the result for the roles they apply to. The outcome
+# is a role x table x command array of 0 (none), 0.5 (own or filtered rows)
+# and 1 (all rows). CREATE POLICY does not turn RLS on: a table whose RLS
+# was never enabled (or was disabled) is open, and one that has policies
+# all the same is reported as unenforced.
+POLICY_FILES = ['supabase_database_schema.sql', 'supabase_fix_rls_recursion.sql']
+POLICY_ROLES = ['admin', 'other_admin', 'client', 'driver']
+POLICY_COMMANDS = ['select', 'insert', 'update', 'delete']
+PRIVILEGE_PAGE_ROWS = 40
+POLICY_PATTERN = re.compile(r'create\s+policy\s+("[^"]+"|\w+)\s+on\s+([\w."]+)(.*)', re.I | re.S)
+DROP_POLICY_PATTERN = re.compile(r'drop\s+policy\s+(?:if\s+exists\s+)?("[^"]+"|\w+)\s+on\s+([\w."]+)', re.I)
+RLS_PATTERN = re.compile(r'alter\s+table\s+(?:only\s+)?([\w."]+)\s+(enable|disable)\s+row\s+level\s+security', re.I)
+POLICY_TO_PATTERN = re.compile(r'\bto\s+(.*?)(?=\busing\s*\(|\bwith\s+check\s*\(|$)', re.I | re.S)
+ALL_ROLE_GRANTEES = {'public', 'authenticated', 'current_user', 'session_user'}
+ROLE_TEST_PATTERN = re.compile(r"role(?:\(\))?'?\s*\)?\s*(?:::\s*text\s*)?(?:in\s*\(([^)]*)\)|=\s*'([^']*)')",
+                               re.I)
+
+def sql_statements(text):
+    # Comments and dollar-quoted function bodies go first, so the semicolons
+    # left are statement ends
+    text = re.sub(r'\$(\w*)\$.*?\$\1\$', "''", text, flags=re.S)
+    text = re.sub(r'--[^\n]*', '', text)
+    return [statement.strip() for statement in text.split(';') if statement.strip()]
+
+def table_name(name):
+    return name.replace('"', '').split('.')[-1].lower()
+
+def parenthesised(text, start):
+    # Contents of the balanced parentheses opening at text[start]
+    depth = 0
+    for match in re.finditer(r"'[^']*'|\(|\)", text[start:]):
+        if match.group() == '(':
+            depth += 1
+        elif match.group() == ')':
+            depth -= 1
+            if not depth:
+                return text[start + 1:start + match.start()]
+    return text[start + 1:]
+
+def split_top_level(expression, keyword):
+    # Split at a keyword (or a punctuation separator such as ',') outside
+    # parentheses, array brackets and quotes
+    separator = r'\b' + keyword + r'\b' if keyword.isalpha() else re.escape(keyword)
+    parts, depth, last = [], 0, 0
+    for match in re.finditer(r"'[^']*'|[(\[]|[)\]]|" + separator, expression, re.I):
+        token = match.group()
+        if token in '([':
+            depth += 1
+        elif token in ')]':
+            depth -= 1
+        elif token.lower() == keyword and not depth:
+            parts.append(expression[last:match.start()])
+            last = match.end()
+    return [part.strip() for part in parts + [expression[last:]]]
+
+def policy_access(expression):
+    # Access level of every POLICY_ROLES role under one expression
+    terms = split_top_level(expression, 'or')
+    if len(terms) > 1:
+        return np.max([policy_access(term) for term in terms], axis=0)
+    factors = split_top_level(expression, 'and')
+    if len(factors) > 1:
+        return np.min([policy_access(factor) for factor in factors], axis=0)
+    if expression.startswith('(') and parenthesised(expression, 0) == expression[1:-1]:
+        return policy_access(expression[1:-1].strip())
+
+    roles = set()
+    for listed, single in ROLE_TEST_PATTERN.findall(expression):
+        roles.update(re.findall(r"'([^']*)'", listed) if listed else [single])
+    if roles:
+        if roles & {'authenticated', 'anon', 'public'}:
+            return np.ones(len(POLICY_ROLES))
+        return np.array([1.0 if role in roles else 0.0 for role in POLICY_ROLES])
+    if 'auth.uid()' in expression.lower():
+        return np.full(len(POLICY_ROLES), 0.5)
+    if expression.lower() == 'true':
+        return np.ones(len(POLICY_ROLES))
+    return np.full(len(POLICY_ROLES), 0.5)
+
+def parse_policy(body):
+    # (kind, commands, expression, applies) of the text after CREATE POLICY
+    # name ON table; applies marks the POLICY_ROLES the TO clause covers
+    kind = re.search(r'\bas\s+(permissive|restrictive)\b', body, re.I)
+    command = re.search(r'\bfor\s+(all|select|insert|update|delete)\b', body, re.I)
+    command = command.group(1).lower() if command else 'all'
+    commands = POLICY_COMMANDS if command == 'all' else [command]
+    using = re.search(r'\busing\s*\(', body, re.I)
+    check = re.search(r'\bwith\s+check\s*\(', body, re.I)
+    clause = check if command == 'insert' and check else using or check
+    expression = parenthesised(body, clause.end() - 1).strip() if clause else 'true'
+    # The TO clause sits before USING / WITH CHECK
+    grantees = POLICY_TO_PATTERN.search(body[:min(match.start() for match in (using, check) if match)]
+                                        if using or check else body)
+    applies = np.ones(len(POLICY_ROLES), dtype=bool)
+    if grantees:
+        names = {name.strip().strip('"').lower() for name in grantees.group(1).split(',')}
+        if not names & ALL_ROLE_GRANTEES:
+            applies = np.array([role in names for role in POLICY_ROLES])
+    return (kind.group(1).lower() if kind else 'permissive'), commands, expression, applies
+
+def load_policies(paths):
+    key = ('policies',) + tuple(input_key(path) for path in paths)
+    if key in _input_cache:
+        return _input_cache[key]
+    policies, rls = {}, {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            statements = sql_statements(f.read())
+        for statement in statements:
+            match = POLICY_PATTERN.match(statement)
+            if match:
+                table = table_name(match.group(2))
+                policies[(match.group(1).strip('"'), table)] = parse_policy(match.group(3))
+                rls.setdefault(table, False)
+                continue
+            match = DROP_POLICY_PATTERN.match(statement)
+            if match:
+                policies.pop((match.group(1).strip('"'), table_name(match.group(2))), None)
+                continue
+            match = RLS_PATTERN.match(statement)
+            if match:
+                rls[table_name(match.group(1))] = match.group(2).lower() == 'enable'
+
+    tables = sorted(rls)
+    index = {table: i for i, table in enumerate(tables)}
+    shape = (len(POLICY_ROLES), len(tables), len(POLICY_COMMANDS))
+    permissive, restrictive = np.zeros(shape), np.ones(shape)
+    for (name, table), (kind, commands, expression, applies) in policies.items():
+        levels = policy_access(expression)
+        for command in commands:
+            cell = (slice(None), index[table], POLICY_COMMANDS.index(command))
+            if kind == 'permissive':
+                permissive[cell] = np.maximum(permissive[cell], np.where(applies, levels, 0))
+            else:
+                restrictive[cell] = np.minimum(restrictive[cell], np.where(applies, levels, 1))
+    access = np.minimum(permissive, restrictive)
+    access[:, [not rls[table] for table in tables]] = 1
+    unenforced = sorted({table for _, table in policies if not rls[table]})
+    result = {'tables': tables, 'access': access, 'policies': len(policies), 'files': list(paths),
+              'unenforced': unenforced}
+    _input_cache[key] = result
+    return result
+
+def privilege_rows(tables, access):
+    # Tables x (role, command) rows, tables with the same rules side by side.
+    # Past one page, tables with identical rules share a row.
+    rows = access.transpose(1, 0, 2).reshape(len(tables), -1)
+    order = np.lexsort((np.arange(len(tables)),) + tuple(-rows.T[::-1]))
+    rows, tables = rows[order], [tables[i] for i in order]
+    if len(tables) <= PRIVILEGE_PAGE_ROWS:
+        return tables, rows
+    patterns, first, group = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    group = group.ravel()
+    labels = []
+    for g in np.argsort(first):
+        members = [tables[i] for i in np.flatnonzero(group == g)]
+        labels.append(members[0] + (f' +{len(members) - 1}' if len(members) > 1 else ''))
+    return labels, patterns[np.argsort(first)]
+
+# EDGE ROUTING
+# Orthogonal connectors between boxes (schema tables) that go around other
+# boxes instead of through them. The canvas is cut by grid lines at every
+# box edge plus a margin, at every port row and at a coarse pitch; each
+# grid cell whose centre falls inside a box is occupied. Step costs are
+# built once as NumPy arrays: the segment length, infinite through an
+# occupied cell, and extra for every edge already routed along it so later
+# edges spread out. A* then searches (node, heading) states with a penalty
+# per bend and the Manhattan distance to the target as heuristic. An edge
+# leaves its source box sideways at the source row and enters its target
+# sideways at the target row, on whichever side is cheaper.
+ROUTE_MARGIN = 0.2  # clearance kept around boxes, in data units
+ROUTE_LINES = 60  # coarse grid lines per axis on top of the box and port lines
+ROUTE_BEND_COST = 0.6  # a bend costs as much as this much extra length
+ROUTE_SHARED_COST = 0.8  # extra cost per unit length for each edge already on a segment
+ROUTE_STEPS = [(1, 0), (0, 1), (-1, 0), (0, -1)]  # east, north, west, south
+
+def routing_grid(boxes, rows, bounds):
+    west, south, east, north = bounds
+    pitch = max(east - west, north - south) / ROUTE_LINES
+    # Rounded, so lines a float error apart do not make zero-length steps
+    xs = np.unique(np.r_[west, east, boxes[:, 0] - ROUTE_MARGIN, boxes[:, 2] + ROUTE_MARGIN,
+                         np.arange(west, east, pitch)].clip(west, east).round(9))
+    ys = np.unique(np.r_[south, north, rows, np.arange(south, north, pitch)].clip(south, north).round(9))
+
+    # Rasterise the boxes onto the grid cells; a box is grown by a hair
+    # less than the margin so the margin lines themselves stay free
+    grow = ROUTE_MARGIN * 0.99
+    mid_x, mid_y = (xs[:-1] + xs[1:]) / 2, (ys[:-1] + ys[1:]) / 2
+    cells = np.zeros((len(ys) + len(mid_y), len(xs) + len(mid_x)), dtype=bool)
+    line_x, line_y = np.r_[xs, mid_x], np.r_[ys, mid_y]
+    order_x, order_y = np.argsort(line_x), np.argsort(line_y)
+    for x0, y0, x1, y1 in boxes:
+        i0, i1 = np.searchsorted(line_x[order_x], (x0 - grow, x1 + grow), side='right')
+        j0, j1 = np.searchsorted(line_y[order_y], (y0 - grow, y1 + grow), side='right')
+        cells[np.ix_(order_y[j0:j1], order_x[i0:i1])] = True
+
+    # Cost of the segment east of / north of every node, blocked where the
+    # segment midpoint is occupied. The last column / row is infinite, so
+    # stepping off the grid needs no bounds check.
+    horizontal = np.full((len(ys), len(xs)), np.inf)
+    horizontal[:, :-1] = np.where(cells[:len(ys), len(xs):], np.inf, np.diff(xs)[None, :])
+    vertical = np.full((len(ys), len(xs)), np.inf)
+    vertical[:-1] = np.where(cells[len(ys):, :len(xs)], np.inf, np.diff(ys)[:, None])
+    return {'xs': xs, 'ys': ys, 'base': [horizontal.ravel().tolist(), vertical.ravel().tolist()],
+            'cost': [horizontal.ravel().tolist(), vertical.ravel().tolist()],
+            'used': [[0] * horizontal.size, [0] * vertical.size]}
+
+def route_edge(grid, starts, goals):
+    # starts: (i, j, heading) states leaving the source box; goals:
+    # {(i, j): heading into the target box}. Nodes are j * nx + i and
+    # states node * 4 + heading. Returns the node path.
+    xs, ys = grid['xs'], grid['ys']
+    nx = len(xs)
+    horizontal, vertical = grid['cost']
+    hx = np.min([np.abs(xs - xs[i]) for i, j in goals], axis=0).tolist()
+    hy = np.min([np.abs(ys - ys[j]) for i, j in goals], axis=0).tolist()
+    finish = {(j * nx + i): heading for (i, j), heading in goals.items()}
+    # Per heading: segment costs, offset of the segment from the node, node step
+    moves = [(horizontal, 0, 1), (vertical, 0, nx), (horizontal, -1, -1), (vertical, -nx, -nx)]
+    turns = [[(heading, 0.0), ((heading + 1) % 4, ROUTE_BEND_COST), ((heading + 3) % 4, ROUTE_BEND_COST)]
+             for heading in range(4)]
+
+    best, parent, queue = {}, {}, []
+    for i, j, heading in starts:
+        state = (j * nx + i) * 4 + heading
+        best[state], parent[state] = 0.0, -1
+        heapq.heappush(queue, (hx[i] + hy[j], 0.0, state))
+    end, end_cost = -1, np.inf
+    while queue:
+        estimate, g, state = heapq.heappop(queue)
+        if estimate >= end_cost:
+            break
+        g = -g
+        if g > best[state]:
+            continue
+        node, heading = state >> 2, state & 3
+        if node in finish:
+            # Finish by turning into the target box if needed
+            total = g + (0 if heading == finish[node] else ROUTE_BEND_COST)
+            if total < end_cost:
+                end, end_cost = state, total
+        for direction, bend in turns[heading]:
+            costs, offset, step = moves[direction]
+            total = g + costs[node + offset] + bend
+            neighbour = (node + step) * 4 + direction
+            if total < best.get(neighbour, np.inf):
+                best[neighbour], parent[neighbour] = total, state
+                # Ties go to the deeper state
+                heapq.heappush(queue, (total + hx[(node + step) % nx] + hy[(node + step) // nx], -total,
+                                       neighbour))
+    if end < 0:
+        return None
+    path = []
+    while end >= 0:
+        path.append(((end >> 2) % nx, (end >> 2) // nx))
+        end = parent[end]
+    return path[::-1]
+
+def route_edges(boxes, edges, bounds):
+    # edges: (source box, source row y, target box, target row y). Returns a
+    # polyline of corner points per edge, None where no route exists.
+    boxes = np.asarray(boxes, dtype=float)
+    rows = np.array([y for edge in edges for y in (edge[1], edge[3])])
+    grid = routing_grid(boxes, rows, bounds)
+    xs, ys = grid['xs'], grid['ys']
+    nx = len(xs)
+
+    def sides(box, y):
+        # Grid nodes just outside the left and right side of a box at row y
+        j = int(np.searchsorted(ys, round(y, 9)))
+        return ((int(np.searchsorted(xs, round(boxes[box, 0] - ROUTE_MARGIN, 9))), j, 2),
+                (int(np.searchsorted(xs, round(boxes[box, 2] + ROUTE_MARGIN, 9))), j, 0))
+
+    # Short edges first, so they keep the direct routes
+    length = [abs(boxes[s, 0] - boxes[t, 0]) + abs(y0 - y1) for s, y0, t, y1 in edges]
+    routes = [None] * len(edges)
+    for index in np.argsort(length, kind='stable'):
+        source, source_y, target, target_y = edges[index]
+        starts = sides(source, source_y)
+        goals = {(i, j): (heading + 2) % 4 for i, j, heading in sides(target, target_y)}
+        path = route_edge(grid, starts, goals)
+        if path is None:
+            continue
+        for (i0, j0), (i1, j1) in zip(path[:-1], path[1:]):
+            axis, segment = (0, j0 * nx + min(i0, i1)) if j0 == j1 else (1, min(j0, j1) * nx + i0)
+            grid['used'][axis][segment] += 1
+            grid['cost'][axis][segment] = grid['base'][axis][segment] * (1 + ROUTE_SHARED_COST *
+                                                                         grid['used'][axis][segment])
+
+        # Box side -> corners -> box side, with straight runs merged
+        points = np.array([(xs[i], ys[j]) for i, j in path])
+        first, last = points[0], points[-1]
+        points = np.vstack(([boxes[source, 0] if first[0] < boxes[source, 0] else boxes[source, 2], first[1]],
+                            points,
+                            [boxes[target, 0] if last[0] < boxes[target, 0] else boxes[target, 2], last[1]]))
+        before, after = points[1:-1] - points[:-2], points[2:] - points[1:-1]
+        turns = np.abs(before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]) > 1e-12
+        routes[index] = np.vstack((points[0], points[1:-1][turns], points[-1]))
+    return routes
+
+def draw_routes(ax, routes, labels, color='red'):
+    # All connectors as one line collection and one set of arrowheads; each
+    # label sits on the longest run of its connector. Returns the labels with
+    # the axis each may slide along and how far, for nudge_labels.
+    routes = [(route, label) for route, label in zip(routes, labels) if route is not None]
+    texts, slide, reach = [], [], []
+    if not routes:
+        return texts, slide, reach
+    ax.add_collection(LineCollection([route for route, _ in routes], colors=color, linewidths=1.5, zorder=2))
+    heads = []
+    for route, label in routes:
+        tip, back = route[-1], route[-2]
+        direction = (tip - back) / max(np.hypot(*(tip - back)), 1e-9)
+        normal = np.array([-direction[1], direction[0]])
+        heads.append(Polygon([tip, tip - 0.18 * direction + 0.07 * normal, tip - 0.18 * direction - 0.07 * normal]))
+        runs = np.hypot(*np.diff(route, axis=0).T)
+        start, end = route[np.argmax(runs)], route[np.argmax(runs) + 1]
+        middle = (start + end) / 2
+        texts.append(ax.text(middle[0], middle[1], label, ha='center', va='center', fontsize=8, fontweight='bold',
+                             zorder=4, bbox=dict(boxstyle="round,pad=0.2", facecolor='yellow', alpha=0.8)))
+        slide.append(np.abs(end - start) > 1e-9)
+        reach.append(np.abs(end - start) / 2)
+    ax.add_collection(PatchCollection(heads, facecolors=color, edgecolors='none', zorder=3))
+    return texts, slide, reach
+
+# LABEL PLACEMENT
+# Labels drawn at segment midpoints are moved apart after the layout is
+# final (after tight_layout, so data units map to the saved pixels). Every
+# label is measured once; labels and obstacle boxes then live in one array
+# of rectangles. Each pass sorts the rectangles by left edge and pairs each
+# with those whose left edge falls before its right edge (a sweep done with
+# one searchsorted and a repeat/gather), keeps the pairs that overlap in y
+# as well, and pushes both sides of every overlap apart along the axis that
+# needs the smaller move (a label caught in k overlaps takes the mean of its
+# k pushes); obstacles never move. A label may be limited to one axis
+# (labels on a connector slide along it) and to a reach from its anchor,
+# and stays inside the axes. Overlaps left after LABEL_PASSES are printed.
+LABEL_PAD = 3  # points kept clear around each label
+LABEL_PASSES = 60
+LABEL_CLEARANCE = 0.05  # extra push beyond the overlap, in label half sizes
+
+def label_extents(ax, texts):
+    # (x0, y0, x1, y1) of every text in data units, padded by LABEL_PAD
+    renderer = ax.figure.canvas.get_renderer()
+    pad = LABEL_PAD * ax.figure.dpi / 72
+    corners = np.array([text.get_window_extent(renderer).extents for text in texts]).reshape(-1, 4)
+    corners += (-pad, -pad, pad, pad)
+    inverse = ax.transData.inverted()
+    return np.hstack((inverse.transform(corners[:, :2]), inverse.transform(corners[:, 2:])))
+
+def overlapping_pairs(lo, hi):
+    # Index pairs of rectangles (lo, hi corners) that overlap, sweep on x
+    order = np.argsort(lo[:, 0], kind='stable')
+    left, right = lo[order, 0], hi[order, 0]
+    ends = np.searchsorted(left, right, side='left')
+    counts = np.maximum(ends - np.arange(len(order)) - 1, 0)
+    first = np.repeat(np.arange(len(order)), counts)
+    second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    a, b = order[first], order[second]
+    overlap = np.minimum(hi[a], hi[b]) - np.maximum(lo[a], lo[b])
+    keep = (overlap > 0).all(axis=1)
+    return a[keep], b[keep], overlap[keep]
+
+def nudge_labels(ax, texts, obstacles=(), slide=None, reach=None, name=''):
+    # texts: Text artists at their preferred places; obstacles: (x0, y0, x1,
+    # y1) boxes to keep off; slide: per label (sx, sy) in {0, 1}, the axes it
+    # may move along; reach: per label largest (dx, dy) from its anchor
+    # (default: its own size). Returns the number of unresolved overlaps.
+    if not len(texts):
+        return 0
+    extents = label_extents(ax, texts)
+    n = len(texts)
+    obstacles = np.asarray(obstacles, dtype=float).reshape(-1, 4)
+    half = np.vstack(((extents[:, 2:] - extents[:, :2]) / 2, (obstacles[:, 2:] - obstacles[:, :2]) / 2))
+    anchor = np.vstack(((extents[:, :2] + extents[:, 2:]) / 2, (obstacles[:, :2] + obstacles[:, 2:]) / 2))
+    weight = np.zeros_like(anchor)
+    weight[:n] = 1 if slide is None else np.asarray(slide, dtype=float)
+    reach = 2 * half[:n] if reach is None else np.asarray(reach, dtype=float)
+    limits = np.array([ax.get_xlim(), ax.get_ylim()]).T
+    lowest = np.minimum(limits.min(axis=0) + half[:n], anchor[:n])
+    highest = np.maximum(limits.max(axis=0) - half[:n], anchor[:n])
+
+    centre = anchor.copy()
+    for step in range(LABEL_PASSES + 1):
+        a, b, overlap = overlapping_pairs(centre - half, centre + half)
+        movable = ((weight[a] + weight[b]) > 0).any(axis=1)
+        a, b, overlap = a[movable], b[movable], overlap[movable]
+        if not len(a) or step == LABEL_PASSES:
+            break
+        # Separate along the cheaper axis either side can move on
+        cost = np.where((weight[a] + weight[b]) > 0, overlap, np.inf)
+        axis = np.argmin(cost, axis=1)
+        rows = np.arange(len(a))
+        distance = overlap[rows, axis] + LABEL_CLEARANCE * np.minimum(half[a, axis], half[b, axis])
+        side = np.sign(centre[a, axis] - centre[b, axis])
+        side[side == 0] = np.where(a < b, -1, 1)[side == 0]
+        share = weight[a, axis] / (weight[a, axis] + weight[b, axis])
+        push = np.zeros_like(centre)
+        np.add.at(push, (a, axis), side * distance * share)
+        np.add.at(push, (b, axis), -side * distance * (1 - share))
+        contacts = np.bincount(np.r_[a, b], minlength=len(centre))[:n, None]
+        centre[:n] += push[:n] * weight[:n] / np.maximum(contacts, 1)
+        centre[:n] = np.clip(centre[:n], anchor[:n] - reach, anchor[:n] + reach)
+        centre[:n] = np.clip(centre[:n], lowest, highest)
+
+    for text, shift in zip(texts, centre[:n] - anchor[:n]):
+        if shift.any():
+            x, y = text.get_position()
+            text.set_position((x + shift[0], y + shift[1]))
+    if len(a):
+        names = [f"'{texts[i].get_text().splitlines()[0]}'" for i in np.unique(np.r_[a, b]) if i < n]
+        print(f"⚠️  {name}: {len(a)} label overlap(s) left unresolved ({', '.join(names[:6])}"
+              f"{', …' if len(names) > 6 else ''})")
+    return len(a)
+
+# MIGRATION REPLAY
+# The schema as a plain dict model, built by replaying SQL files in order:
+#   {table: {'columns': {name: {'type', 'not_null', 'default', 'primary',
+#                               'unique', 'references'}},
+#            'constraints': {name: {'kind', 'columns', 'references', 'text'}}}}
+# CREATE TABLE (IF NOT EXISTS keeps a table that is already there), DROP
+# TABLE and ALTER TABLE ADD / DROP / ALTER / RENAME COLUMN, ADD / DROP
+# CONSTRAINT and RENAME TO are understood; other statements leave the model
+# alone. DDL inside a DO block is replayed as if its guard had passed.
+# Unnamed table constraints are keyed by kind and columns.
+# After every file the model is a checkpoint, keyed by a digest chained
+# over the contents of the files so far and kept in memory and as JSON in
+# <output-dir>/.schema_checkpoints/. A replay starts from the newest
+# checkpoint of its longest known prefix, so adding a migration applies
+# only that file; editing a file changes its digest and every one after it.
+MIGRATION_CACHE = '.schema_checkpoints'
+CREATE_TABLE_PATTERN = re.compile(r'create\s+table\s+(if\s+not\s+exists\s+)?([\w."]+)\s*\(', re.I)
+DROP_TABLE_PATTERN = re.compile(r'drop\s+table\s+(?:if\s+exists\s+)?(.*?)(?:\s+(?:cascade|restrict))?$', re.I | re.S)
+ALTER_TABLE_PATTERN = re.compile(r'alter\s+table\s+(?:if\s+exists\s+)?(?:only\s+)?([\w."]+)\s+(.*)', re.I | re.S)
+CONSTRAINT_PATTERN = re.compile(r'(?:constraint\s+("[^"]+"|\w+)\s+)?(primary\s+key|unique|foreign\s+key|check)\b\s*(.*)',
+                                re.I | re.S)
+REFERENCES_PATTERN = re.compile(r'\breferences\s+([\w."]+)', re.I)
+DO_BLOCK_PATTERN = re.compile(r'\bdo\s+\$(\w*)\$(.*?)\$\1\$', re.I | re.S)
+GUARDED_DDL_PATTERN = re.compile(r'\b(?:create|alter|drop)\s+table\b[^;]*', re.I)
+COLUMN_END = r'(?=\s+(?:not\s+null|null|default|primary|unique|references|check|constraint|generated|collate)\b|$)'
+TYPE_ALIASES = {'timestamptz': 'timestamp with time zone', 'int': 'integer', 'int4': 'integer', 'int8': 'bigint',
+                'bool': 'boolean', 'decimal': 'numeric', 'varchar': 'character varying', 'float8': 'double precision'}
+
+def normalised(text):
+    return ' '.join(text.lower().split())
+
+def migration_statements(text):
+    text = re.sub(r'--[^\n]*', '', text)
+    text = DO_BLOCK_PATTERN.sub(lambda match: ';' + ';'.join(GUARDED_DDL_PATTERN.findall(match.group(2))) + ';',
+                                text)
+    return sql_statements(text)
+
+def column_spec(item):
+    name, rest = (item.split(None, 1) + [''])[:2]
+    default = re.search(r'\bdefault\s+(.*?)' + COLUMN_END, rest, re.I | re.S)
+    references = REFERENCES_PATTERN.search(rest)
+    kind = re.match(r'(.*?)' + COLUMN_END, rest, re.I | re.S).group(1)
+    return name.strip('"').lower(), {
+        'type': re.sub(r'^\w+', lambda word: TYPE_ALIASES.get(word.group(), word.group()), normalised(kind)),
+        'not_null': bool(re.search(r'\bnot\s+null\b', rest, re.I)),
+        'default': normalised(default.group(1)) if default else None,
+        'primary': bool(re.search(r'\bprimary\s+key\b', rest, re.I)),
+        'unique': bool(re.search(r'\bunique\b', rest, re.I)),
+        'references': table_name(references.group(1)) if references else None}
+
+def constraint_spec(item):
+    # (key, spec) of a table constraint, None for anything else
+    match = CONSTRAINT_PATTERN.match(item.strip())
+    if not match:
+        return None
+    name, kind, rest = match.groups()
+    kind = kind.lower().split()[0]
+    columns = []
+    if kind != 'check' and rest.startswith('('):
+        columns = [column.strip().strip('"').lower() for column in parenthesised(rest, 0).split(',')]
+    parent = REFERENCES_PATTERN.search(rest) if kind == 'foreign' else None
+    spec = {'kind': kind, 'columns': columns, 'references': table_name(parent.group(1)) if parent else None,
+            'text': normalised(item)}
+    key = name.strip('"').lower() if name else f"{kind} ({', '.join(columns)})" if columns else spec['text']
+    return key, spec
+
+def table_spec(body):
+    table = {'columns': {}, 'constraints': {}}
+    for item in split_top_level(body, ','):
+        constraint = constraint_spec(item) if item else None
+        if constraint:
+            table['constraints'][constraint[0]] = constraint[1]
+        elif item and item.split()[0].lower() not in ('constraint', 'exclude', 'like'):
+            name, spec = column_spec(item)
+            table['columns'][name] = spec
+    return table
+
+def alter_table(table, action):
+    # Applies one ALTER TABLE action; returns the new name for RENAME TO
+    columns, constraints = table['columns'], table['constraints']
+    match = re.match(r'add\s+(?:column\s+)?(if\s+not\s+exists\s+)?(.*)', action, re.I | re.S)
+    if match:
+        constraint = constraint_spec(match.group(2))
+        if constraint:
+            constraints[constraint[0]] = constraint[1]
+            return None
+        name, spec = column_spec(match.group(2))
+        if name not in columns or not match.group(1):
+            columns[name] = spec
+        return None
+    match = re.match(r'drop\s+(column\s+|constraint\s+)?(?:if\s+exists\s+)?("[^"]+"|\w+)', action, re.I)
+    if match:
+        name = match.group(2).strip('"').lower()
+        if (match.group(1) or '').lower().startswith('constraint'):
+            constraints.pop(name, None)
+        elif columns.pop(name, None):
+            # Constraints on a dropped column go with it
+            for key in [key for key, spec in constraints.items() if name in spec['columns']]:
+                del constraints[key]
+        return None
+    match = re.match(r'alter\s+(?:column\s+)?("[^"]+"|\w+)\s+(.*)', action, re.I | re.S)
+    if match and match.group(1).strip('"').lower() in columns:
+        spec, change = columns[match.group(1).strip('"').lower()], match.group(2).strip()
+        kind = re.match(r'(?:set\s+data\s+)?type\s+(.*?)(?:\s+using\b.*)?$', change, re.I | re.S)
+        default = re.match(r'set\s+default\s+(.*)', change, re.I | re.S)
+        if kind:
+            spec['type'] = column_spec('x ' + kind.group(1))[1]['type']
+        elif default:
+            spec['default'] = normalised(default.group(1))
+        elif re.match(r'drop\s+default', change, re.I):
+            spec['default'] = None
+        elif re.match(r'(set|drop)\s+not\s+null', change, re.I):
+            spec['not_null'] = change.lower().startswith('set')
+        return None
+    match = re.match(r'rename\s+(column\s+|constraint\s+)?("[^"]+"|\w+)\s+to\s+("[^"]+"|\w+)', action, re.I)
+    if match:
+        part = 'constraints' if (match.group(1) or '').lower().startswith('constraint') else 'columns'
+        old, new = match.group(2).strip('"').lower(), match.group(3).strip('"').lower()
+        table[part] = {new if key == old else key: spec for key, spec in table[part].items()}
+        return None
+    match = re.match(r'rename\s+to\s+([\w."]+)', action, re.I)
+    return table_name(match.group(1)) if match else None
+
+def apply_statement(model, statement):
+    match = CREATE_TABLE_PATTERN.match(statement)
+    if match:
+        name = table_name(match.group(2))
+        if name not in model or not match.group(1):
+            model[name] = table_spec(parenthesised(statement, match.end() - 1))
+        return
+    match = DROP_TABLE_PATTERN.match(statement)
+    if match:
+        for name in match.group(1).split(','):
+            model.pop(table_name(name.strip()), None)
+        return
+    match = ALTER_TABLE_PATTERN.match(statement)
+    if match and table_name(match.group(1)) in model:
+        name = table_name(match.group(1))
+        for action in split_top_level(match.group(2), ','):
+            renamed = alter_table(model[name], action)
+            if renamed:
+                model[renamed] = model.pop(name)
+                name = renamed
+
+def schema_checkpoint(paths):
+    # Schema model after replaying paths in order; the result is shared with
+    # the checkpoint cache and must not be modified
+    digests, chain = [], ''
+    for path in paths:
+        chain = hashlib.sha256((chain + file_digest(path)).encode()).hexdigest()
+        digests.append(chain)
+    cache_dir = os.path.join(RENDER_CONFIG['output_dir'], MIGRATION_CACHE)
+    model, start = {}, 0
+    for k in range(len(paths), 0, -1):
+        key, stored = ('migration', digests[k - 1]), os.path.join(cache_dir, f'{digests[k - 1]}.json')
+        if key not in _input_cache and os.path.exists(stored):
+            with open(stored, encoding='utf-8') as f:
+                _input_cache[key] = json.load(f)
+        if key in _input_cache:
+            model, start = _input_cache[key], k
+            break
+
+    for k in range(start, len(paths)):
+        model = copy.deepcopy(model)
+        with open(paths[k], encoding='utf-8') as f:
+            for statement in migration_statements(f.read()):
+                apply_statement(model, statement)
+        _input_cache[('migration', digests[k])] = model
+        # Written aside and moved into place, so parallel renders never
+        # read a half-written checkpoint
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(model, f)
+        os.replace(temporary, os.path.join(cache_dir, f'{digests[k]}.json'))
+    return model
+
+def table_keys(table):
+    # Primary key columns, single-column unique columns and column -> parent
+    # table of a model table
+    primary, unique, references = set(), set(), {}
+    for column, spec in table['columns'].items():
+        if spec['primary']:
+            primary.add(column)
+        if spec['unique']:
+            unique.add(column)
+        if spec['references']:
+            references[column] = spec['references']
+    for spec in table['constraints'].values():
+        if spec['kind'] == 'primary':
+            primary.update(spec['columns'])
+        elif spec['kind'] == 'unique' and len(spec['columns']) == 1:
+            unique.update(spec['columns'])
+        elif spec['kind'] == 'foreign' and spec['references']:
+            references.update((column, spec['references']) for column in spec['columns'])
+    return primary, unique, references
+
+def field_label(column, primary, references):
+    marks = ['PK'] * (column in primary) + ['FK'] * (column in references)
+    return column + (f" ({', '.join(marks)})" if marks else '')
+
+def schema_tables(model):
+    # Tables ({'name', 'fields', 'color'}) and relationships (parent, child
+    # field, child, label) of the schema diagram
+    tables, relationships = [], []
+    for i, (name, table) in enumerate(model.items()):
+        primary, unique, references = table_keys(table)
+        fields = []
+        for column in table['columns']:
+            fields.append(field_label(column, primary, references))
+            if references.get(column) in model:
+                one = column in unique or primary == {column}
+                relationships.append((references[column], fields[-1], name, '1:1' if one else '1:N'))
+        tables.append({'name': name, 'fields': fields, 'color': SCHEMA_COLORS[i % len(SCHEMA_COLORS)]})
+    return tables, relationships
+
+# SCHEMA DIFF
+# What a range of migrations changed: the checkpoint before the range
+# against the one after it, drawn as schema tables. Only changed tables are
+# shown. An altered table keeps its unchanged columns for context; every
+# changed column or constraint row is marked (+ added, − removed, ~ altered,
+# with the attributes that changed) and coloured, and the table frame
+# carries the table's own status.
+DIFF_STYLES = {
+    'added': ('+', '#abebc6', '#27ae60'),
+    'removed': ('−', '#f5b7b1', '#c0392b'),
+    'altered': ('~', '#f9e79f', '#f39c12')
+}  # row prefix, row colour, table frame colour
+DIFF_LABEL_LENGTH = 26
+
+def constraint_label(key, spec):
+    columns = ', '.join(spec['columns'])
+    if spec['kind'] == 'foreign':
+        label = f"FK ({columns}) → {spec['references']}"
+    elif spec['kind'] == 'check':
+        label = 'CHECK ' + (key if key != spec['text'] else spec['text'][len('check'):].strip())
+    else:
+        label = f"{'PK' if spec['kind'] == 'primary' else 'UNIQUE'} ({columns})"
+    return label if len(label) <= DIFF_LABEL_LENGTH else label[:DIFF_LABEL_LENGTH - 1] + '…'
+
+def diff_tables(before, after):
+    # Changed tables as schema diagram tables with per-row 'marks', plus the
+    # number of added, removed and altered tables
+    tables, counts = [], dict.fromkeys(DIFF_STYLES, 0)
+    empty = {'columns': {}, 'constraints': {}}
+    for i, name in enumerate(list(after) + [name for name in before if name not in after]):
+        old, new = before.get(name), after.get(name)
+        if old == new:
+            continue
+        status = 'added' if old is None else 'removed' if new is None else 'altered'
+        old, new = old or empty, new or empty
+        primary, _, references = table_keys(old if status == 'removed' else new)
+        fields, marks = [], []
+        for part in ('columns', 'constraints'):
+            was, now = old[part], new[part]
+            for key in list(now) + [key for key in was if key not in now]:
+                if key in was and key in now and was[key] == now[key]:
+                    if part == 'columns':
+                        fields.append(field_label(key, primary, references))
+                        marks.append(None)
+                    continue
+                mark = 'added' if key not in was else 'removed' if key not in now else 'altered'
+                if part == 'columns':
+                    label = field_label(key, primary, references)
+                    if mark == 'altered':
+                        changed = [attribute.replace('_', ' ') for attribute in now[key]
+                                   if now[key][attribute] != was[key][attribute]]
+                        label += f" [{', '.join(changed)}]"
+                else:
+                    label = constraint_label(key, now.get(key) or was[key])
+                fields.append(f'{DIFF_STYLES[mark][0]} {label}')
+                marks.append(mark)
+        counts[status] += 1
+        tables.append({'name': name, 'fields': fields, 'marks': marks, 'frame': DIFF_STYLES[status][2],
+                       'color': SCHEMA_COLORS[i % len(SCHEMA_COLORS)]})
+    return tables, counts
+
+# SCHEMA LAYOUT
+# Table boxes of the database schema diagram are placed by a packer instead
+# of by hand. Tables come from the built-in documentation model or from
+# --schema SQL files replayed into a schema model, where foreign keys
+# become relationships. Tables linked by foreign keys form connected
+# components, packed largest first, and each component is walked breadth
+# first from its most linked table so neighbours come out next to each
+# other. Boxes go into page columns skyline style: each table drops into
+# the column with the most free space that fits it, with a penalty per
+# column away from its neighbours already on the page. A component that no
+# longer fits the rest of a page starts a new one; one taller than a page
+# spills over, and the relationships cut by the break are tagged on the
+# foreign key row with the page the parent table is on.
+SCHEMA_ROW_HEIGHT = 0.25
+SCHEMA_HEADER_HEIGHT = 0.4
+SCHEMA_GAP = 0.8  # vertical space between stacked tables
+SCHEMA_MAX_COLUMNS = 5
+SCHEMA_PAGE_HEIGHT = 24  # packing height of one page, in data units
+SCHEMA_NEIGHBOUR_COST = 1.5  # column depth worth one column of distance to a neighbour
+SCHEMA_COLORS = ['#3498db', '#e74c3c', '#2ecc71', '#f39c12', '#9b59b6', '#1abc9c', '#e67e22', '#95a5a6',
+                 '#34495e']
+
+def load_schema(paths):
+    # --schema files are replayed like migrations, so ALTER TABLE counts too
+    return schema_tables(schema_checkpoint(paths))
+
+def pack_tables(heights, links):
+    # heights: box heights, header included; links: (parent, child) index
+    # pairs. Returns the page, column and depth below the page top of every
+    # box, and the number of columns.
+    heights = np.asarray(heights, dtype=float)
+    n = len(heights)
+    columns = int(np.clip(np.ceil(np.sqrt(n)), 1, SCHEMA_MAX_COLUMNS))
+    neighbours = [[] for _ in range(n)]
+    root = list(range(n))
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    for parent, child in links:
+        if parent != child:
+            neighbours[parent].append(child)
+            neighbours[child].append(parent)
+            root[find(parent)] = find(child)
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    stacked = heights + SCHEMA_GAP
+    components = sorted(groups.values(), key=lambda members: (-stacked[members].sum(), members[0]))
+
+    page, column, depth = np.zeros(n, dtype=int), np.zeros(n, dtype=int), np.zeros(n)
+    placed = np.zeros(n, dtype=bool)
+    fill, current, lanes = np.zeros(columns), 0, np.arange(columns)
+    for members in components:
+        size = stacked[members].sum()
+        if fill.any() and (SCHEMA_PAGE_HEIGHT - fill).clip(0).sum() < size <= SCHEMA_PAGE_HEIGHT * columns:
+            current, fill = current + 1, np.zeros(columns)
+
+        # Breadth first from the most linked table, busiest neighbours first
+        order = [max(members, key=lambda i: (len(neighbours[i]), -i))]
+        seen = set(order)
+        for i in order:
+            for j in sorted(set(neighbours[i]) - seen, key=lambda j: (-len(neighbours[j]), j)):
+                seen.add(j)
+                order.append(j)
+
+        for i in order:
+            fits = fill + stacked[i] <= SCHEMA_PAGE_HEIGHT
+            if not fits.any():
+                if fill.any():
+                    current, fill = current + 1, np.zeros(columns)
+                # A box taller than a page gets an empty column to itself
+                fits = fill == 0
+            near = [column[j] for j in neighbours[i] if placed[j] and page[j] == current]
+            distance = np.abs(lanes[:, None] - near).min(axis=1) if near else 0
+            lane = int(np.argmin(np.where(fits, fill + SCHEMA_NEIGHBOUR_COST * distance, np.inf)))
+            page[i], column[i], depth[i], placed[i] = current, lane, fill[lane], True
+            fill[lane] += stacked[i]
+    return page, column, depth, columns
+
+def draw_schema_pages(tables, relationships, name, title, focus=None, legend=None, info=None):
+    # One figure per packed page, written as name.png, name_2.png, ...; the
+    # focus table, if any, gets a red header frame. A table may carry its own
+    # header 'frame' colour and per-field diff 'marks'; legend entries and
+    # the info box (title, text) default to the schema key and database info.
+    tables = [dict(table) for table in tables]
+    index = {table['name']: i for i, table in enumerate(tables)}
+    links = [(index[parent], index[child]) for parent, _, child, _ in relationships]
+
+    # Pack the boxes (header included) into pages of columns
+    heights = np.array([len(table['fields']) * SCHEMA_ROW_HEIGHT + 0.5 for table in tables])
+    page, column, depth, columns = pack_tables(heights + SCHEMA_HEADER_HEIGHT, links)
+    # Columns centred on the page, never further apart than three per page
+    centres = 8 + (np.arange(columns) - (columns - 1) / 2) * min(6, 12 / max(columns - 1, 1))
+    pages = page.max() + 1 if len(tables) else 1
+
+    def row_y(table, field):
+        # Primary key row for field None
+        fields = table['fields']
+        row = fields.index(field) if field else next((i for i, label in enumerate(fields) if '(PK' in label), 0)
+        return table['pos'][1] - 0.3 - row * SCHEMA_ROW_HEIGHT
+
+    for sheet in range(pages):
+        members = np.flatnonzero(page == sheet)
+        # Page content runs from y = 0 up to the deepest column; the strip
+        # below holds the legend and info box
+        top = (depth[members] + heights[members] + SCHEMA_HEADER_HEIGHT).max() if len(members) else 0
+        for i in members:
+            tables[i]['pos'] = (centres[column[i]], top - depth[i] - SCHEMA_HEADER_HEIGHT)
+        bottom = -2.2
+        fig, ax = plt.subplots(1, 1, figsize=(16, top + 2.2 - bottom))
+        ax.set_xlim(0, 16)
+        ax.set_ylim(bottom, top + 2.2)
+        ax.axis('off')
+
+        # Title
+        ax.text(8, top + 1.7, title + (f' ({sheet + 1}/{pages})' if pages > 1 else ''),
+                fontsize=18, fontweight='bold', ha='center')
+
+        # Draw tables
+        for i in members:
+            table, table_height = tables[i], heights[i]
+
+            # Table header
+            frame = table.get('frame') or ('red' if table['name'] == focus else None)
+            header_rect = Rectangle((table['pos'][0] - 1, table['pos'][1]), 2, SCHEMA_HEADER_HEIGHT,
+                                    facecolor=table['color'], edgecolor=frame or 'black', linewidth=4 if frame else 2)
+            ax.add_patch(header_rect)
+            ax.text(table['pos'][0], table['pos'][1] + 0.2, table['name'].upper(),
+                    ha='center', va='center', fontweight='bold', color='white',
+                    fontsize=min(10, 170 / max(len(table['name']), 1)))
+
+            # Table body
+            body_rect = Rectangle((table['pos'][0] - 1, table['pos'][1] - table_height), 2, table_height,
+                                  facecolor='white', edgecolor='black', linewidth=1)
+            ax.add_patch(body_rect)
+
+            # Table fields
+            for row, field in enumerate(table['fields']):
+                y_pos = table['pos'][1] - 0.3 - (row * SCHEMA_ROW_HEIGHT)
+
+                # Highlight diff marks, primary keys and foreign keys
+                if table.get('marks') and table['marks'][row]:
+                    field_color = DIFF_STYLES[table['marks'][row]][1]
+                    field_weight = 'bold'
+                elif '(PK' in field:
+                    field_color = 'gold'
+                    field_weight = 'bold'
+                elif '(FK)' in field:
+                    field_color = 'lightblue'
+                    field_weight = 'bold'
+                else:
+                    field_color = 'white'
+                    field_weight = 'normal'
+
+                # Field background
+                field_rect = Rectangle((table['pos'][0] - 0.95, y_pos - 0.1), 1.9, 0.2,
+                                       facecolor=field_color, alpha=0.7, edgecolor='gray', linewidth=0.5)
+                ax.add_patch(field_rect)
+
+                ax.text(table['pos'][0], y_pos, field, ha='center', va='center',
+                        fontsize=8, fontweight=field_weight)
+
+        # Relationships inside the page are routed around the tables; one
+        # whose parent is on another page is tagged on the foreign key row
+        local = {i: k for k, i in enumerate(members)}
+        edges, labels = [], []
+        for (parent, field, child, label), (p, c) in zip(relationships, links):
+            if page[c] != sheet or p == c:
+                continue
+            if page[p] == sheet:
+                edges.append((local[p], row_y(tables[p], None), local[c], row_y(tables[c], field)))
+                labels.append(label)
+            else:
+                ax.text(tables[c]['pos'][0] + 1.05, row_y(tables[c], field), f'→ {parent} (p. {page[p] + 1})',
+                        ha='left', va='center', fontsize=6, color='red', zorder=4,
+                        bbox=dict(boxstyle="round,pad=0.1", facecolor='white', edgecolor='none'))
+        boxes = np.array([(tables[i]['pos'][0] - 1, tables[i]['pos'][1] - heights[i], tables[i]['pos'][0] + 1,
+                           tables[i]['pos'][1] + SCHEMA_HEADER_HEIGHT) for i in members]).reshape(-1, 4)
+        routes = route_edges(boxes, edges, (0, -0.2, 16, top + 0.9))
+        route_texts, route_slide, route_reach = draw_routes(ax, routes, labels, color='red')
+
+        # Add legend
+        legend_elements = legend or [
+            {'color': 'gold', 'label': 'Primary Key (PK)'},
+            {'color': 'lightblue', 'label': 'Foreign Key (FK)'},
+            {'color': 'red', 'label': 'Relationship'}
+        ]
+
+        legend_y = bottom + 1.2
+        for i, element in enumerate(legend_elements):
+            legend_rect = Rectangle((0.5, legend_y - i*0.3), 0.3, 0.2,
+                                   facecolor=element['color'], alpha=0.7, edgecolor='black')
+            ax.add_patch(legend_rect)
+            ax.text(1, legend_y - i*0.3 + 0.1, element['label'],
+                   ha='left', va='center', fontsize=10, fontweight='bold')
+
+        # Add database info box
+        info_box = FancyBboxPatch((10, bottom + 0.2), 5.5, 1.5,
+                                 boxstyle="round,pad=0.2",
+                                 facecolor='lightgray', alpha=0.8,
+                                 edgecolor='black', linewidth=2)
+        ax.add_patch(info_box)
+        info_title, info_text = info or ('Database Information',
+                                         'Engine: PostgreSQL (Supabase)\nCharset: UTF-8\nTimezone: UTC')
+        ax.text(12.75, bottom + 1.2, info_title, ha='center', va='center',
+               fontsize=12, fontweight='bold')
+        ax.text(12.75, bottom + 0.8, info_text,
+               ha='center', va='center', fontsize=10)
+
+        plt.tight_layout()
+        nudge_labels(ax, route_texts, boxes, route_slide, route_reach, name=f'{name} page {sheet + 1}')
+        save_figure(fig, f'{name}.png' if not sheet else f'{name}_{sheet + 1}.png')
+
+# SCHEMA NEIGHBOURHOODS
+# Foreign keys as an undirected adjacency index in CSR form: the links of
+# table i are neighbours[offsets[i]:offsets[i + 1]]. It is built once per
+# render and answers every --focus table; a neighbourhood is a breadth
+# first search that expands the whole frontier per hop with one gather, so
+# only the tables within reach are ever touched, packed and drawn.
+def schema_graph(tables, relationships):
+    index = {table['name']: i for i, table in enumerate(tables)}
+    links = np.array([(index[parent], index[child]) for parent, _, child, _ in relationships],
+                     dtype=int).reshape(-1, 2)
+    pairs = np.vstack((links, links[:, ::-1]))
+    pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+    return {'index': index, 'links': links.tolist(),
+            'offsets': np.searchsorted(pairs[:, 0], np.arange(len(tables) + 1)), 'neighbours': pairs[:, 1]}
+
+def neighbourhood(graph, start, depth):
+    # Hops from start of every table, -1 beyond depth
+    offsets, neighbours = graph['offsets'], graph['neighbours']
+    hops = np.full(len(offsets) - 1, -1)
+    hops[start] = 0
+    frontier = np.array([start])
+    for hop in range(1, depth + 1):
+        counts = offsets[frontier + 1] - offsets[frontier]
+        if not counts.sum():
+            break
+        # Positions offsets[f]:offsets[f + 1] of every frontier table at once
+        positions = np.arange(counts.sum()) + np.repeat(offsets[frontier] - np.cumsum(counts) + counts, counts)
+        reached = np.unique(neighbours[positions])
+        frontier = reached[hops[reached] < 0]
+        hops[frontier] = hop
+    return hops
+
 # 1. SYSTEM ARCHITECTURE OVERVIEW
 def create_system_architecture():
     fig, ax = plt.subplots(1, 1, figsize=(16, 12))
@@ -126,8 +4259,7 @@ def create_system_architecture():
     ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(0.98, 0.98))
     
     plt.tight_layout()
-    plt.savefig('system_architecture.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'system_architecture.png')
 
 # 2. USER INTERACTION FLOW
 def create_user_interaction_flow():
@@ -220,8 +4352,7 @@ def create_user_interaction_flow():
             bbox=dict(boxstyle="round,pad=0.3", facecolor='lightyellow'))
     
     plt.tight_layout()
-    plt.savefig('user_interaction_flow.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'user_interaction_flow.png')
 
 # 3. SECURITY ARCHITECTURE
 def create_security_architecture():
@@ -243,14 +4374,10 @@ def create_security_architecture():
         {'name': 'User Security', 'rect': (2.5, 2.5, 5, 5), 'color': 'lightcoral', 'alpha': 0.7}
     ]
     
-    for i, layer in enumerate(layers):
-        rect = Rectangle((layer['rect'][0], layer['rect'][1]), 
-                        layer['rect'][2], layer['rect'][3],
-                        facecolor=layer['color'], alpha=layer['alpha'],
-                        edgecolor='black', linewidth=2)
-        ax.add_patch(rect)
-        ax.text(layer['rect'][0] + 0.1, layer['rect'][1] + layer['rect'][3] - 0.3, 
-                layer['name'], fontsize=10, fontweight='bold')
+    # The layer scaffolding is static, so it comes from the template cache
+    draw_template(ax, draw_security_layers_template,
+                  layers=tuple((layer['name'], layer['rect'], layer['color'], layer['alpha'])
+                               for layer in layers))
     
     # Security components
     security_components = [
@@ -274,65 +4401,66 @@ def create_security_architecture():
                 ha='center', va='center', fontsize=8, fontweight='bold')
     
     plt.tight_layout()
-    plt.savefig('security_architecture.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'security_architecture.png')
 
 # 4. USER PRIVILEGE MATRIX
 def create_user_privilege_matrix():
-    fig, ax = plt.subplots(1, 1, figsize=(14, 10))
-    
-    # Define users and their privileges
-    users = ['Admin', 'Other Admin', 'Client', 'Driver']
-    features = [
-        'User Management', 'Create Consignments', 'Assign Drivers', 
-        'View All Consignments', 'GPS Tracking', 'Messaging', 
-        'Fuel Management', 'Reports & Analytics', 'System Settings',
-        'Profile Management', 'View Own Data', 'Update Status'
-    ]
-    
-    # Privilege matrix (1 = Full Access, 0.5 = Limited Access, 0 = No Access)
-    privileges = np.array([
-        [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],  # Admin
-        [0.5, 1, 1, 1, 1, 1, 0.5, 1, 0.5, 1, 1, 1],  # Other Admin
-        [0, 1, 0, 0.5, 1, 1, 0, 0.5, 0, 1, 1, 0.5],  # Client
-        [0, 0, 0, 0.5, 1, 1, 1, 0, 0, 1, 1, 1]   # Driver
-    ])
-    
-    # Create heatmap
-    im = ax.imshow(privileges, cmap='RdYlGn', aspect='auto', vmin=0, vmax=1)
-    
-    # Set ticks and labels
-    ax.set_xticks(np.arange(len(features)))
-    ax.set_yticks(np.arange(len(users)))
-    ax.set_xticklabels(features, rotation=45, ha='right')
-    ax.set_yticklabels(users)
-    
-    # Add text annotations
-    for i in range(len(users)):
-        for j in range(len(features)):
-            if privileges[i, j] == 1:
-                text = 'Full'
-                color = 'white'
-            elif privileges[i, j] == 0.5:
-                text = 'Limited'
-                color = 'black'
-            else:
-                text = 'None'
-                color = 'white'
-            
-            ax.text(j, i, text, ha='center', va='center', 
-                   color=color, fontweight='bold', fontsize=8)
-    
-    # Add colorbar
-    cbar = plt.colorbar(im, ax=ax)
-    cbar.set_label('Access Level', rotation=270, labelpad=20)
-    
-    ax.set_title('User Privilege Matrix - Access Control Overview', 
-                fontsize=16, fontweight='bold', pad=20)
-    
-    plt.tight_layout()
-    plt.savefig('user_privilege_matrix.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    policies = load_policies(RENDER_CONFIG['policy_files'] or
+                             [os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in POLICY_FILES])
+    # Policies on a table without RLS enforce nothing; say so on its row
+    names = [table + ' ⚠ RLS off' if table in policies['unenforced'] else table for table in policies['tables']]
+    tables, rows = privilege_rows(names, policies['access'])
+    roles = [role.replace('_', ' ').title() for role in POLICY_ROLES]
+    commands = [command.upper() for command in POLICY_COMMANDS]
+    pages = max(1, -(-len(tables) // PRIVILEGE_PAGE_ROWS))
+
+    for page in range(pages):
+        labels, cells = tables[page * PRIVILEGE_PAGE_ROWS:(page + 1) * PRIVILEGE_PAGE_ROWS], \
+            rows[page * PRIVILEGE_PAGE_ROWS:(page + 1) * PRIVILEGE_PAGE_ROWS]
+        fig, ax = plt.subplots(1, 1, figsize=(14, 3 + 0.4 * max(len(labels), 4)))
+
+        # Create heatmap
+        im = ax.imshow(cells.reshape(len(labels), -1), cmap='RdYlGn', aspect='auto', vmin=0, vmax=1)
+        ax.grid(False)
+
+        # Commands under each role, roles on top
+        ax.set_xticks(np.arange(cells.shape[1]))
+        ax.set_xticklabels(commands * len(roles), fontsize=8)
+        ax.set_yticks(np.arange(len(labels)))
+        ax.set_yticklabels(labels)
+        top = ax.secondary_xaxis('top')
+        top.set_xticks(np.arange(len(roles)) * len(commands) + (len(commands) - 1) / 2)
+        top.set_xticklabels(roles, fontweight='bold')
+        top.tick_params(length=0)
+        for boundary in np.arange(1, len(roles)) * len(commands) - 0.5:
+            ax.axvline(boundary, color='white', linewidth=3)
+
+        # One glyph layer for every cell annotation
+        level = np.round(cells.ravel() * 2).astype(int)
+        rr, cc = np.divmod(np.arange(cells.size), cells.shape[1])
+        draw_label_layer(ax, [('None', 'Own', 'All')[i] for i in level], np.column_stack((cc, rr)),
+                         np.array(['white', 'black', 'white'])[level].tolist())
+
+        # Add colorbar
+        cbar = plt.colorbar(im, ax=ax, ticks=[0, 0.5, 1])
+        cbar.ax.set_yticklabels(['None', 'Own / filtered rows', 'All rows'])
+        cbar.set_label('Access Level', rotation=270, labelpad=20)
+
+        title = 'User Privilege Matrix - Row Level Security Policies'
+        if pages > 1:
+            title += f' ({page + 1}/{pages})'
+        ax.set_title(title, fontsize=16, fontweight='bold', pad=30)
+        caption = (f"{policies['policies']} policies on {len(policies['tables'])} tables from "
+                   f"{', '.join(os.path.basename(path) for path in policies['files'])}")
+        if len(tables) < len(policies['tables']):
+            caption += ' · tables with identical rules share a row (+n more)'
+        if policies['unenforced']:
+            caption += (f" · {len(policies['unenforced'])} table(s) have policies but RLS is not enabled, "
+                        f"so every role has full access")
+        fig.text(0.5, 0.01, caption, ha='center', fontsize=9, style='italic')
+
+        plt.tight_layout(rect=(0, 0.03, 1, 1))
+        save_figure(fig, 'user_privilege_matrix.png' if not page else f'user_privilege_matrix_{page + 1}.png')
 
 # 5. SYSTEM EVALUATION DASHBOARD
 def create_system_evaluation():
@@ -360,30 +4488,71 @@ def create_system_evaluation():
         ax1.text(bar.get_x() + bar.get_width()/2., height + 1,
                 f'{value}%', ha='center', va='bottom', fontweight='bold')
     
+    # Real figures from the rollup store replace the illustrative ones for
+    # every table that has been ingested, narrowed by the active filters.
+    # Users are not attributable to a client or driver, so that panel only
+    # follows the time window and says so; a key filter the other rollups
+    # cannot honour is an error
+    store = RENDER_CONFIG['rollup_store']
+    filters = RENDER_CONFIG['filters']
+    ingested = rollup_tables(store) if store else set()
+    if ingested and filters.get('label'):
+        fig.suptitle(f"System Performance & Evaluation Dashboard\n{filters['label']}",
+                     fontsize=20, fontweight='bold')
+    window = {name: filters.get(name) for name in ('since', 'until')}
+    for table in sorted(ingested & {'activity', 'consignments'}):
+        check_key_filters(filters, rollup_keys(store, table), f'the {table} rollup, which holds rows without that id')
+    users = query_rollup(store, 'users', window) if 'users' in ingested else None
+    activity = query_rollup(store, 'activity', filters) if 'activity' in ingested else None
+    consignments = query_rollup(store, 'consignments', filters) if 'consignments' in ingested else None
+    
     # 2. User Activity
     ax2 = fig.add_subplot(gs[0, 1])
     user_types = ['Admin', 'Client', 'Driver']
     active_users = [5, 150, 75]
-    
-    wedges, texts, autotexts = ax2.pie(active_users, labels=user_types, 
-                                      autopct='%1.1f%%', startangle=90,
-                                      colors=['#ff6b6b', '#4ecdc4', '#45b7d1'])
-    ax2.set_title('Active Users Distribution', fontweight='bold')
+    users_title = 'Active Users Distribution'
+    if users is not None:
+        keep = users['category'] >= 0
+        by_role = np.bincount(users['category'][keep], weights=users['count'][keep],
+                              minlength=len(ROLLUP_TABLES['users']['categories']))
+        # admin + other_admin, client + user, driver
+        active_users = [by_role[0] + by_role[1], by_role[2] + by_role[3], by_role[4]]
+        users_title = f'Registered Users by Role ({int(sum(active_users)):,})'
+        if filters.get('client') is not None or filters.get('driver') is not None:
+            users_title += '\nall clients and drivers'
+    
+    if sum(active_users):
+        # Roles without users get no slice
+        shown = [i for i, count in enumerate(active_users) if count]
+        wedges, texts, autotexts = ax2.pie([active_users[i] for i in shown], labels=[user_types[i] for i in shown],
+                                          autopct='%1.1f%%', startangle=90,
+                                          colors=[['#ff6b6b', '#4ecdc4', '#45b7d1'][i] for i in shown])
+    else:
+        empty_window(ax2)
+    ax2.set_title(users_title, fontweight='bold')
     
     # 3. System Load
     ax3 = fig.add_subplot(gs[0, 2])
     hours = np.arange(0, 24)
-    load = np.sin(hours * np.pi / 12) * 30 + 50 + np.random.normal(0, 5, 24)
-    load = np.clip(load, 0, 100)
-    
-    ax3.plot(hours, load, marker='o', linewidth=2, markersize=4)
-    ax3.fill_between(hours, load, alpha=0.3)
+    if activity is not None:
+        # Events per hour of day as a share of the busiest hour
+        load = np.bincount(activity['hour'] % 24, weights=activity['count'], minlength=24)
+        load = load / max(load.max(), 1) * 100
+    else:
+        load = np.sin(hours * np.pi / 12) * 30 + 50 + np.random.normal(0, 5, 24)
+        load = np.clip(load, 0, 100)
+    
+    if load.any():
+        ax3.plot(hours, load, marker='o', linewidth=2, markersize=4)
+        ax3.fill_between(hours, load, alpha=0.3)
+        ax3.set_xlabel('Hour of Day')
+        ax3.set_ylabel('Load (%)')
+        ax3.set_xlim(0, 23)
+        ax3.set_ylim(0, 100)
+        ax3.grid(True, alpha=0.3)
+    else:
+        empty_window(ax3)
     ax3.set_title('24-Hour System Load', fontweight='bold')
-    ax3.set_xlabel('Hour of Day')
-    ax3.set_ylabel('Load (%)')
-    ax3.set_xlim(0, 23)
-    ax3.set_ylim(0, 100)
-    ax3.grid(True, alpha=0.3)
     
     # 4. Delivery Statistics
     ax4 = fig.add_subplot(gs[1, :])
@@ -391,21 +4560,31 @@ def create_system_evaluation():
     completed = [120, 135, 158, 142, 167, 189]
     pending = [25, 30, 22, 28, 31, 24]
     cancelled = [8, 12, 15, 10, 9, 11]
+    if consignments is not None:
+        # Last six months by creation date; open = pending + assigned + in_transit
+        labels, counts = rollup_months(consignments, len(ROLLUP_TABLES['consignments']['categories']))
+        labels, counts = labels[-6:], counts[-6:]
+        months = [label.item().strftime('%b %Y') for label in labels]
+        completed = counts[:, 3]
+        pending = counts[:, 0] + counts[:, 1] + counts[:, 2]
+        cancelled = counts[:, 4]
     
     x = np.arange(len(months))
     width = 0.25
     
-    ax4.bar(x - width, completed, width, label='Completed', color='#2ecc71')
-    ax4.bar(x, pending, width, label='Pending', color='#f39c12')
-    ax4.bar(x + width, cancelled, width, label='Cancelled', color='#e74c3c')
-    
+    if months:
+        ax4.bar(x - width, completed, width, label='Completed', color='#2ecc71')
+        ax4.bar(x, pending, width, label='Pending', color='#f39c12')
+        ax4.bar(x + width, cancelled, width, label='Cancelled', color='#e74c3c')
+        ax4.set_xlabel('Month')
+        ax4.set_ylabel('Number of Consignments')
+        ax4.set_xticks(x)
+        ax4.set_xticklabels(months)
+        ax4.legend()
+        ax4.grid(True, alpha=0.3)
+    else:
+        empty_window(ax4)
     ax4.set_title('Monthly Delivery Statistics', fontweight='bold')
-    ax4.set_xlabel('Month')
-    ax4.set_ylabel('Number of Consignments')
-    ax4.set_xticks(x)
-    ax4.set_xticklabels(months)
-    ax4.legend()
-    ax4.grid(True, alpha=0.3)
     
     # 5. Security Events
     ax5 = fig.add_subplot(gs[2, 0])
@@ -446,8 +4625,7 @@ def create_system_evaluation():
     ax7.set_title('System Health Score', fontweight='bold', pad=20)
     
     plt.tight_layout()
-    plt.savefig('system_evaluation.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'system_evaluation.png')
 
 # 6. USER INTERFACE MOCKUP
 def create_ui_mockup():
@@ -469,19 +4647,16 @@ def create_ui_mockup():
         ax.set_xlim(0, 10)
         ax.set_ylim(0, 15)
         ax.set_aspect('equal')
-        
-        # Phone frame
-        phone_frame = Rectangle((1, 1), 8, 13, facecolor='black', edgecolor='black')
-        ax.add_patch(phone_frame)
-        
-        # Screen
-        screen_area = Rectangle((1.5, 2), 7, 11, facecolor='white', edgecolor='gray')
-        ax.add_patch(screen_area)
-        
+
+        # Phone frame, screen, header and navigation bar are shared by all
+        # screens and rendered once
+        draw_template(ax, draw_phone_template,
+                      frame_color='black', screen_color='white',
+                      header_color='#3498db', nav_color='#34495e',
+                      nav_items=('🏠', '📦', '💬', '👤'))
+
         # Header
-        header = Rectangle((1.5, 11.5), 7, 1.5, facecolor='#3498db', edgecolor='none')
-        ax.add_patch(header)
-        ax.text(5, 12.2, screen['title'], ha='center', va='center', 
+        ax.text(5, 12.2, screen['title'], ha='center', va='center',
                 color='white', fontweight='bold', fontsize=10)
         
         # Content based on screen type
@@ -543,21 +4718,12 @@ def create_ui_mockup():
                    element['pos'][1] + element['size'][1]/2,
                    element['text'], ha='center', va='center', 
                    fontsize=8, fontweight='bold', wrap=True)
-        
-        # Navigation bar
-        nav_bar = Rectangle((1.5, 2), 7, 0.8, facecolor='#34495e', edgecolor='none')
-        ax.add_patch(nav_bar)
-        nav_items = ['🏠', '📦', '💬', '👤']
-        for i, item in enumerate(nav_items):
-            ax.text(2.5 + i*1.5, 2.4, item, ha='center', va='center', 
-                   color='white', fontsize=12)
-        
+
         ax.set_title(f'{screen["user"]} Interface', fontweight='bold', pad=10)
         ax.axis('off')
     
     plt.tight_layout()
-    plt.savefig('ui_mockup.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'ui_mockup.png')
 
 # 7. FILE STRUCTURE DIAGRAM
 def create_file_structure():
@@ -637,8 +4803,7 @@ def create_file_structure():
                        fontsize=8, ha='center', va='center', style='italic')
     
     plt.tight_layout()
-    plt.savefig('file_structure.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'file_structure.png')
 
 # 8. SYSTEM FLOW FOR NON-PROGRAMMERS
 def create_system_flow_simple():
@@ -718,8 +4883,7 @@ def create_system_flow_simple():
             ha='center', va='center', fontsize=11)
     
     plt.tight_layout()
-    plt.savefig('system_flow_simple.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'system_flow_simple.png')
 
 # 9. DATA FLOW DIAGRAM
 def create_data_flow_diagram():
@@ -795,6 +4959,7 @@ def create_data_flow_diagram():
         {'from': (7.4, 5), 'to': (8.2, 1.5), 'label': 'Messages'}
     ]
     
+    flow_labels = []
     for flow in flows:
         arrow = ConnectionPatch(flow['from'], flow['to'], "data", "data",
                                arrowstyle="->", shrinkA=5, shrinkB=5,
@@ -804,12 +4969,17 @@ def create_data_flow_diagram():
         # Add label
         mid_x = (flow['from'][0] + flow['to'][0]) / 2
         mid_y = (flow['from'][1] + flow['to'][1]) / 2
-        ax.text(mid_x, mid_y + 0.2, flow['label'], ha='center', va='center', 
-                fontsize=8, bbox=dict(boxstyle="round,pad=0.2", facecolor='white', alpha=0.8))
+        flow_labels.append(ax.text(mid_x, mid_y + 0.2, flow['label'], ha='center', va='center',
+                fontsize=8, bbox=dict(boxstyle="round,pad=0.2", facecolor='white', alpha=0.8)))
     
     plt.tight_layout()
-    plt.savefig('data_flow_diagram.png', dpi=300, bbox_inches='tight')
-    plt.show()
+
+    # Keep flow labels off each other and off the symbols
+    nodes = [(x - 0.5, y - 0.3, x + 0.5, y + 0.3) for x, y in (entity['pos'] for entity in entities)]
+    nodes += [(x - 0.6, y - 0.6, x + 0.6, y + 0.6) for x, y in (process['pos'] for process in processes)]
+    nodes += [(x - 0.8, y - 0.2, x + 0.8, y + 0.2) for x, y in (store['pos'] for store in stores)]
+    nudge_labels(ax, flow_labels, nodes, name='data_flow_diagram')
+    save_figure(fig, 'data_flow_diagram.png')
 
 # 10. DEPLOYMENT ARCHITECTURE
 def create_deployment_architecture():
@@ -927,23 +5097,12 @@ def create_deployment_architecture():
         ax.add_patch(arrow)
     
     plt.tight_layout()
-    plt.savefig('deployment_architecture.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'deployment_architecture.png')
 def create_database_schema():
-    fig, ax = plt.subplots(1, 1, figsize=(16, 12))
-    ax.set_xlim(0, 16)
-    ax.set_ylim(0, 12)
-    ax.axis('off')
-    
-    # Title
-    ax.text(8, 11.5, 'Database Schema - Logistics Management System', 
-            fontsize=18, fontweight='bold', ha='center')
-    
     # Define tables with their fields
     tables = [
         {
             'name': 'users',
-            'pos': (2, 9),
             'fields': [
                 'id (PK)',
                 'email',
@@ -959,7 +5118,6 @@ def create_database_schema():
         },
         {
             'name': 'consignments',
-            'pos': (8, 9),
             'fields': [
                 'id (PK)',
                 'client_id (FK)',
@@ -977,7 +5135,6 @@ def create_database_schema():
         },
         {
             'name': 'drivers',
-            'pos': (14, 9),
             'fields': [
                 'id (PK)',
                 'user_id (FK)',
@@ -993,7 +5150,6 @@ def create_database_schema():
         },
         {
             'name': 'messages',
-            'pos': (2, 5),
             'fields': [
                 'id (PK)',
                 'consignment_id (FK)',
@@ -1008,7 +5164,6 @@ def create_database_schema():
         },
         {
             'name': 'tracking_logs',
-            'pos': (8, 5),
             'fields': [
                 'id (PK)',
                 'consignment_id (FK)',
@@ -1023,7 +5178,6 @@ def create_database_schema():
         },
         {
             'name': 'fuel_transactions',
-            'pos': (14, 5),
             'fields': [
                 'id (PK)',
                 'driver_id (FK)',
@@ -1038,7 +5192,6 @@ def create_database_schema():
         },
         {
             'name': 'notifications',
-            'pos': (2, 1),
             'fields': [
                 'id (PK)',
                 'user_id (FK)',
@@ -1052,7 +5205,6 @@ def create_database_schema():
         },
         {
             'name': 'system_logs',
-            'pos': (8, 1),
             'fields': [
                 'id (PK)',
                 'user_id (FK)',
@@ -1067,7 +5219,6 @@ def create_database_schema():
         },
         {
             'name': 'app_settings',
-            'pos': (14, 1),
             'fields': [
                 'id (PK)',
                 'setting_key',
@@ -1079,110 +5230,41 @@ def create_database_schema():
             'color': '#34495e'
         }
     ]
-    
-    # Draw tables
-    for table in tables:
-        # Calculate table height based on number of fields
-        table_height = len(table['fields']) * 0.25 + 0.5
-        
-        # Table header
-        header_rect = Rectangle((table['pos'][0] - 1, table['pos'][1]), 2, 0.4,
-                               facecolor=table['color'], edgecolor='black', linewidth=2)
-        ax.add_patch(header_rect)
-        ax.text(table['pos'][0], table['pos'][1] + 0.2, table['name'].upper(), 
-                ha='center', va='center', fontweight='bold', color='white', fontsize=10)
-        
-        # Table body
-        body_rect = Rectangle((table['pos'][0] - 1, table['pos'][1] - table_height), 2, table_height,
-                             facecolor='white', edgecolor='black', linewidth=1)
-        ax.add_patch(body_rect)
-        
-        # Table fields
-        for i, field in enumerate(table['fields']):
-            y_pos = table['pos'][1] - 0.3 - (i * 0.25)
-            
-            # Highlight primary keys and foreign keys
-            if '(PK)' in field:
-                field_color = 'gold'
-                field_weight = 'bold'
-            elif '(FK)' in field:
-                field_color = 'lightblue'
-                field_weight = 'bold'
-            else:
-                field_color = 'white'
-                field_weight = 'normal'
-            
-            # Field background
-            field_rect = Rectangle((table['pos'][0] - 0.95, y_pos - 0.1), 1.9, 0.2,
-                                  facecolor=field_color, alpha=0.7, edgecolor='gray', linewidth=0.5)
-            ax.add_patch(field_rect)
-            
-            ax.text(table['pos'][0], y_pos, field, ha='center', va='center', 
-                   fontsize=8, fontweight=field_weight)
-    
-    # Draw relationships
+
+    # Parent primary key -> child foreign key
     relationships = [
-        # From users to consignments (client_id)
-        {'from': (3, 8.5), 'to': (7, 8.5), 'label': '1:N (client)'},
-        # From drivers to consignments (driver_id)
-        {'from': (13, 8.5), 'to': (9, 8.5), 'label': '1:N (assigned)'},
-        # From users to drivers
-        {'from': (3, 9), 'to': (13, 9), 'label': '1:1'},
-        # From consignments to messages
-        {'from': (7, 7.5), 'to': (3, 6), 'label': '1:N'},
-        # From consignments to tracking_logs
-        {'from': (8, 7.5), 'to': (8, 6.5), 'label': '1:N'},
-        # From drivers to fuel_transactions
-        {'from': (14, 7.5), 'to': (14, 6.5), 'label': '1:N'},
-        # From users to notifications
-        {'from': (2, 7.5), 'to': (2, 2.5), 'label': '1:N'},
-        # From users to system_logs
-        {'from': (3, 7.5), 'to': (7, 2.5), 'label': '1:N'}
-    ]
-    
-    for rel in relationships:
-        # Draw relationship line
-        arrow = ConnectionPatch(rel['from'], rel['to'], "data", "data",
-                               arrowstyle="->", shrinkA=5, shrinkB=5,
-                               mutation_scale=15, fc="red", ec="red", lw=1.5)
-        ax.add_patch(arrow)
-        
-        # Add relationship label
-        mid_x = (rel['from'][0] + rel['to'][0]) / 2
-        mid_y = (rel['from'][1] + rel['to'][1]) / 2
-        ax.text(mid_x, mid_y, rel['label'], ha='center', va='center', 
-               fontsize=8, bbox=dict(boxstyle="round,pad=0.2", 
-               facecolor='yellow', alpha=0.8), fontweight='bold')
-    
-    # Add legend
-    legend_elements = [
-        {'color': 'gold', 'label': 'Primary Key (PK)'},
-        {'color': 'lightblue', 'label': 'Foreign Key (FK)'},
-        {'color': 'red', 'label': 'Relationship'}
+        ('users', 'client_id (FK)', 'consignments', '1:N (client)'),
+        ('drivers', 'driver_id (FK)', 'consignments', '1:N (assigned)'),
+        ('users', 'user_id (FK)', 'drivers', '1:1'),
+        ('consignments', 'consignment_id (FK)', 'messages', '1:N'),
+        ('consignments', 'consignment_id (FK)', 'tracking_logs', '1:N'),
+        ('drivers', 'driver_id (FK)', 'fuel_transactions', '1:N'),
+        ('users', 'user_id (FK)', 'notifications', '1:N'),
+        ('users', 'user_id (FK)', 'system_logs', '1:N')
     ]
-    
-    legend_y = 0.5
-    for i, element in enumerate(legend_elements):
-        legend_rect = Rectangle((0.5, legend_y - i*0.3), 0.3, 0.2,
-                               facecolor=element['color'], alpha=0.7, edgecolor='black')
-        ax.add_patch(legend_rect)
-        ax.text(1, legend_y - i*0.3 + 0.1, element['label'], 
-               ha='left', va='center', fontsize=10, fontweight='bold')
-    
-    # Add database info box
-    info_box = FancyBboxPatch((10, 0.2), 5.5, 1.5,
-                             boxstyle="round,pad=0.2", 
-                             facecolor='lightgray', alpha=0.8,
-                             edgecolor='black', linewidth=2)
-    ax.add_patch(info_box)
-    ax.text(12.75, 1.2, 'Database Information', ha='center', va='center', 
-           fontsize=12, fontweight='bold')
-    ax.text(12.75, 0.8, 'Engine: PostgreSQL (Supabase)\nCharset: UTF-8\nTimezone: UTC', 
-           ha='center', va='center', fontsize=10)
-    
-    plt.tight_layout()
-    plt.savefig('database_schema.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    if RENDER_CONFIG['schema_files']:
+        tables, relationships = load_schema(RENDER_CONFIG['schema_files'])
+    focus = RENDER_CONFIG['schema_focus']
+    if not focus:
+        draw_schema_pages(tables, relationships, 'database_schema', 'Database Schema - Logistics Management System')
+        return
+
+    # Neighbourhood views: each focus table and everything within --depth
+    # foreign key hops, one diagram per table
+    graph = schema_graph(tables, relationships)
+    focus = [table['name'] for table in tables] if focus == ['all'] else focus
+    unknown = [name for name in focus if name not in graph['index']]
+    if unknown:
+        raise ValueError(f"--focus: no table(s) {', '.join(unknown)} in the schema")
+    depth = RENDER_CONFIG['schema_depth']
+    for name in focus:
+        members = set(np.flatnonzero(neighbourhood(graph, graph['index'][name], depth) >= 0).tolist())
+        draw_schema_pages([table for i, table in enumerate(tables) if i in members],
+                          [relationship for relationship, (parent, child) in zip(relationships, graph['links'])
+                           if parent in members and child in members],
+                          f'database_schema_{name}',
+                          f"Database Schema - {name} and tables within {depth} FK hop{'s' * (depth != 1)}",
+                          focus=name)
 
 # 11. USER MANUAL DIAGRAM
 def create_user_manual():
@@ -1205,18 +5287,11 @@ def create_user_manual():
         {'step': '7', 'text': 'Handle system settings', 'y': 3}
     ]
     
+    # Step circles and arrows are shared scaffolding, only the text differs
+    draw_template(ax1, draw_step_template, color='red',
+                  steps=tuple((step['step'], step['y']) for step in admin_steps))
     for step in admin_steps:
-        # Step circle
-        circle = Circle((1, step['y']), 0.3, facecolor='red', alpha=0.7)
-        ax1.add_patch(circle)
-        ax1.text(1, step['y'], step['step'], ha='center', va='center', 
-                fontweight='bold', color='white')
-        # Step text
         ax1.text(1.8, step['y'], step['text'], ha='left', va='center', fontsize=10)
-        # Arrow to next step
-        if step['y'] > 3:
-            ax1.arrow(1, step['y']-0.4, 0, -0.2, head_width=0.1, head_length=0.1, 
-                     fc='red', ec='red')
     
     ax1.axis('off')
     
@@ -1236,15 +5311,11 @@ def create_user_manual():
         {'step': '7', 'text': 'Confirm delivery completion', 'y': 3}
     ]
     
+    # Step circles and arrows are shared scaffolding, only the text differs
+    draw_template(ax2, draw_step_template, color='blue',
+                  steps=tuple((step['step'], step['y']) for step in client_steps))
     for step in client_steps:
-        circle = Circle((1, step['y']), 0.3, facecolor='blue', alpha=0.7)
-        ax2.add_patch(circle)
-        ax2.text(1, step['y'], step['step'], ha='center', va='center', 
-                fontweight='bold', color='white')
         ax2.text(1.8, step['y'], step['text'], ha='left', va='center', fontsize=10)
-        if step['y'] > 3:
-            ax2.arrow(1, step['y']-0.4, 0, -0.2, head_width=0.1, head_length=0.1, 
-                     fc='blue', ec='blue')
     
     ax2.axis('off')
     
@@ -1264,15 +5335,11 @@ def create_user_manual():
         {'step': '7', 'text': 'Confirm completion', 'y': 3}
     ]
     
+    # Step circles and arrows are shared scaffolding, only the text differs
+    draw_template(ax3, draw_step_template, color='green',
+                  steps=tuple((step['step'], step['y']) for step in driver_steps))
     for step in driver_steps:
-        circle = Circle((1, step['y']), 0.3, facecolor='green', alpha=0.7)
-        ax3.add_patch(circle)
-        ax3.text(1, step['y'], step['step'], ha='center', va='center', 
-                fontweight='bold', color='white')
         ax3.text(1.8, step['y'], step['text'], ha='left', va='center', fontsize=10)
-        if step['y'] > 3:
-            ax3.arrow(1, step['y']-0.4, 0, -0.2, head_width=0.1, head_length=0.1, 
-                     fc='green', ec='green')
     
     ax3.axis('off')
     
@@ -1298,8 +5365,7 @@ def create_user_manual():
     ax4.axis('off')
     
     plt.tight_layout()
-    plt.savefig('user_manual.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'user_manual.png')
 
 # 12. COMMUNICATION FLOW DIAGRAM
 def create_communication_flow():
@@ -1337,30 +5403,64 @@ def create_communication_flow():
     
     # Communication channels
     communications = [
-        {'from': (2, 7), 'to': (6, 8.5), 'label': 'Order Assignment\nNotifications', 'color': 'red'},
-        {'from': (6, 8.5), 'to': (10, 7), 'label': 'Delivery Instructions\nLocation Sharing', 'color': 'blue'},
-        {'from': (10, 7), 'to': (2, 7), 'label': 'Status Updates\nDelivery Reports', 'color': 'green'},
-        {'from': (6, 5), 'to': (2, 7), 'label': 'System Alerts\nAnalytics', 'color': 'orange'},
-        {'from': (6, 5), 'to': (6, 8.5), 'label': 'Order Confirmations\nTracking Updates', 'color': 'orange'},
-        {'from': (6, 5), 'to': (10, 7), 'label': 'Job Assignments\nRoute Optimization', 'color': 'orange'}
+        {'from': (2, 7), 'to': (6, 8.5), 'label': 'Order Assignment\nNotifications', 'color': 'red',
+         'between': ('Admin', 'Client')},
+        {'from': (6, 8.5), 'to': (10, 7), 'label': 'Delivery Instructions\nLocation Sharing', 'color': 'blue',
+         'between': ('Client', 'Driver')},
+        {'from': (10, 7), 'to': (2, 7), 'label': 'Status Updates\nDelivery Reports', 'color': 'green',
+         'between': ('Driver', 'Admin')},
+        {'from': (6, 5), 'to': (2, 7), 'label': 'System Alerts\nAnalytics', 'color': 'orange',
+         'between': ('System', 'Admin')},
+        {'from': (6, 5), 'to': (6, 8.5), 'label': 'Order Confirmations\nTracking Updates', 'color': 'orange',
+         'between': ('System', 'Client')},
+        {'from': (6, 5), 'to': (10, 7), 'label': 'Job Assignments\nRoute Optimization', 'color': 'orange',
+         'between': ('System', 'Driver')}
     ]
+    for comm in communications:
+        comm['lw'] = 2
+    
+    # Real traffic from a chat export: edge width follows message volume,
+    # labels carry the per-direction counts and the median reply time
+    if RENDER_CONFIG['chat_export']:
+        traffic = chat_traffic_stats(RENDER_CONFIG['chat_export'], RENDER_CONFIG['chat_users'],
+                                     RENDER_CONFIG['chat_participants'], RENDER_CONFIG['filters'])
+        counts = traffic['counts']
+        volumes = []
+        for comm in communications:
+            a, b = (CHAT_ROLES.index(role) for role in comm['between'])
+            volumes.append(counts[a, b] + counts[b, a])
+        busiest = max(max(volumes), 1)
+        for comm, volume in zip(communications, volumes):
+            a, b = comm['between']
+            ia, ib = CHAT_ROLES.index(a), CHAT_ROLES.index(b)
+            comm['lw'] = 0.5 + 9.5 * volume / busiest
+            comm['label'] += f"\n→{format_count(counts[ia, ib])} ←{format_count(counts[ib, ia])}"
+            reply = traffic['reply_p50'].get(tuple(sorted((a, b), key=CHAT_ROLES.index)))
+            if reply is not None:
+                comm['label'] += f" · reply {format_duration(reply)}"
+        caption = (f"Edge width: {traffic['messages']:,} chat messages by sender → receiver role "
+                   f"(→ / ← counts in arrow order, reply = median time to answer)")
+        if RENDER_CONFIG['filters'].get('label'):
+            caption += f"\n{RENDER_CONFIG['filters']['label']}"
+        ax.text(6, 3.7, caption, fontsize=9, ha='center', va='center', style='italic', color='#555555')
     
     # Draw communication lines
+    comm_labels = []
     for comm in communications:
         # Curved arrow
         arrow = ConnectionPatch(comm['from'], comm['to'], "data", "data",
                                arrowstyle="<->", shrinkA=30, shrinkB=30,
                                mutation_scale=15, fc=comm['color'], 
-                               ec=comm['color'], lw=2, alpha=0.7,
+                               ec=comm['color'], lw=comm['lw'], alpha=0.7,
                                connectionstyle="arc3,rad=0.2")
         ax.add_patch(arrow)
         
         # Label
         mid_x = (comm['from'][0] + comm['to'][0]) / 2
         mid_y = (comm['from'][1] + comm['to'][1]) / 2 + 0.3
-        ax.text(mid_x, mid_y, comm['label'], ha='center', va='center', 
+        comm_labels.append(ax.text(mid_x, mid_y, comm['label'], ha='center', va='center',
                 fontsize=8, bbox=dict(boxstyle="round,pad=0.2", 
-                facecolor='white', alpha=0.8, edgecolor=comm['color']))
+                facecolor='white', alpha=0.8, edgecolor=comm['color'])))
     
     # Communication types legend
     legend_box = FancyBboxPatch((0.5, 1), 11, 2,
@@ -1382,8 +5482,12 @@ def create_communication_flow():
         ax.text(x, y, comm_type, ha='left', va='center', fontsize=10)
     
     plt.tight_layout()
-    plt.savefig('communication_flow.png', dpi=300, bbox_inches='tight')
-    plt.show()
+
+    # Keep channel labels off each other, the users and the legend
+    nodes = [(x - 0.8, y - 0.4, x + 0.8, y + 0.4) if user['name'] == 'System' else (x - 0.6, y - 0.6, x + 0.6, y + 0.6)
+             for user in users for x, y in [user['pos']]]
+    nudge_labels(ax, comm_labels, nodes + [(0.3, 0.8, 11.7, 3.2)], name='communication_flow')
+    save_figure(fig, 'communication_flow.png')
 
 # 13. SYSTEM LIFECYCLE DIAGRAM
 def create_system_lifecycle():
@@ -1410,6 +5514,19 @@ def create_system_lifecycle():
         {'name': 'Order\nClosed', 'pos': (2, 6), 'color': '#34495e', 'time': '24-48 hours'}
     ]
     
+    # Measured p50 / p90 / p99 replace the estimates when a status history
+    # export is given; stages without any transitions keep the estimate
+    if RENDER_CONFIG['status_history']:
+        durations = lifecycle_durations(RENDER_CONFIG['status_history'], RENDER_CONFIG['filters'])
+        for i, measured in durations.items():
+            stages[i]['time'] = ' / '.join(format_duration(measured[q]) for q in ('p50', 'p90', 'p99'))
+        transitions = sum(measured['count'] for measured in durations.values())
+        caption = f'Stage times: p50 / p90 / p99 measured from {transitions:,} status changes'
+        if RENDER_CONFIG['filters'].get('label'):
+            caption += f" · {RENDER_CONFIG['filters']['label']}"
+        ax.text(6, 9.05, caption,
+                fontsize=10, ha='center', style='italic', color='#555555')
+    
     # Draw stages
     for i, stage in enumerate(stages):
         # Stage circle
@@ -1468,68 +5585,1193 @@ def create_system_lifecycle():
         ax.text(x, 2.2, exception, ha='center', va='center', fontsize=10)
     
     plt.tight_layout()
-    plt.savefig('system_lifecycle.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(fig, 'system_lifecycle.png')
+
+# 14. FUEL ANALYTICS DIAGRAM
+def create_fuel_analytics():
+    ledger = fuel_ledger(RENDER_CONFIG['fuel_export'], RENDER_CONFIG['filters'])
+    daily = ledger['daily']
+    ends = np.r_[ledger['starts'][1:], len(daily['driver'])]
+
+    # Busiest drivers first; the grid is capped so the figure stays readable
+    ranked = np.argsort(-ledger['spend'], kind='stable')
+    shown = ranked[:MAX_FUEL_PANELS]
+    columns = 20
+    rows = max(1, -(-len(shown) // columns))
+
+    # Heights in inches: title, summary panels, room for their rotated date
+    # ticks and the grid title, then one square 0.9in cell per grid row
+    title_height, panel_height, gap, cell = 1.0, 5.0, 1.2, 0.9
+    height = title_height + panel_height + gap + rows * cell + 0.2
+    fig = plt.figure(figsize=(18, height))
+    gs = gridspec.GridSpec(1, 3, left=0.06, right=0.98, wspace=0.22, top=1 - title_height / height,
+                           bottom=(0.2 + rows * cell + gap) / height)
+    grid = gridspec.GridSpec(1, 1, left=0.02, right=0.98, bottom=0.2 / height, top=(0.2 + rows * cell) / height)
+    title = 'Fuel Transaction Analytics'
+    if RENDER_CONFIG['filters'].get('label'):
+        title += f"\n{RENDER_CONFIG['filters']['label']}"
+    fig.suptitle(title, fontsize=18, fontweight='bold')
+
+    # Top spenders
+    ax1 = fig.add_subplot(gs[0])
+    top = ranked[:15][::-1]
+    ax1.barh([ledger['labels'][i] for i in top], ledger['spend'][top],
+             color=['#e74c3c' if ledger['anomalies'][i] else '#1abc9c' for i in top])
+    ax1.set_title('Top Drivers by Fuel Spend', fontweight='bold')
+    ax1.set_xlabel('Spend')
+    ax1.tick_params(axis='y', labelsize=8)
+
+    # Fleet spend per day
+    ax2 = fig.add_subplot(gs[1])
+    first_day = daily['day'].min()
+    fleet = np.bincount(daily['day'] - first_day, weights=daily['spend'])
+    dates = (first_day + np.arange(len(fleet))).astype('datetime64[D]')
+    ax2.plot(dates, fleet, color='#2980b9', linewidth=1.5)
+    ax2.fill_between(dates, fleet, color='#2980b9', alpha=0.2)
+    ax2.set_title('Fleet Fuel Spend per Day', fontweight='bold')
+    ax2.tick_params(axis='x', labelrotation=30, labelsize=8)
+
+    # Ledger anomalies
+    ax3 = fig.add_subplot(gs[2])
+    totals = ledger['totals']
+    if ledger['has_balance']:
+        kinds = ['Balance\nmismatch', 'Balance\ngap']
+        values = [totals['mismatch'], totals['gap']]
+        bars = ax3.bar(kinds, values, color=['#e74c3c', '#f39c12'])
+        for bar, value in zip(bars, values):
+            ax3.text(bar.get_x() + bar.get_width() / 2, bar.get_height(), f'{value:,}',
+                     ha='center', va='bottom', fontweight='bold')
+        # A clean ledger reads as zero rather than a +-0.04 axis
+        ax3.set_ylim(0, max(1, max(values)) * 1.15)
+    else:
+        ax3.text(0.5, 0.5, 'Export has no balance_before/\nbalance_after columns',
+                 ha='center', va='center', transform=ax3.transAxes)
+        ax3.set_xticks([])
+        ax3.set_yticks([])
+    ax3.set_title(f"Ledger Anomalies ({totals['transactions']:,} transactions)", fontweight='bold')
+
+    # Small multiples: one cell per driver, one line collection per cell
+    ax4 = fig.add_subplot(grid[0])
+    ax4.set_xlim(0, columns)
+    ax4.set_ylim(0, rows)
+    ax4.axis('off')
+    trajectory = 'balance' if ledger['has_balance'] else 'cumulative spend'
+    ax4.set_title(f'Daily {trajectory} per driver (top {len(shown)} of {len(ranked)} by spend, '
+                  f'red = flagged transactions)', fontweight='bold', fontsize=11)
+
+    cells = tuple((n % columns + 0.04, rows - 1 - n // columns + 0.08) for n in range(len(shown)))
+    draw_template(ax4, draw_fuel_panels_template, cells=cells,
+                  labels=tuple(f"{ledger['labels'][i]} {format_count(int(ledger['spend'][i]))}" for i in shown),
+                  flagged=tuple(bool(ledger['anomalies'][i]) for i in shown))
+
+    day_span = max(1, daily['day'].max() - first_day)
+    for (x, y), i in zip(cells, shown):
+        days = daily['day'][ledger['starts'][i]:ends[i]]
+        if len(days) < 2:
+            continue
+        if ledger['has_balance']:
+            values = daily['balance'][ledger['starts'][i]:ends[i]]
+        else:
+            values = np.cumsum(daily['spend'][ledger['starts'][i]:ends[i]])
+        low, high = np.nanmin(values), np.nanmax(values)
+        px = x + 0.04 + 0.84 * (days - first_day) / day_span
+        py = y + 0.06 + 0.6 * (values - low) / ((high - low) or 1)
+        points = np.column_stack((px, py))
+        segments = np.stack((points[:-1], points[1:]), axis=1)
+        flagged = daily['anomalies'][ledger['starts'][i]:ends[i]][1:] > 0
+        ax4.add_collection(LineCollection(segments, colors=np.where(flagged, '#e74c3c', '#2980b9'),
+                                          linewidths=np.where(flagged, 1.2, 0.6)),
+                           autolim=False)
+
+    save_figure(fig, 'fuel_analytics.png')
+
+# 15. DRIVER ROUTE MAP
+def create_route_map():
+    tracks = load_tracks(RENDER_CONFIG['tracking_export'], RENDER_CONFIG['filters'])
+    bbox = RENDER_CONFIG['bbox'] or (tracks['lon'].min(), tracks['lat'].min(),
+                                     tracks['lon'].max(), tracks['lat'].max())
+
+    fig, ax = plt.subplots(1, 1, figsize=(14, 10))
+    # One output pixel in projected units sets the simplification tolerance
+    pixels = fig.get_figwidth() * 0.8 * RENDER_CONFIG['dpi']
+    tolerance = (bbox[2] - bbox[0]) * tracks['scale'] / pixels * ROUTE_TOLERANCE_PX
+    lines, drivers, points, vertices = route_polylines(tracks, bbox, tolerance)
+
+    palette = plt.get_cmap('tab20')
+    colors = [palette(int(driver % 20)) for driver in drivers]
+    ax.add_collection(LineCollection(lines, colors=colors, linewidths=0.8, alpha=0.8))
+    ax.set_xlim(bbox[0], bbox[2])
+    ax.set_ylim(bbox[1], bbox[3])
+    ax.set_aspect(1 / tracks['scale'])
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.grid(True, alpha=0.3)
+
+    title = 'Driver Routes from Tracking Logs'
+    if RENDER_CONFIG['filters'].get('label'):
+        title += f"\n{RENDER_CONFIG['filters']['label']}"
+    ax.set_title(title, fontsize=16, fontweight='bold')
+    ax.text(0.01, 0.01, f'{len(lines):,} route pieces from {len(np.unique(drivers)):,} drivers · '
+                        f'{points:,} points simplified to {vertices:,} vertices',
+            transform=ax.transAxes, fontsize=9, style='italic',
+            bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.8))
+
+    plt.tight_layout()
+    save_figure(fig, 'route_map.png')
+
+# 16. ETA ACCURACY DIAGRAM
+def create_eta_accuracy():
+    accuracy = eta_accuracy(RENDER_CONFIG['tracking_export'], RENDER_CONFIG['filters'])
+    errors, totals = accuracy['errors'], accuracy['totals']
+
+    fig, axes = plt.subplots(1, 3, figsize=(20, 7))
+    title = 'ETA Accuracy from Tracking Logs'
+    if RENDER_CONFIG['filters'].get('label'):
+        title += f"\n{RENDER_CONFIG['filters']['label']}"
+    fig.suptitle(title, fontsize=18, fontweight='bold')
+
+    # Signed error over every scored estimate
+    ax1 = axes[0]
+    overall = errors.sum(axis=0)
+    middles = (ETA_ERROR_EDGES[:-1] + ETA_ERROR_EDGES[1:]) / 2
+    ax1.bar(middles[1:-1], overall[1:-1], width=np.diff(ETA_ERROR_EDGES)[1:-1], color='#3498db', alpha=0.8)
+    # The end bins hold every error clipped at ±2h; they are drawn as wider
+    # hatched bars outside the range and do not set the scale
+    top = max(overall[1:-1].max(initial=0), 1) * 1.15
+    overflow_width = 10
+    for count, x, side, align in ((overall[0], ETA_ERROR_EDGES[0] - overflow_width, '≤ -2h', 'left'),
+                                  (overall[-1], ETA_ERROR_EDGES[-1], '≥ 2h', 'right')):
+        ax1.bar(x, min(count, top), width=overflow_width, align='edge', color='#95a5a6', alpha=0.6,
+                hatch='///', edgecolor='#7f8c8d')
+        ax1.text(x if align == 'left' else x + overflow_width, min(count, top * 0.85),
+                 f'{side}\n{int(count):,}', ha=align, va='bottom', fontsize=8,
+                 bbox=dict(boxstyle='round,pad=0.15', facecolor='white', edgecolor='none', alpha=0.7))
+    if overall.sum():
+        p50, p10, p90 = binned_percentiles(overall, ETA_ERROR_EDGES, (0.5, 0.1, 0.9))[0]
+        ax1.axvline(p50, color='#e74c3c', linewidth=1.5, label=f'median {p50:+.1f} min')
+        ax1.axvspan(p10, p90, color='#f39c12', alpha=0.15, label=f'p10-p90 {p10:+.1f} to {p90:+.1f} min')
+        ax1.legend(loc='upper left', fontsize=9)
+    ax1.set_title('ETA Error Distribution', fontweight='bold')
+    ax1.set_xlabel('Predicted - actual time to arrival (minutes; errors past ±2h in the hatched bins)')
+    ax1.set_ylabel('Estimates')
+    ax1.set_xlim(ETA_ERROR_EDGES[0] - overflow_width - 2, ETA_ERROR_EDGES[-1] + overflow_width + 2)
+    ax1.set_ylim(0, top)
+
+    # Error spread by how far the vehicle still was from arriving
+    ax2 = axes[1]
+    horizons = ETA_HORIZON_EDGES[:-1] + np.diff(ETA_HORIZON_EDGES) / 2
+    bands = binned_percentiles(errors[:-1], ETA_ERROR_EDGES, (0.1, 0.25, 0.5, 0.75, 0.9))
+    ax2.fill_between(horizons, bands[:, 0], bands[:, 4], color='#3498db', alpha=0.2, label='p10-p90')
+    ax2.fill_between(horizons, bands[:, 1], bands[:, 3], color='#3498db', alpha=0.4, label='p25-p75')
+    ax2.plot(horizons, bands[:, 2], color='#2c3e50', linewidth=2, label='median')
+    ax2.axhline(0, color='gray', linewidth=0.8, linestyle='--')
+    ax2.set_title('Error by Time to Arrival', fontweight='bold')
+    ax2.set_xlabel('Actual time to arrival (minutes)')
+    ax2.set_ylabel('ETA error (minutes)')
+    ax2.legend(loc='upper left', fontsize=9)
+
+    # Segment speeds the estimates are built from
+    ax3 = axes[2]
+    ax3.bar(SPEED_EDGES[:-1], accuracy['speeds'], width=1, align='edge', color='#2ecc71', alpha=0.8)
+    ax3.set_title('Segment Speeds', fontweight='bold')
+    ax3.set_xlabel('Speed (km/h)')
+    ax3.set_ylabel('Segments')
+
+    mae = totals['absolute_error'] / max(totals['scored_points'], 1)
+    fig.text(0.5, 0.01, f"{totals['points']:,} points · {totals['arrived']:,} delivered consignments scored, "
+                        f"{totals['active']:,} still active · {totals['scored_points']:,} estimates · "
+                        f"mean absolute error {mae:.1f} min · {totals['distance_km']:,.0f} km travelled",
+             ha='center', fontsize=10, style='italic')
+
+    plt.tight_layout(rect=(0, 0.03, 1, 1))
+    save_figure(fig, 'eta_accuracy.png')
+
+# 17. DRIVER ASSIGNMENT DIAGRAM
+def create_driver_assignment():
+    match = driver_assignment(RENDER_CONFIG['consignments_export'], RENDER_CONFIG['tracking_export'],
+                              RENDER_CONFIG['filters'])
+    rows, columns = match['rows'], match['columns']
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 9), gridspec_kw={'width_ratios': [3, 2]})
+    title = 'Driver Assignment for Pending Consignments'
+    if RENDER_CONFIG['filters'].get('label'):
+        title += f"\n{RENDER_CONFIG['filters']['label']}"
+    fig.suptitle(title, fontsize=18, fontweight='bold')
+
+    # Pickups, drivers and one line per match
+    segments = np.stack((np.column_stack((match['consignment_lon'][rows], match['consignment_lat'][rows])),
+                         np.column_stack((match['driver_lon'][columns], match['driver_lat'][columns]))), axis=1)
+    ax1.add_collection(LineCollection(segments, colors='#2ecc71', linewidths=0.8, alpha=0.8))
+    waiting = np.ones(len(match['consignment_lat']), dtype=bool)
+    waiting[rows] = False
+    idle = np.ones(len(match['driver_lat']), dtype=bool)
+    idle[columns] = False
+    ax1.scatter(match['consignment_lon'][~waiting], match['consignment_lat'][~waiting], s=14, marker='s',
+                color='#e74c3c', label=f'Pickup, assigned ({len(rows):,})', zorder=3)
+    ax1.scatter(match['consignment_lon'][waiting], match['consignment_lat'][waiting], s=14, marker='s',
+                facecolors='none', edgecolors='#7f8c8d', label=f'Pickup, no driver left ({int(waiting.sum()):,})', zorder=3)
+    ax1.scatter(match['driver_lon'][~idle], match['driver_lat'][~idle], s=14, color='#3498db',
+                label=f'Driver, assigned ({len(columns):,})', zorder=3)
+    ax1.scatter(match['driver_lon'][idle], match['driver_lat'][idle], s=14, facecolors='none',
+                edgecolors='#95a5a6', label=f'Driver, unused ({int(idle.sum()):,})', zorder=3)
+    ax1.set_aspect(1 / np.cos(np.radians(np.median(match['consignment_lat']))))
+    ax1.autoscale_view()
+    ax1.set_xlabel('Longitude')
+    ax1.set_ylabel('Latitude')
+    ax1.set_title(f"Assignments ({match['method']})", fontweight='bold')
+    ax1.legend(loc='upper right', fontsize=9)
+
+    # Pickup distance per match, against the greedy baseline
+    ax2.set_title('Driver-to-Pickup Distance', fontweight='bold')
+    if len(rows):
+        distance, greedy = match['distance'] / 1000, match['greedy_distance'] / 1000
+        edges = np.linspace(0, max(distance.max(), greedy.max()) * 1.01, 41)
+        ax2.hist(distance, bins=edges, color='#2ecc71', alpha=0.8,
+                 label=f"{match['method']}: {distance.sum():,.1f} km total")
+        if match['method'] != 'greedy':
+            extra = greedy.sum() / max(distance.sum(), 1e-9) - 1
+            ax2.hist(greedy, bins=edges, histtype='step', color='#e67e22', linewidth=1.8,
+                     label=f'greedy: {greedy.sum():,.1f} km total (+{extra:.1%})')
+        ax2.legend(loc='upper right', fontsize=10)
+    ax2.set_yscale('log')
+    ax2.set_xlabel('Distance (km)')
+    ax2.set_ylabel('Assignments (log scale)')
+
+    fig.text(0.5, 0.01, f"{len(match['consignment_lat']):,} pending consignments with pickup coordinates · "
+                        f"{match['unlocated']:,} without · {len(match['driver_lat']):,} available drivers · "
+                        f"{match['busy']:,} busy drivers excluded",
+             ha='center', fontsize=10, style='italic')
+
+    plt.tight_layout(rect=(0, 0.03, 1, 1))
+    save_figure(fig, 'driver_assignment.png')
+
+# 18. STATUS TRANSITIONS DIAGRAM
+def create_status_transitions():
+    transitions = transition_counts(RENDER_CONFIG['status_history'], RENDER_CONFIG['filters'])
+    layout = sankey_layout(transitions)
+    source, target, x, top = layout['source'], layout['target'], layout['x'], layout['top']
+
+    loop, backward = layout['loop'], layout['backward']
+    lanes = layout['lane'][loop] - layout['width'][loop]
+    floor = min(lanes.min() if len(lanes) else 0, 0) - 0.03
+    reach = x[target[loop]] - 0.04 - layout['width'][loop]
+    fig, ax = plt.subplots(1, 1, figsize=(20, 11))
+    ax.set_xlim(min(reach.min() if len(reach) else 0, 0) - 0.02, 1.1)
+    ax.set_ylim(floor, 1.02)
+    ax.axis('off')
+    title = 'Consignment Status Transitions'
+    if RENDER_CONFIG['filters'].get('label'):
+        title += f"\n{RENDER_CONFIG['filters']['label']}"
+    fig.suptitle(title, fontsize=18, fontweight='bold')
+
+    # Ribbons: along the lifecycle, off it, and back to an earlier stage
+    off_path = ~layout['on_path'][source] | ~layout['on_path'][target]
+    forward = ~loop
+    ax.add_collection(PatchCollection(
+        sankey_ribbons(x[source[forward]] + SANKEY_NODE_WIDTH, layout['source_top'][forward], x[target[forward]],
+                       layout['target_top'][forward], layout['width'][forward]),
+        facecolors=np.where(off_path[forward], '#e67e22', '#3498db'), edgecolors='none', alpha=0.35))
+    ax.add_collection(PatchCollection(
+        sankey_loops(x[source[loop]] + SANKEY_NODE_WIDTH, layout['source_top'][loop], x[target[loop]],
+                     layout['target_top'][loop], layout['width'][loop], layout['lane'][loop]),
+        facecolors=np.where(backward[loop], '#e74c3c', np.where(off_path[loop], '#e67e22', '#3498db')),
+        edgecolors='none', alpha=0.35))
+    ax.add_collection(PatchCollection(
+        [Rectangle((left, bottom), SANKEY_NODE_WIDTH, height) for left, bottom, height in
+         zip(x, top - layout['height'], layout['height'])],
+        facecolors=np.where(layout['on_path'], '#2c3e50', '#e67e22'), edgecolors='none'))
+
+    last = layout['column'] == layout['column'].max()
+    for i in np.flatnonzero(layout['height'] >= SANKEY_LABEL_HEIGHT):
+        name = layout['statuses'][i].replace('_', ' ').title()
+        ax.text(x[i] - 0.005 if last[i] else x[i] + SANKEY_NODE_WIDTH + 0.005, top[i] - layout['height'][i] / 2,
+                f"{name}\n{layout['through'][i]:,}", ha='right' if last[i] else 'left', va='center', fontsize=9,
+                bbox=dict(boxstyle='round,pad=0.15', facecolor='white', edgecolor='none', alpha=0.7))
+
+    ax.legend(handles=[patches.Patch(color='#3498db', alpha=0.6, label='Along the lifecycle'),
+                       patches.Patch(color='#e67e22', alpha=0.6, label='Into or out of an off-path status'),
+                       patches.Patch(color='#e74c3c', alpha=0.6, label='Back to an earlier stage (retry)')],
+              loc='lower center', bbox_to_anchor=(0.5, 1.0), ncol=3, frameon=False, fontsize=10)
+
+    total = max(int(layout['count'].sum()), 1)
+    fig.text(0.5, 0.02, f"{transitions['consignments']:,} consignments · {int(layout['count'].sum()):,} status changes · "
+                        f"{len(layout['statuses'])} statuses · {layout['count'][backward].sum() / total:.1%} went back · "
+                        f"{layout['count'][off_path & ~backward].sum() / total:.1%} left or rejoined the lifecycle",
+             ha='center', fontsize=10, style='italic')
+
+    plt.tight_layout(rect=(0, 0.04, 1, 1))
+    save_figure(fig, 'status_transitions.png')
+
+# 19. SCHEMA DIFF DIAGRAM
+def create_schema_diff():
+    paths = RENDER_CONFIG['migrations']
+    split = paths.index(RENDER_CONFIG['diff_from']) + 1 if RENDER_CONFIG['diff_from'] else len(paths) - 1
+    tables, counts = diff_tables(schema_checkpoint(paths[:split]), schema_checkpoint(paths))
+    changed = paths[split:]
+    title = 'Schema Changes - ' + (os.path.basename(changed[0]) if len(changed) == 1 else
+                                   f'{len(changed)} migrations')
+    legend = [{'color': color, 'label': f'{mark.title()} ({prefix})'}
+              for mark, (prefix, color, _) in DIFF_STYLES.items()]
+    since = os.path.basename(paths[split - 1]) if split else 'an empty schema'
+    summary = (f"{len(paths)} files replayed, changes since {since}\n"
+               f"+{counts['added']} / −{counts['removed']} / ~{counts['altered']} tables" if tables else
+               f"{len(paths)} files replayed\nNo schema changes since {since}")
+    draw_schema_pages(tables, [], 'schema_diff', title, legend=legend, info=('Migration Replay', summary))
+
+# SYNTHETIC DATA
+# Deterministic exports in the layout every reader above expects, for
+# benchmarking the data-driven diagrams without production data:
+#   users.csv                    id, role, created_at
+#   consignments.csv             id, client_id, driver_id, status, created_at, pickup_latitude,
+#                                pickup_longitude, weight, estimated_delivery_date, actual_delivery_date
+#   status_history.csv           consignment_id, status, timestamp, client_id, driver_id
+#   tracking_logs.csv            driver_id, consignment_id, latitude, longitude, timestamp, status
+#   delivery_notes.csv           id, driver_id, customer_id, customer_name, delivery_address, status,
+#                                notes, consignment_id, created_at
+#   chat_messages.csv            id, room_id, sender_id, message_type, created_at
+#   chat_room_participants.csv   room_id, user_id
+#   fuel_transactions.csv        id, fuel_card_id, driver_id, transaction_date, type, amount,
+#                                balance_before, balance_after, status
+# --rows sets the number of consignments; the other tables scale with it.
+# Rows are drawn in batches of whole days with vectorized NumPy sampling:
+# a per-day count (weekday pattern, growth over the span), a diurnal hour
+# profile, a status chain with exponential stage gaps and early
+# cancellations, and GPS traces that random-walk from pickup to drop-off.
+# Every batch has its own generator seeded from (--seed, table group,
+# batch), so the output does not depend on --jobs. Time-ordered exports stay
+# in time order: tracking points past the next batch's first day are
+# carried into it, and fuel balances are carried per driver.
+SYNTHETIC_END_MS = int(np.datetime64('2025-10-01T00:00:00', 'ms').astype('int64'))
+SYNTHETIC_DAYS = 180
+SYNTHETIC_BATCH_ROWS = 100_000
+SYNTHETIC_GROUPS = ['users', 'consignments', 'chat', 'fuel']
+SYNTHETIC_RATIOS = {'chat': 2.0, 'fuel': 0.3}  # rows per consignment
+CONSIGNMENTS_PER_USER = 50
+# Role of user i is SYNTHETIC_ROLE_CYCLE[i % 20]
+SYNTHETIC_ROLE_CYCLE = ['admin', 'other_admin'] + ['driver'] * 4 + ['client'] * 12 + ['user'] * 2
+DIURNAL_LOAD = np.array([1, 0.6, 0.4, 0.4, 0.5, 1, 2.5, 5, 8, 9.5, 10, 9.5,
+                         8, 8.5, 9, 9, 8.5, 7, 5.5, 4.5, 3.5, 2.5, 2, 1.5])
+DIURNAL_LOAD = DIURNAL_LOAD / DIURNAL_LOAD.sum()
+WEEKDAY_LOAD = np.array([1.0, 1.05, 1.05, 1.0, 1.1, 0.6, 0.3])  # Monday first
+STAGE_HOURS = [4, 20, 3]  # mean pending -> assigned -> in_transit -> delivered
+CANCEL_CHANCE = [0.04, 0.02]  # while pending, while assigned
+SYNTHETIC_HUBS = np.array([[-1.2921, 36.8219], [-0.0917, 34.7680], [-4.0435, 39.6682], [0.5143, 35.2698]])
+TRACK_SECONDS = 300
+TRACK_MAX_POINTS = 60
+TRACK_STEP_DEGREES = 0.002
+NOTE_STATUS_CHANCE = {'delivered': 0.93, 'partial': 0.04, 'failed': 0.03}
+NOTE_REMARKS = ['', '', '', 'Left at reception', 'Signed by security', 'Customer requested call on arrival',
+                'Package slightly damaged', 'Delivered to neighbour', 'Gate code required']
+FIRST_NAMES = ['Amina', 'Brian', 'Chloe', 'David', 'Esther', 'Felix', 'Grace', 'Hassan', 'Irene', 'James',
+               'Kevin', 'Lucy', 'Moses', 'Naomi', 'Oscar', 'Priya', 'Quentin', 'Ruth', 'Samuel', 'Tess']
+LAST_NAMES = ['Achieng', 'Baker', 'Chen', 'Dlamini', 'Evans', 'Fernandes', 'Gitau', 'Hughes', 'Ibrahim',
+              'Juma', 'Kamau', 'Lopez', 'Mwangi', 'Nakamura', 'Otieno', 'Patel', 'Rossi', 'Smith', 'Wanjiru']
+STREETS = ['Moi Avenue', 'Kenyatta Road', 'Harbour Drive', 'Station Lane', 'Market Street', 'Hill View Road',
+           'Industrial Way', 'Lake Close', 'Riverside Drive', 'Airport Road']
+TOWNS = ['Nairobi', 'Kisumu', 'Mombasa', 'Eldoret', 'Nakuru', 'Thika']
+FUEL_TYPES = {'topup': 0.12, 'fuel': 0.7, 'carWash': 0.06, 'convenience': 0.07, 'maintenance': 0.05}
+FUEL_MISMATCH_CHANCE = 0.0005
+SYNTHETIC_KINDS = ['users', 'consignments', 'delivery_notes', 'rooms', 'messages', 'fuel', 'cards']
+
+def scramble(values):
+    # splitmix64 finaliser; uint64 arithmetic wraps
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+def synthetic_ids(kind, index):
+    # UUID-shaped ids, a fixed scramble of (kind, index), so a user or a
+    # consignment has the same id in every table that refers to it
+    values = np.asarray(index, dtype=np.uint64) * np.uint64(2) + np.uint64(SYNTHETIC_KINDS.index(kind) << 48)
+    text = (pd.Series(scramble(values)).map('{:016x}'.format) +
+            pd.Series(scramble(values + np.uint64(1))).map('{:016x}'.format))
+    return (text.str[:8] + '-' + text.str[8:12] + '-4' + text.str[13:16] + '-a' + text.str[17:20] + '-' +
+            text.str[20:])
+
+def iso_times(times):
+    # Epoch ms -> ISO 8601 UTC to the second; negative times are left empty
+    text = np.char.add(np.datetime_as_string(np.maximum(times, 0).astype('datetime64[ms]').astype('datetime64[s]')), 'Z')
+    return np.where(times >= 0, text, '')
+
+def synthetic_users(rows):
+    return 20 * max(rows // (20 * CONSIGNMENTS_PER_USER), 2)
+
+def role_users(role, index):
+    # Index into the users of one role -> index into all users
+    cycle = [i for i, name in enumerate(SYNTHETIC_ROLE_CYCLE) if name == role]
+    return (index // len(cycle)) * 20 + np.asarray(cycle)[index % len(cycle)]
+
+def skewed_choice(rng, count, size, floor=10):
+    # A few clients (rooms, ...) are far busier than the rest
+    weights = np.cumsum(1 / (np.arange(count) + floor))
+    return np.minimum(np.searchsorted(weights, rng.random(size) * weights[-1]), count - 1)
+
+def day_batches(seed, group, total):
+    # (generator, days, rows per day) batches of whole days with about
+    # SYNTHETIC_BATCH_ROWS rows each, oldest first
+    rng = np.random.default_rng([seed, SYNTHETIC_GROUPS.index(group)])
+    days = np.arange(SYNTHETIC_END_MS // DAY_MS - SYNTHETIC_DAYS, SYNTHETIC_END_MS // DAY_MS)
+    weights = WEEKDAY_LOAD[(days + 3) % 7] * np.linspace(0.6, 1, len(days)) * rng.gamma(20, 1 / 20, len(days))
+    counts = rng.multinomial(total, weights / weights.sum())
+    start = batch = 0
+    for end in range(1, len(days) + 1):
+        if end == len(days) or counts[start:end].sum() >= SYNTHETIC_BATCH_ROWS:
+            yield np.random.default_rng([seed, SYNTHETIC_GROUPS.index(group), batch]), days[start:end], counts[start:end]
+            start, batch = end, batch + 1
+
+def diurnal_times(rng, days, counts):
+    day = np.repeat(days, counts)
+    hour = rng.choice(24, size=len(day), p=DIURNAL_LOAD)
+    return np.sort(day * DAY_MS + hour * HOUR_MS + rng.integers(0, HOUR_MS, len(day)))
+
+def write_rows(files, path, frame):
+    first = path not in files
+    frame.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+    files[path] = files.get(path, 0) + len(frame)
+
+def synthesize_users(seed, rows, output_dir, files):
+    offset = 0
+    for rng, days, counts in day_batches(seed, 'users', synthetic_users(rows)):
+        times = diurnal_times(rng, days, counts)
+        index = np.arange(offset, offset + len(times))
+        offset += len(times)
+        write_rows(files, os.path.join(output_dir, 'users.csv'), pd.DataFrame({
+            'id': synthetic_ids('users', index),
+            'role': np.asarray(SYNTHETIC_ROLE_CYCLE)[index % 20],
+            'created_at': iso_times(times)
+        }))
+
+def status_chain(rng, created):
+    # Stage times (created, assigned, in transit, delivered) and the
+    # cancellation time; stages after a cancellation never happen
+    never = np.iinfo(np.int64).max
+    n = len(created)
+    stages = np.empty((n, 4), dtype=np.int64)
+    stages[:, 0] = created
+    for stage, hours in enumerate(STAGE_HOURS, 1):
+        stages[:, stage] = stages[:, stage - 1] + rng.exponential(hours * HOUR_MS, n).astype(np.int64)
+    cancelled_at = np.full(n, never)
+    for stage, chance in enumerate(CANCEL_CHANCE):
+        cancel = (rng.random(n) < chance) & (cancelled_at == never)
+        cancelled_at[cancel] = stages[cancel, stage] + rng.exponential(2 * HOUR_MS, cancel.sum()).astype(np.int64)
+        stages[cancel, stage + 1:] = never
+    return stages, cancelled_at
+
+def queue_trips(stages, driver, busy):
+    # A driver carries one consignment at a time, so each trip waits for the
+    # driver's previous one: start'[i] = max(start[i], start'[i-1] + length[i-1]),
+    # which is a running max of start - (trip time before i) per driver.
+    # busy holds when each driver is next free and is carried across batches
+    never = np.iinfo(np.int64).max
+    trips = np.flatnonzero(stages[:, 2] != never)
+    order = trips[np.lexsort((stages[trips, 2], driver[trips]))]
+    who = driver[order]
+    start = stages[order, 2]
+    length = stages[order, 3] - start
+    first = np.r_[True, who[1:] != who[:-1]]
+    start[first] = np.maximum(start[first], busy[who[first]])
+    before = np.cumsum(length) - length
+    before -= before[first][np.cumsum(first) - 1]
+    # Drivers are kept apart by an offset larger than any time
+    offset = (np.cumsum(first) - 1) << 42
+    queued = np.maximum.accumulate(start - before + offset) - offset + before
+    shift = queued - stages[order, 2]
+    stages[order, 2] += shift
+    stages[order, 3] += shift
+    last = np.r_[who[1:] != who[:-1], True]
+    busy[who[last]] = queued[last] + length[last]
+
+def gps_traces(rng, start, end, arrive, pickup, dropoff):
+    # Points every TRACK_SECONDS (at most TRACK_MAX_POINTS per trip) from
+    # start to end, on a random walk pinned to pickup at start and to
+    # dropoff at arrive; returns (trip, time, lat, lon)
+    points = np.clip((end - start) // (TRACK_SECONDS * 1000), 2, TRACK_MAX_POINTS)
+    trip = np.repeat(np.arange(len(start)), points)
+    first = np.repeat(np.cumsum(points) - points, points)
+    step = np.arange(len(trip)) - first
+    times = start[trip] + (end - start)[trip] * step // (points[trip] - 1)
+    progress = (times - start[trip]) / np.maximum(arrive - start, 1)[trip]
+    walk = np.cumsum(rng.normal(0, TRACK_STEP_DEGREES, (len(trip), 2)), axis=0)
+    walk -= walk[first]
+    # Pin the walk to zero at arrival so the trace ends on the drop-off
+    final = np.cumsum(points) - 1
+    walk -= progress[:, None] * walk[final][trip]
+    position = pickup[trip] + progress[:, None] * (dropoff - pickup)[trip] + walk
+    return trip, times, position[:, 0], position[:, 1]
+
+def synthesize_consignments(seed, rows, output_dir, files):
+    users = synthetic_users(rows)
+    drivers, clients = users // 5, users * 3 // 5
+    categories = ROLLUP_TABLES['consignments']['categories']
+    busy = np.zeros(drivers, dtype=np.int64)
+    carried = None
+    offset = notes = 0
+    batches = list(day_batches(seed, 'consignments', rows))
+    for number, (rng, days, counts) in enumerate(batches):
+        created = diurnal_times(rng, days, counts)
+        n = len(created)
+        ids = synthetic_ids('consignments', np.arange(offset, offset + n))
+        offset += n
+        client = skewed_choice(rng, clients, n)
+        driver = rng.integers(0, drivers, n)
+        client_ids = synthetic_ids('users', role_users('client', client))
+        driver_ids = synthetic_ids('users', role_users('driver', driver))
+
+        stages, cancelled_at = status_chain(rng, created)
+        queue_trips(stages, driver, busy)
+        reached = stages <= SYNTHETIC_END_MS
+        cancelled = cancelled_at <= SYNTHETIC_END_MS
+        status = np.where(cancelled, categories.index('cancelled'), reached.sum(axis=1) - 1)
+        delivered = status == categories.index('delivered')
+        # Drivers work from one hub
+        hub = SYNTHETIC_HUBS[driver % len(SYNTHETIC_HUBS)]
+        pickup = hub + rng.normal(0, 0.05, (n, 2))
+        dropoff = hub + rng.normal(0, 0.15, (n, 2))
+
+        write_rows(files, os.path.join(output_dir, 'consignments.csv'), pd.DataFrame({
+            'id': ids,
+            'client_id': client_ids,
+            'driver_id': driver_ids.where(reached[:, 1], ''),
+            'status': np.asarray(categories)[status],
+            'created_at': iso_times(created),
+            'pickup_latitude': pickup[:, 0].round(6),
+            'pickup_longitude': pickup[:, 1].round(6),
+            'weight': rng.lognormal(3, 1, n).round(2),
+            'estimated_delivery_date': iso_times(created + 2 * DAY_MS),
+            'actual_delivery_date': iso_times(np.where(delivered, stages[:, 3], -1))
+        }))
+
+        # One history row per stage reached, then the cancellation
+        events = np.column_stack([reached, cancelled])
+        row, stage = np.nonzero(events)
+        stage_names = np.asarray(['pending', 'assigned', 'in_transit', 'delivered', 'cancelled'])
+        write_rows(files, os.path.join(output_dir, 'status_history.csv'), pd.DataFrame({
+            'consignment_id': ids.to_numpy()[row],
+            'status': stage_names[stage],
+            'timestamp': iso_times(np.column_stack([stages, cancelled_at])[row, stage]),
+            'client_id': client_ids.to_numpy()[row],
+            'driver_id': np.where(reached[row, 1], driver_ids.to_numpy()[row], '')
+        }))
+
+        # GPS from pickup until delivery (or until the end of the span),
+        # kept in time order across batches
+        moving = np.flatnonzero(reached[:, 2] & ~cancelled)
+        start, arrive = stages[moving, 2], stages[moving, 3]
+        end = np.minimum(arrive, SYNTHETIC_END_MS)
+        trip, times, lat, lon = gps_traces(rng, start, end, arrive, pickup[moving], dropoff[moving])
+        last = np.r_[trip[1:] != trip[:-1], True] & (times == arrive[trip])
+        points = pd.DataFrame({
+            'driver_id': driver_ids.to_numpy()[moving][trip],
+            'consignment_id': ids.to_numpy()[moving][trip],
+            'latitude': lat.round(6),
+            'longitude': lon.round(6),
+            'time': times,
+            'status': np.where(last, 'delivered', 'in_transit')
+        })
+        if carried is not None:
+            points = pd.concat([carried, points], ignore_index=True)
+        points = points.sort_values('time', kind='stable')
+        cutoff = batches[number + 1][1][0] * DAY_MS if number + 1 < len(batches) else np.iinfo(np.int64).max
+        due = points['time'].to_numpy() < cutoff
+        carried = points[~due]
+        points = points[due]
+        write_rows(files, os.path.join(output_dir, 'tracking_logs.csv'), pd.DataFrame({
+            'driver_id': points['driver_id'],
+            'consignment_id': points['consignment_id'],
+            'latitude': points['latitude'],
+            'longitude': points['longitude'],
+            'timestamp': iso_times(points['time'].to_numpy()),
+            'status': points['status']
+        }))
+
+        # A delivery note for every delivered consignment; the customer is
+        # the consignment's client, so --client matches notes and
+        # consignments alike, and keeps its name across notes
+        done = np.flatnonzero(delivered)
+        note_status = rng.choice(list(NOTE_STATUS_CHANCE), size=len(done), p=list(NOTE_STATUS_CHANCE.values()))
+        who = client[done]
+        names = (np.asarray(FIRST_NAMES)[who % len(FIRST_NAMES)].astype(object) + ' ' +
+                 np.asarray(LAST_NAMES)[(who // len(FIRST_NAMES)) % len(LAST_NAMES)])
+        addresses = (pd.Series(rng.integers(1, 400, len(done))).astype(str) + ' ' +
+                     np.asarray(STREETS)[rng.integers(0, len(STREETS), len(done))] + ', ' +
+                     np.asarray(TOWNS)[rng.integers(0, len(TOWNS), len(done))])
+        write_rows(files, os.path.join(output_dir, 'delivery_notes.csv'), pd.DataFrame({
+            'id': synthetic_ids('delivery_notes', np.arange(notes, notes + len(done))),
+            'driver_id': driver_ids.to_numpy()[done],
+            'customer_id': client_ids.to_numpy()[done],
+            'customer_name': names,
+            'delivery_address': addresses.to_numpy(),
+            'status': note_status,
+            'notes': np.asarray(NOTE_REMARKS)[rng.integers(0, len(NOTE_REMARKS), len(done))],
+            'consignment_id': ids.to_numpy()[done],
+            'created_at': iso_times(stages[done, 3])
+        }))
+        notes += len(done)
+
+def synthesize_chat(seed, rows, output_dir, files):
+    # Two-person rooms: a client with a driver, or with support
+    users = synthetic_users(rows)
+    clients, drivers, admins = users * 3 // 5, users // 5, users // 20
+    rng = np.random.default_rng([seed, SYNTHETIC_GROUPS.index('chat')])
+    rooms = clients
+    support = rng.random(rooms) < 0.1
+    members = np.column_stack([
+        role_users('client', np.arange(rooms)),
+        np.where(support, role_users('admin', rng.integers(0, admins, rooms)),
+                 role_users('driver', rng.integers(0, drivers, rooms)))
+    ])
+    room_ids = synthetic_ids('rooms', np.arange(rooms)).to_numpy()
+    write_rows(files, os.path.join(output_dir, 'chat_room_participants.csv'), pd.DataFrame({
+        'room_id': np.repeat(room_ids, 2),
+        'user_id': synthetic_ids('users', members.ravel())
+    }))
+
+    offset = 0
+    for rng, days, counts in day_batches(seed, 'chat', int(rows * SYNTHETIC_RATIOS['chat'])):
+        times = diurnal_times(rng, days, counts)
+        room = skewed_choice(rng, rooms, len(times))
+        sender = members[room, rng.integers(0, 2, len(times))]
+        write_rows(files, os.path.join(output_dir, 'chat_messages.csv'), pd.DataFrame({
+            'id': synthetic_ids('messages', np.arange(offset, offset + len(times))),
+            'room_id': room_ids[room],
+            'sender_id': synthetic_ids('users', sender),
+            'message_type': rng.choice(['text', 'image', 'file', 'system'], len(times), p=[0.9, 0.06, 0.02, 0.02]),
+            'created_at': iso_times(times)
+        }))
+        offset += len(times)
+
+def synthesize_fuel(seed, rows, output_dir, files):
+    drivers = synthetic_users(rows) // 5
+    balance = np.full(drivers, 50_000, dtype=np.int64)  # cents, carried across batches
+    offset = 0
+    for rng, days, counts in day_batches(seed, 'fuel', int(rows * SYNTHETIC_RATIOS['fuel'])):
+        times = diurnal_times(rng, days, counts)
+        n = len(times)
+        driver = rng.integers(0, drivers, n)
+        kind = rng.choice(list(FUEL_TYPES), n, p=list(FUEL_TYPES.values()))
+        credit = kind == 'topup'
+        amount = np.where(credit, rng.integers(4, 20, n) * 5_000, rng.gamma(2, 2_500, n).astype(np.int64) + 500)
+        signed = np.where(credit, amount, -amount)
+
+        # Running balance per driver in time order: a stable sort by driver
+        # and a cumulative sum restarted at each driver
+        order = np.argsort(driver, kind='stable')
+        ordered = signed[order]
+        total = np.cumsum(ordered) - ordered
+        starts = np.r_[True, driver[order][1:] != driver[order][:-1]]
+        base = total[starts][np.cumsum(starts) - 1]
+        before = np.empty(n, dtype=np.int64)
+        before[order] = balance[driver[order]] + total - base
+        after = before + signed
+        after[rng.random(n) < FUEL_MISMATCH_CHANCE] += 1_000
+        balance += np.bincount(driver, weights=signed, minlength=drivers).astype(np.int64)
+
+        write_rows(files, os.path.join(output_dir, 'fuel_transactions.csv'), pd.DataFrame({
+            'id': synthetic_ids('fuel', np.arange(offset, offset + n)),
+            'fuel_card_id': synthetic_ids('cards', driver),
+            'driver_id': synthetic_ids('users', role_users('driver', driver)),
+            'transaction_date': iso_times(times),
+            'type': kind,
+            'amount': amount / 100,
+            'balance_before': before / 100,
+            'balance_after': after / 100,
+            'status': 'completed'
+        }))
+        offset += n
+
+SYNTHESIZERS = {'users': synthesize_users, 'consignments': synthesize_consignments,
+                'chat': synthesize_chat, 'fuel': synthesize_fuel}
+
+def synthesize_group(task):
+    group, seed, rows, output_dir = task
+    files = {}
+    SYNTHESIZERS[group](seed, rows, output_dir, files)
+    return list(files.items())
+
+def synthesize_exports(output_dir, rows, seed, jobs=None):
+    # Yields (path, rows) for every file written; table groups run in parallel
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(group, seed, rows, output_dir) for group in SYNTHETIC_GROUPS]
+    for files in stream_tasks(synthesize_group, tasks, min(jobs or os.cpu_count() or 1, len(tasks))):
+        yield from files
+
+# DIAGRAM REGISTRY
+# Output name -> (function, progress message), in generation order
+DIAGRAMS = {
+    'system_architecture': (create_system_architecture, "✅ System Architecture diagram created"),
+    'database_schema': (create_database_schema, "✅ Database Schema diagram created"),
+    'security_architecture': (create_security_architecture, "✅ Security Architecture diagram created"),
+    'user_privilege_matrix': (create_user_privilege_matrix, "✅ User Privilege Matrix created"),
+    'system_evaluation': (create_system_evaluation, "✅ System Evaluation Dashboard created"),
+    'ui_mockup': (create_ui_mockup, "✅ UI Mockup designs created"),
+    'file_structure': (create_file_structure, "✅ File Structure diagram created"),
+    'system_flow_simple': (create_system_flow_simple, "✅ Simple System Flow created"),
+    'data_flow_diagram': (create_data_flow_diagram, "✅ Data Flow Diagram created"),
+    'deployment_architecture': (create_deployment_architecture, "✅ Deployment Architecture created"),
+    'user_manual': (create_user_manual, "✅ User Manual created"),
+    'communication_flow': (create_communication_flow, "✅ Communication Flow diagram created"),
+    'system_lifecycle': (create_system_lifecycle, "✅ System Lifecycle diagram created"),
+    'fuel_analytics': (create_fuel_analytics, "✅ Fuel Analytics diagram created"),
+    'route_map': (create_route_map, "✅ Driver Route Map created"),
+    'eta_accuracy': (create_eta_accuracy, "✅ ETA Accuracy diagram created"),
+    'driver_assignment': (create_driver_assignment, "✅ Driver Assignment diagram created"),
+    'status_transitions': (create_status_transitions, "✅ Status Transitions diagram created"),
+    'schema_diff': (create_schema_diff, "✅ Schema Diff diagram created")
+}
+
+# Diagrams drawn purely from exports; they are only generated when every
+# RENDER_CONFIG input they read has been given
+DATA_DIAGRAMS = {
+    'fuel_analytics': ('fuel_export',),
+    'route_map': ('tracking_export',),
+    'eta_accuracy': ('tracking_export',),
+    'driver_assignment': ('consignments_export', 'tracking_export'),
+    'status_transitions': ('status_history',),
+    'schema_diff': ('migrations',)
+}
+
+# BATCH RENDERING
+# Tenants x diagrams are rendered in one process pool. Workers stay warm
+# between tasks, so fonts, template fragments and parsed inputs are loaded
+# once per worker and reused for every tenant it renders.
+def warm_worker(config):
+    RENDER_CONFIG.update(config)
+    RENDER_CONFIG['show'] = False
+    apply_memory_budget()
+    if RENDER_CONFIG['preview']:
+        plt.rcParams.update(PREVIEW_RC)
+    for weight in ('normal', 'bold'):
+        findfont(FontProperties(weight=weight))
+    findfont(FontProperties(family='monospace'))
+
+def render_task(task):
+    name, brand, output_dir = task
+    RENDER_CONFIG['brand'] = brand
+    RENDER_CONFIG['output_dir'] = output_dir
+    del _variant_log[:]
+    governed(name, DIAGRAMS[name][0])
+    return name, brand['name'] if brand else None, list(_variant_log)
+
+def render_tasks(tasks, jobs=None, chunksize=1):
+    # Yields (diagram, brand name, variant entries) as tasks finish; a single
+    # job renders in this process without the pool's startup cost
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        warm_worker(dict(RENDER_CONFIG))
+        for task in tasks:
+            yield render_task(task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=warm_worker,
+                             initargs=(dict(RENDER_CONFIG),)) as pool:
+        yield from pool.map(render_task, tasks, chunksize=chunksize)
+
+def stream_tasks(function, tasks, jobs=None):
+    # function(task) for a stream of tasks on the same warm workers, results
+    # in task order. At most 2 x jobs tasks are in flight, so tasks built
+    # from an export are never all held in memory.
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        warm_worker(dict(RENDER_CONFIG))
+        for task in tasks:
+            yield function(task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=warm_worker,
+                             initargs=(dict(RENDER_CONFIG),)) as pool:
+        pending = deque()
+        for task in tasks:
+            if len(pending) == 2 * jobs:
+                yield pending.popleft().result()
+            pending.append(pool.submit(function, task))
+        while pending:
+            yield pending.popleft().result()
+
+def render_brands(brands, names, output_root, jobs=None):
+    # Diagram-major order keeps each worker on one diagram across tenants,
+    # so its templates and inputs are reused instead of rebuilt
+    tasks = [(name, brand, os.path.join(output_root, brand['name']))
+             for name in names for brand in brands]
+    variant_entries = []
+    for done, (name, brand_name, entries) in enumerate(
+            render_tasks(tasks, jobs, chunksize=max(1, len(brands))), 1):
+        variant_entries.extend(entries)
+        print(f"[{done}/{len(tasks)}] {brand_name}: {name}.png")
+    write_variant_manifests(variant_entries)
+
+# PREVIEW MODE
+# Low DPI, no bbox_inches='tight' second pass and no antialiasing on shapes,
+# followed by a static gallery page, so a layout change can be checked across
+# every diagram in a couple of seconds.
+PREVIEW_DPI = 60
+PREVIEW_RC = {
+    'lines.antialiased': False,
+    'patch.antialiased': False,
+    'path.simplify': True,
+    'path.simplify_threshold': 1.0
+}
+
+def render_preview(names, output_dir, jobs=None):
+    preview_dir = os.path.join(output_dir, 'preview')
+    RENDER_CONFIG.update({
+        'preview': True,
+        'dpi': PREVIEW_DPI,
+        'bbox_inches': None,
+        'show': False,
+        'variants': ['thumb']
+    })
+    plt.rcParams.update(PREVIEW_RC)
+
+    entries = []
+    for name, _, diagram_entries in render_tasks([(name, None, preview_dir) for name in names], jobs):
+        entries.extend(diagram_entries)
+        print(f"👀 {name} preview created")
+    write_variant_manifests(entries)
+    return write_gallery(preview_dir, output_dir, entries)
+
+def write_gallery(preview_dir, full_dir, entries):
+    # One card per file written, so every page of a multi-page diagram and
+    # every --focus view shows up under its own file name
+    cards = []
+    for thumb in entries:
+        name = thumb['diagram']
+        # Link to the full render when one exists, otherwise to the preview
+        full_path = os.path.join(full_dir, name + '.png')
+        if not os.path.exists(full_path):
+            full_path = os.path.join(preview_dir, name + '.png')
+        href = os.path.relpath(full_path, preview_dir).replace(os.sep, '/')
+        cards.append(
+            f'<figure><a href="{html.escape(href)}">'
+            f'<img src="{html.escape(thumb["file"].replace(os.sep, "/"))}" loading="lazy" '
+            f'width="{thumb["width"]}" height="{thumb["height"]}" alt="{html.escape(name)}"></a>'
+            f'<figcaption>{html.escape(name)}</figcaption></figure>'
+        )
+
+    page = (
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        '<title>Logistics diagrams preview</title>\n<style>\n'
+        'body { font-family: sans-serif; margin: 24px; background: #f5f6fa; }\n'
+        'main { display: grid; grid-template-columns: repeat(auto-fill, minmax(340px, 1fr)); gap: 16px; }\n'
+        'figure { margin: 0; padding: 10px; background: white; border: 1px solid #dcdde1; }\n'
+        'img { max-width: 100%; height: auto; }\n'
+        'figcaption { margin-top: 6px; font-weight: bold; }\n'
+        '</style>\n</head>\n<body>\n<h1>Logistics diagrams preview</h1>\n<main>\n'
+        + '\n'.join(cards) +
+        '\n</main>\n</body>\n</html>\n'
+    )
+    path = os.path.join(preview_dir, 'index.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    return path
+
+def run_diagrams(names):
+    for name in names:
+        function, message = DIAGRAMS[name]
+        governed(name, function)
+        print(message)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the logistics system documentation diagrams.')
+    parser.add_argument('--only', help='comma-separated diagram names to generate (default: all)')
+    parser.add_argument('--output-dir', default='.', help='directory the PNG files are written to')
+    parser.add_argument('--brands', help='JSON file with one brand spec or a list of them; renders every diagram per brand')
+    parser.add_argument('--jobs', type=int, help='worker processes for batch and preview rendering (default: CPU count)')
+    parser.add_argument('--variants', nargs='?', const=','.join(VARIANTS),
+                        help=f"export size variants from each render ({', '.join(VARIANTS)}; default: all)")
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help='memory cap of each rendering process; an allocation past it stops the diagram with '
+                             'a report, and canvases are saved at a lower DPI to fit what is left')
+    parser.add_argument('--max-artists', type=int, default=RENDER_CONFIG['max_artists'],
+                        help=f"artists per diagram before lines and patches are merged into collections "
+                             f"(default: {RENDER_CONFIG['max_artists']:,})")
+    parser.add_argument('--max-pixels', type=float, default=RENDER_CONFIG['max_pixels'], metavar='MP',
+                        help=f"canvas megapixels per diagram before the DPI is lowered "
+                             f"(default: {RENDER_CONFIG['max_pixels']})")
+    parser.add_argument('--over-budget', choices=['downgrade', 'fail'], default=RENDER_CONFIG['over_budget'],
+                        help='downgrade a diagram that exceeds a budget, or stop with a report (default: downgrade)')
+    parser.add_argument('--preview', action='store_true',
+                        help='fast low-DPI renders of every diagram plus an HTML gallery in <output-dir>/preview/')
+    parser.add_argument('--status-history',
+                        help='CSV export of consignment status changes (consignment_id, status, timestamp); '
+                             'annotates the lifecycle diagram with measured stage times and draws the '
+                             'status transitions diagram')
+    parser.add_argument('--chat-export',
+                        help='CSV export of messages or chat_messages, in created_at order; '
+                             'weights the communication flow diagram by real traffic')
+    parser.add_argument('--chat-users', help='CSV export of users (id, role), required with --chat-export')
+    parser.add_argument('--chat-participants',
+                        help='CSV export of chat_room_participants (room_id, user_id), '
+                             'required when the chat export has no receiver_id column')
+    parser.add_argument('--fuel-export',
+                        help='CSV export of fuel_transactions; adds the fuel analytics diagram')
+    parser.add_argument('--rollup-store',
+                        help='directory of the local rollup store the evaluation dashboard reads')
+    parser.add_argument('--ingest', action='append', default=[], metavar='TABLE=CSV',
+                        help=f"append an export to the rollup store ({', '.join(ROLLUP_TABLES)}); may be repeated")
+    parser.add_argument('--tracking-export',
+                        help='CSV export of tracking_logs in timestamp order; adds the driver route map')
+    parser.add_argument('--bbox', metavar='WEST,SOUTH,EAST,NORTH',
+                        help='route map bounding box in degrees (default: all points)')
+    parser.add_argument('--consignments-export',
+                        help='CSV export of consignments with pickup coordinates; with --tracking-export '
+                             'adds the driver assignment diagram')
+    parser.add_argument('--policies', nargs='+', metavar='SQL',
+                        help='SQL files replayed in order for the user privilege matrix '
+                             f"(default: {' '.join(POLICY_FILES)} next to this script)")
+    parser.add_argument('--schema', nargs='+', metavar='SQL',
+                        help='SQL files whose CREATE TABLE statements replace the built-in tables of the '
+                             'database schema diagram; large schemas are packed onto several pages')
+    parser.add_argument('--focus', nargs='+', metavar='TABLE',
+                        help="draw the database schema only around these tables, one diagram each "
+                             "(database_schema_<table>.png); 'all' draws one per table")
+    parser.add_argument('--depth', type=int, default=2, help='foreign key hops shown around --focus tables (default: 2)')
+    parser.add_argument('--migrations', nargs='+', metavar='SQL',
+                        help='SQL files replayed in order into a schema model; adds the schema diff diagram of '
+                             'what the last file changed')
+    parser.add_argument('--diff-from', metavar='SQL',
+                        help='one of --migrations; the schema diff shows every change made after it')
+    parser.add_argument('--delivery-notes', metavar='CSV',
+                        help='write delivery note PDFs from a delivery_notes export into '
+                             '<output-dir>/delivery_notes/ instead of diagrams')
+    parser.add_argument('--client-reports', metavar='YYYY-MM',
+                        help='write the evaluation dashboard of this month for every client in '
+                             '--consignments-export into <output-dir>/client_reports/YYYY-MM/ instead of diagrams')
+    parser.add_argument('--synthesize', metavar='DIR',
+                        help='write deterministic synthetic exports (users, consignments, status history, tracking '
+                             'logs, delivery notes, chat, fuel) into DIR instead of diagrams')
+    parser.add_argument('--rows', type=int, default=100_000,
+                        help='consignments in the synthetic exports; the other tables scale with it (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic exports (default: 0)')
+    parser.add_argument('--playback', choices=PLAYBACK_FORMATS,
+                        help='write an animated replay of driver positions from --tracking-export instead of diagrams')
+    parser.add_argument('--live', metavar='SOURCE',
+                        help='keep the evaluation dashboard current from a realtime event stream: a JSONL file '
+                             'that is followed as it grows, or tcp://host:port sending one JSON event per line')
+    parser.add_argument('--frames', type=int, default=1200, help='playback frames (default: 1200)')
+    parser.add_argument('--fps', type=int, default=24,
+                        help='playback frames per second, or the live dashboard redraw limit (default: 24)')
+    parser.add_argument('--from', dest='since', metavar='DATE',
+                        help='only data at or after this date/time (YYYY-MM-DD or ISO 8601)')
+    parser.add_argument('--to', dest='until', metavar='DATE',
+                        help='only data before the end of this date, or before this ISO 8601 time')
+    parser.add_argument('--client', help='only data for this client id')
+    parser.add_argument('--driver', help='only data for this driver id')
+    parser.add_argument('--no-show', action='store_true', help='do not open a window for each diagram')
+    args = parser.parse_args(argv)
+
+    args.names = [name for name in DIAGRAMS
+                  if all(getattr(args, key) for key in DATA_DIAGRAMS.get(name, ()))]
+    if args.only:
+        args.names = [name.strip() for name in args.only.split(',') if name.strip()]
+        unknown = [name for name in args.names if name not in DIAGRAMS]
+        if unknown:
+            parser.error(f"unknown diagram(s): {', '.join(unknown)}")
+        missing = [f"{name} needs --{key.replace('_', '-')}" for name in args.names
+                   for key in DATA_DIAGRAMS.get(name, ()) if not getattr(args, key)]
+        if missing:
+            parser.error(', '.join(missing))
+
+    if args.focus:
+        if args.depth < 0:
+            parser.error('--depth must be 0 or more')
+        if not args.only:
+            args.names = ['database_schema']
+        elif 'database_schema' not in args.names:
+            parser.error('--focus needs the database_schema diagram')
+
+    if args.diff_from:
+        matches = [path for path in args.migrations or []
+                   if os.path.abspath(path) == os.path.abspath(args.diff_from)]
+        if not matches:
+            parser.error('--diff-from must be one of the --migrations files')
+        args.diff_from = matches[0]
+
+    ingests = []
+    for item in args.ingest:
+        table, _, path = item.partition('=')
+        if table not in ROLLUP_TABLES or not path:
+            parser.error(f"--ingest expects TABLE=CSV with TABLE one of {', '.join(ROLLUP_TABLES)}")
+        ingests.append((table, path))
+    args.ingest = ingests
+    if args.ingest and not args.rollup_store:
+        parser.error('--ingest needs --rollup-store')
+
+    if args.bbox:
+        try:
+            args.bbox = tuple(float(value) for value in args.bbox.split(','))
+        except ValueError:
+            args.bbox = ()
+        if len(args.bbox) != 4 or args.bbox[0] >= args.bbox[2] or args.bbox[1] >= args.bbox[3]:
+            parser.error('--bbox expects WEST,SOUTH,EAST,NORTH in degrees')
+
+    args.filters = {}
+    label = []
+    try:
+        if args.since:
+            args.filters['since'] = parse_time_bound(args.since)
+        if args.until:
+            args.filters['until'] = parse_time_bound(args.until, end=True)
+    except ValueError:
+        parser.error('--from/--to expect YYYY-MM-DD or an ISO 8601 time')
+    if args.since or args.until:
+        label.append(f"{args.since or '…'} → {args.until or '…'}")
+    for name in ('client', 'driver'):
+        value = getattr(args, name)
+        if value:
+            args.filters[name] = hash_id(value)
+            label.append(f'{name} {value[:8]}')
+    if label:
+        args.filters['label'] = ' · '.join(label)
+
+    if args.chat_export and not args.chat_users:
+        parser.error('--chat-export needs --chat-users to resolve sender and receiver roles')
+
+    if args.playback and not args.tracking_export:
+        parser.error('--playback needs --tracking-export')
+    if args.frames < 2 or args.fps < 1:
+        parser.error('--frames must be at least 2 and --fps at least 1')
+
+    if args.delivery_notes and (args.playback or args.preview):
+        parser.error('--delivery-notes cannot be combined with --playback or --preview')
+
+    if args.client_reports:
+        if not re.fullmatch(r'\d{4}-\d{2}', args.client_reports) or not 1 <= int(args.client_reports[5:]) <= 12:
+            parser.error('--client-reports expects a month as YYYY-MM')
+        if not args.consignments_export:
+            parser.error('--client-reports needs --consignments-export')
+        if args.since or args.until:
+            parser.error('--client-reports sets its own time window; drop --from/--to')
+        if args.playback or args.preview or args.delivery_notes:
+            parser.error('--client-reports cannot be combined with --playback, --preview or --delivery-notes')
+
+    if (args.memory_budget is not None and args.memory_budget < 1) or args.max_artists < 1 or args.max_pixels <= 0:
+        parser.error('--memory-budget, --max-artists and --max-pixels must be positive')
+
+    if args.synthesize:
+        if args.rows < 1 or args.seed < 0:
+            parser.error('--rows must be at least 1 and --seed not negative')
+        if args.playback or args.preview or args.delivery_notes or args.client_reports or args.live:
+            parser.error('--synthesize cannot be combined with --playback, --preview, --delivery-notes, '
+                         '--client-reports or --live')
+
+    if args.live:
+        if not args.live.startswith('tcp://') and not os.path.isfile(args.live):
+            parser.error(f'--live: no such event file: {args.live}')
+        if args.playback or args.preview or args.delivery_notes or args.client_reports or args.brands:
+            parser.error('--live cannot be combined with --playback, --preview, --delivery-notes, '
+                         '--client-reports or --brands')
+
+    if args.preview and (args.brands or args.variants):
+        parser.error('--preview cannot be combined with --brands or --variants')
+
+    if args.variants:
+        args.variants = [name.strip() for name in args.variants.split(',') if name.strip()]
+        unknown = [name for name in args.variants if name not in VARIANTS]
+        if unknown:
+            parser.error(f"unknown variant(s): {', '.join(unknown)}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    RENDER_CONFIG['output_dir'] = args.output_dir
+    RENDER_CONFIG['show'] = not args.no_show
+    RENDER_CONFIG['variants'] = args.variants
+    RENDER_CONFIG['status_history'] = args.status_history
+    RENDER_CONFIG['chat_export'] = args.chat_export
+    RENDER_CONFIG['chat_users'] = args.chat_users
+    RENDER_CONFIG['chat_participants'] = args.chat_participants
+    RENDER_CONFIG['fuel_export'] = args.fuel_export
+    RENDER_CONFIG['rollup_store'] = args.rollup_store
+    RENDER_CONFIG['filters'] = args.filters
+    RENDER_CONFIG['tracking_export'] = args.tracking_export
+    RENDER_CONFIG['bbox'] = args.bbox
+    RENDER_CONFIG['consignments_export'] = args.consignments_export
+    RENDER_CONFIG['policy_files'] = args.policies
+    RENDER_CONFIG['schema_files'] = args.schema
+    RENDER_CONFIG['schema_focus'] = args.focus
+    RENDER_CONFIG['schema_depth'] = args.depth
+    RENDER_CONFIG['migrations'] = args.migrations
+    RENDER_CONFIG['diff_from'] = args.diff_from
+    RENDER_CONFIG['report_month'] = args.client_reports
+    RENDER_CONFIG['memory_budget'] = args.memory_budget
+    RENDER_CONFIG['max_artists'] = args.max_artists
+    RENDER_CONFIG['max_pixels'] = args.max_pixels
+    RENDER_CONFIG['over_budget'] = args.over_budget
+    apply_memory_budget()
+
+    for table, path in args.ingest:
+        result = ingest_export(args.rollup_store, table, path)
+        if result is None:
+            print(f"📥 {path}: already ingested")
+        else:
+            rows, skipped = result
+            print(f"📥 {path}: {rows:,} new {table} rows in {args.rollup_store}"
+                  + (f" ({skipped:,} at or before its watermark skipped)" if skipped else ''))
+
+    if args.playback:
+        path = render_playback(args.playback, args.output_dir, args.frames, args.fps)
+        print(f"🎬 Playback written to {path}")
+        return
+
+    if args.synthesize:
+        total = 0
+        for path, rows in synthesize_exports(args.synthesize, args.rows, args.seed, args.jobs):
+            total += rows
+            print(f"🧪 {path}: {rows:,} rows")
+        print(f"\n🧪 {total:,} synthetic rows in {args.synthesize}")
+        return
+
+    if args.live:
+        events = run_live_dashboard(args.live, args.output_dir, args.fps)
+        print(f"📡 Live dashboard stopped after {events:,} events")
+        return
+
+    if args.delivery_notes:
+        for brand in load_brands(args.brands) if args.brands else [None]:
+            RENDER_CONFIG['brand'] = brand
+            output_dir = os.path.join(args.output_dir, brand['name']) if brand else args.output_dir
+            files = notes = 0
+            for path, count in render_delivery_notes(args.delivery_notes, output_dir, args.jobs):
+                files += 1
+                notes += count
+                print(f"🧾 {path}: {count:,} notes")
+            print(f"\n🧾 {notes:,} delivery notes in {files} PDF(s) in {os.path.join(output_dir, 'delivery_notes')}")
+        return
+
+    if args.client_reports:
+        for brand in load_brands(args.brands) if args.brands else [None]:
+            RENDER_CONFIG['brand'] = brand
+            output_dir = os.path.join(args.output_dir, brand['name']) if brand else args.output_dir
+            done = 0
+            for done, total, client, path in render_client_reports(args.consignments_export, args.client_reports,
+                                                                   output_dir, args.jobs):
+                print(f"[{done}/{total}] {client}: {path}")
+            print(f"\n📊 {done:,} client reports for {args.client_reports} in "
+                  f"{os.path.join(output_dir, 'client_reports', args.client_reports)}")
+        return
+
+    if args.preview:
+        gallery = render_preview(args.names, args.output_dir, args.jobs)
+        print(f"\n🖼️  Preview gallery: {gallery}")
+        return
+
+    if args.brands:
+        brands = load_brands(args.brands)
+        print(f"Generating {len(args.names)} diagrams for {len(brands)} brands...")
+        render_brands(brands, args.names, args.output_dir, args.jobs)
+        print(f"\n🎉 Branded diagrams written to {args.output_dir}/<brand name>/")
+        return
 
-# Execute all visualization functions
-if __name__ == "__main__":
     print("Generating comprehensive logistics system documentation...")
     
     # Generate all diagrams
-    create_system_architecture()
-    print("✅ System Architecture diagram created")
-    
-    create_database_schema()
-    print("✅ Database Schema diagram created")
-    
-    create_security_architecture()
-    print("✅ Security Architecture diagram created")
-    
-    create_user_privilege_matrix()
-    print("✅ User Privilege Matrix created")
-    
-    create_system_evaluation()
-    print("✅ System Evaluation Dashboard created")
-    
-    create_ui_mockup()
-    print("✅ UI Mockup designs created")
-    
-    create_file_structure()
-    print("✅ File Structure diagram created")
-    
-    create_system_flow_simple()
-    print("✅ Simple System Flow created")
-    
-    create_data_flow_diagram()
-    print("✅ Data Flow Diagram created")
-    
-    create_deployment_architecture()
-    print("✅ Deployment Architecture created")
-    
-    create_user_manual()
-    print("✅ User Manual created")
-    
-    create_communication_flow()
-    print("✅ Communication Flow diagram created")
-    
-    create_system_lifecycle()
-    print("✅ System Lifecycle diagram created")
+    run_diagrams(args.names)
+    write_variant_manifests(_variant_log)
     
     print("\n🎉 All documentation diagrams have been generated successfully!")
     print("📁 Check your current directory for the following PNG files:")
-    print("   • system_architecture.png")
-    print("   • database_schema.png")
-    print("   • security_architecture.png")
-    print("   • user_privilege_matrix.png")
-    print("   • system_evaluation.png")
-    print("   • ui_mockup.png")
-    print("   • file_structure.png")
-    print("   • system_flow_simple.png")
-    print("   • data_flow_diagram.png")
-    print("   • deployment_architecture.png")
-    print("   • user_manual.png")
-    print("   • communication_flow.png")
-    print("   • system_lifecycle.png")
+    for name in args.names:
+        print(f"   • {name}.png")
     
     # Summary report
     print("\n📋 SYSTEM DOCUMENTATION SUMMARY:")
@@ -1544,5 +6786,6 @@ if __name__ == "__main__":
     print("🔄 Status: Ready for development implementation")
     print("=" * 50)
 
-
-
+# Execute all visualization functions
+if __name__ == "__main__":
+    main()
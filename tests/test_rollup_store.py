@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import arc
+
+
+def write_export(path, column, hours):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'driver_id,{column}\n')
+        for hour in hours:
+            f.write(f'd1,2025-01-01T{hour:02d}:00:00Z\n')
+    return str(path)
+
+
+def total(store):
+    return int(arc.query_rollup(store, 'activity', {})['count'].sum())
+
+
+def test_two_sources_into_one_table(tmp_path):
+    store = str(tmp_path / 'store')
+    tracking = write_export(tmp_path / 'tracking_logs.csv', 'timestamp', [10, 11, 12])
+    # Older than everything in the tracking export
+    chat = write_export(tmp_path / 'chat_messages.csv', 'created_at', [1, 2])
+
+    assert arc.ingest_export(store, 'activity', tracking) == (3, 0)
+    assert arc.ingest_export(store, 'activity', chat) == (2, 0)
+    assert total(store) == 5
+    assert arc.ingest_export(store, 'activity', chat) is None
+
+
+def test_cumulative_export_adds_only_new_rows(tmp_path):
+    store = str(tmp_path / 'store')
+    path = tmp_path / 'tracking_logs.csv'
+    arc.ingest_export(store, 'activity', write_export(path, 'timestamp', [10, 11]))
+    # Re-exported with one more row tied on the watermark and one after it
+    rows, skipped = arc.ingest_export(store, 'activity', write_export(path, 'timestamp', [10, 11, 11, 12]))
+
+    assert (rows, skipped) == (2, 2)
+    assert total(store) == 4
+    hours = arc.query_rollup(store, 'activity', {})
+    assert np.array_equal(hours['count'], [1, 2, 1])
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import arc
+
+
+def write_history(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('consignment_id,status,timestamp,client_id,driver_id\n')
+        for consignment, status, hour, client, driver in rows:
+            f.write(f'{consignment},{status},2025-01-01T{hour:02d}:00:00Z,{client},{driver}\n')
+    return str(path)
+
+
+def test_driver_filter_keeps_pending_events(tmp_path):
+    # The driver is only known from the assigned event on
+    path = write_history(tmp_path / 'status_history.csv', [
+        ('c1', 'pending', 1, 'k1', ''),
+        ('c2', 'pending', 1, 'k1', ''),
+        ('c1', 'assigned', 3, 'k1', 'd1'),
+        ('c2', 'assigned', 2, 'k1', 'd2'),
+        ('c1', 'delivered', 7, 'k1', 'd1'),
+    ])
+    filters = {'driver': arc.hash_id('d1')}
+
+    stages = arc.lifecycle_durations(path, filters)
+    assert sorted(stages) == [2, 7]
+    assert stages[2]['count'] == 1
+    assert abs(stages[2]['p50'] - 2 * 3600) < 0.02 * 2 * 3600
+
+    transitions = arc.transition_counts(path, filters)
+    statuses = transitions['statuses']
+    assert transitions['consignments'] == 1
+    assert transitions['counts'][statuses.index('pending'), statuses.index('assigned')] == 1